@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+_path = os.path.dirname(os.path.realpath(__file__))
+_hooks = os.path.abspath(os.path.join(_path, '../hooks'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+_add_path(_hooks)
+
+
+import json
+
+from charmhelpers.core import hookenv
+from nova_compute_cpu import (
+    cpu_partition,
+    cpu_partitioning_enabled,
+    node_cores,
+)
+from nova_compute_facts import format_cpu_list
+
+
+def cpu_topology_report():
+    '''Action to report the cores of every NUMA node and the shared and
+    dedicated CPU sets computed from them.
+    '''
+    host_cores = (hookenv.action_get('host-cores') or
+                  hookenv.config('cpu-host-cores'))
+    topology = {
+        'node{}'.format(node): [format_cpu_list(core) for core in cores]
+        for node, cores in node_cores().items()}
+    outmap = {
+        'auto': cpu_partitioning_enabled(hookenv.config('cpu-dedicated-set')),
+        'topology': json.dumps(topology, indent=2, sort_keys=True),
+    }
+    try:
+        partition = cpu_partition(host_cores)
+    except ValueError as e:
+        hookenv.action_fail('Could not partition the CPUs: {}'.format(e))
+        return
+    outmap['cpu-shared-set'] = format_cpu_list(partition['shared'])
+    outmap['cpu-dedicated-set'] = format_cpu_list(partition['dedicated'])
+    outmap['nodes'] = json.dumps(
+        {'node{}'.format(node): {name: format_cpu_list(cpus)
+                                 for name, cpus in sets.items()}
+         for node, sets in partition['nodes'].items()},
+        indent=2, sort_keys=True)
+    hookenv.action_set(outmap)
+
+if __name__ == '__main__':
+    cpu_topology_report()
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+_path = os.path.dirname(os.path.realpath(__file__))
+_hooks = os.path.abspath(os.path.join(_path, '../hooks'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+_add_path(_hooks)
+
+
+from charmhelpers.core import hookenv
+import nova_compute_trace as trace
+
+
+def hook_trace_report():
+    '''Action to report the slowest subprocess calls and per hook totals
+    from the recorded hook traces.
+    '''
+    top = hookenv.action_get('top') or 10
+    hook = hookenv.action_get('hook') or None
+    traces = trace.load_traces()
+    if not traces:
+        hookenv.action_fail(
+            'No hook traces found; enable them with the hook-trace option')
+        return
+    slowest = [
+        '{:9.3f}s  rc={}  {}  {}  {}'.format(
+            call['duration'], call['returncode'], hook_name,
+            call['caller'], call['command'])
+        for hook_name, call in trace.slowest_calls(traces, top, hook)]
+    totals = [
+        '{}: {} runs, {:.3f}s total, {:.3f}s in {} subprocess calls'.format(
+            name, t['runs'], t['duration'], t['subprocess'], t['calls'])
+        for name, t in sorted(trace.hook_totals(traces, hook).items(),
+                              key=lambda nt: nt[1]['duration'],
+                              reverse=True)]
+    hookenv.action_set({
+        'traces': len(traces),
+        'slowest-calls': '\n'.join(slowest),
+        'hook-totals': '\n'.join(totals),
+    })
+
+if __name__ == '__main__':
+    hook_trace_report()
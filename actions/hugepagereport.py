@@ -28,34 +28,224 @@ def _add_path(path):
 _add_path(_hooks)
 
 
-import subprocess
+import glob
+import json
+import re
+
 from charmhelpers.core import hookenv
+from nova_compute_hugepages import (
+    hugepage_allocation,
+    is_hugepages_spec,
+    page_size_kb,
+    page_size_label,
+)
 
 SYSFS = '/sys'
+PROC = '/proc'
 KERNELCMD = '/proc/cmdline'
+# processes whose hugepage mappings are reported
+HUGEPAGE_PROCESSES = re.compile(r'^(qemu-system-.*|qemu-kvm|kvm|libvirtd)$')
+MEMINFO_FIELDS = ('HugePages_Total', 'HugePages_Free', 'HugePages_Rsvd',
+                  'HugePages_Surp', 'Hugepagesize', 'Hugetlb')
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _pools(path, counters):
+    pools = {}
+    for pool in sorted(glob.glob(os.path.join(path, 'hugepages-*kB'))):
+        size_kb = int(os.path.basename(pool)[len('hugepages-'):-len('kB')])
+        pools[page_size_label(size_kb)] = {
+            name: int(_read(os.path.join(pool, filename)) or 0)
+            for name, filename in counters.items()}
+    return pools
+
+
+def node_hugepages():
+    '''Hugepage pools of every NUMA node, by page size'''
+    nodes = {}
+    for path in glob.glob(os.path.join(
+            SYSFS, 'devices', 'system', 'node', 'node[0-9]*')):
+        nodes[os.path.basename(path)] = _pools(
+            os.path.join(path, 'hugepages'),
+            {'total': 'nr_hugepages', 'free': 'free_hugepages',
+             'surplus': 'surplus_hugepages'})
+    return nodes
+
+
+def host_hugepages():
+    '''Hugepage pools of the host, by page size; only these count the
+    pages reserved for mappings that have not faulted them in yet'''
+    return _pools(os.path.join(SYSFS, 'kernel', 'mm', 'hugepages'),
+                  {'total': 'nr_hugepages', 'free': 'free_hugepages',
+                   'surplus': 'surplus_hugepages',
+                   'reserved': 'resv_hugepages',
+                   'overcommit': 'nr_overcommit_hugepages'})
+
+
+def hugepage_stats():
+    '''The per node hugepage counters of sysfs as path:value lines'''
+    lines = []
+    for path in sorted(glob.glob(os.path.join(
+            SYSFS, 'devices', 'system', 'node', 'node*', 'hugepages', '*',
+            '*'))):
+        lines.append('{}:{}'.format(path, _read(path)))
+    return '\n'.join(lines)
+
+
+def meminfo_hugepages():
+    '''Hugepage totals of /proc/meminfo'''
+    meminfo = {}
+    for line in (_read(os.path.join(PROC, 'meminfo')) or '').splitlines():
+        name, _, value = line.partition(':')
+        if name in MEMINFO_FIELDS:
+            meminfo[name] = value.strip()
+    return meminfo
+
+
+def cmdline_hugepages(cmdline):
+    '''Hugepage parameters of the kernel command line.
+
+    hugepages= applies to the hugepagesz= before it, or to the default
+    page size when it comes first.
+    '''
+    params = {}
+    size = None
+    for arg in cmdline.split():
+        name, _, value = arg.partition('=')
+        if name == 'default_hugepagesz':
+            params['default_hugepagesz'] = value
+        elif name == 'hugepagesz':
+            size = value
+        elif name == 'hugepages':
+            params.setdefault('pages', {})[size or 'default'] = value
+    return params
+
+
+def hugetlbfs_mounts():
+    '''Mounted hugetlbfs with their options'''
+    mounts = []
+    for line in (_read(os.path.join(PROC, 'mounts')) or '').splitlines():
+        fields = line.split()
+        if len(fields) > 3 and fields[2] == 'hugetlbfs':
+            mounts.append({'mount': fields[1], 'options': fields[3]})
+    return mounts
+
+
+def hugepage_processes():
+    '''libvirt and qemu processes with hugepages mapped, with the pages
+    they map on every node by page size'''
+    processes = []
+    for path in glob.glob(os.path.join(PROC, '[0-9]*')):
+        name = _read(os.path.join(path, 'comm'))
+        if not name or not HUGEPAGE_PROCESSES.match(name):
+            continue
+        pages = {}
+        for line in (_read(os.path.join(path, 'numa_maps')) or
+                     '').splitlines():
+            fields = line.split()
+            if 'huge' not in fields:
+                continue
+            counts = dict(f.split('=', 1) for f in fields if '=' in f)
+            size = page_size_label(int(counts.get('kernelpagesize_kB', 0)))
+            for field, count in counts.items():
+                if re.match(r'^N\d+$', field):
+                    node = 'node{}'.format(field[1:])
+                    pool = pages.setdefault(size, {})
+                    pool[node] = pool.get(node, 0) + int(count)
+        if pages:
+            processes.append({'pid': int(os.path.basename(path)),
+                              'name': name, 'hugepages': pages})
+    return sorted(processes, key=lambda p: p['pid'])
+
+
+def requested_hugepages(cmdline):
+    '''Pages requested by the hugepages option and the kernel command line,
+    as (source, page size, node or None for the host, pages)'''
+    requested = []
+    hugepages = hookenv.config('hugepages')
+    if is_hugepages_spec(hugepages):
+        for size_kb, pages in hugepage_allocation(hugepages).items():
+            for node, count in pages.items():
+                requested.append(('hugepages config', page_size_label(size_kb),
+                                  'node{}'.format(node), count))
+    elif hugepages:
+        # a plain number or percentage of 2M pages for the whole host
+        pages = hugepage_allocation('2M:{}'.format(hugepages))[2048]
+        requested.append(('hugepages config', '2M', None,
+                          sum(pages.values())))
+    default = cmdline.get('default_hugepagesz')
+    for size, count in cmdline.get('pages', {}).items():
+        if size == 'default':
+            size = default or '2M'
+        if count.isdigit():
+            requested.append(('kernel cmdline',
+                              page_size_label(page_size_kb(size)), None,
+                              int(count)))
+    return requested
+
+
+def allocation_shortfalls(requested, nodes, host):
+    '''Requested pages the kernel could not allocate'''
+    shortfalls = []
+    for source, size, node, count in requested:
+        if node is None:
+            allocated = host.get(size, {}).get('total', 0)
+        else:
+            allocated = nodes.get(node, {}).get(size, {}).get('total', 0)
+        if allocated >= count:
+            continue
+        shortfall = {'source': source, 'size': size, 'node': node or 'all',
+                     'requested': count, 'allocated': allocated}
+        if page_size_kb(size) >= 1024 * 1024 and source != 'kernel cmdline':
+            shortfall['hint'] = ('{} pages need contiguous memory that '
+                                 'fragmentation leaves little of after boot; '
+                                 'allocate them on the kernel command line'
+                                 .format(size))
+        shortfalls.append(shortfall)
+    return shortfalls
 
 
 def hugepages_report():
-    '''Action to return current hugepage usage and kernel cmdline for static
-    hugepage allocation. Takes no params.
+    '''Action to return current hugepage usage per NUMA node, the kernel
+    cmdline and mounts for static hugepage allocation, the processes using
+    hugepages and any pages that could not be allocated. Takes no params.
     '''
     outmap = {}
     try:
-        devp = "{}/devices/system/node/node*/hugepages/*/*".format(SYSFS)
-        outmap['hugepagestats'] = subprocess.check_output(
-            "grep -H . {}".format(devp),
-            shell=True).decode('UTF-8')
-    except subprocess.CalledProcessError as e:
+        kernelcmd = _read(KERNELCMD)
+        if kernelcmd is None:
+            raise IOError('not readable')
+        cmdline = cmdline_hugepages(kernelcmd)
+        nodes = node_hugepages()
+        host = host_hugepages()
+        report = {
+            'nodes': nodes,
+            'host': host,
+            'meminfo': meminfo_hugepages(),
+            'cmdline': cmdline,
+            'mounts': hugetlbfs_mounts(),
+            'processes': hugepage_processes(),
+            'shortfalls': allocation_shortfalls(
+                requested_hugepages(cmdline), nodes, host),
+        }
+    except (IOError, OSError, ValueError) as e:
         hookenv.log(e)
-        hookenv.action_fail(
-            "Getting hugepages report failed: {}".format(e.message)
-        )
-    with open(KERNELCMD, 'rb') as cmdline:
-        try:
-            outmap['kernelcmd'] = cmdline.read().strip()
-        except IOError as e:
-            hookenv.action_fail('Could not read {}: {}'.format(KERNELCMD, e))
-            return
+        hookenv.action_fail("Getting hugepages report failed: {}".format(e))
+        return
+    outmap['kernelcmd'] = kernelcmd
+    outmap['hugepagestats'] = hugepage_stats()
+    outmap['report'] = json.dumps(report, indent=2, sort_keys=True)
+    if report['shortfalls']:
+        outmap['shortfalls'] = '\n'.join(
+            '{node}: {allocated} of {requested} {size} pages allocated '
+            '({source})'.format(**s) for s in report['shortfalls'])
     hookenv.action_set(outmap)
 
 if __name__ == '__main__':
@@ -31,10 +31,9 @@ _add_path(_hooks)
 
 from charmhelpers.contrib.openstack.utils import (
     do_action_openstack_upgrade,
+    is_unit_paused_set,
 )
-from charmhelpers.core.hookenv import (
-    relation_ids,
-)
+from charmhelpers.core.hookenv import relation_ids
 from nova_compute_utils import do_openstack_upgrade
 from nova_compute_hooks import (
     config_changed,
@@ -57,13 +56,18 @@ def openstack_upgrade():
                                     CONFIGS)):
         # we should restart the container scoped (subordinate) plugins after a
         # managed openstack upgrade see: BUG#1835557
-        for rid in relation_ids('neutron-plugin'):
-            neutron_plugin_joined(rid, remote_restart=True)
-        for rid in relation_ids('nova-ceilometer'):
-            nova_ceilometer_joined(rid, remote_restart=True)
         # NOTE(ajkavanagh) - if unit is paused (usually true for managed
-        # upgrade) then the config_changed() function is a no-op
-        config_changed()
+        # upgrade) then the config_changed() function is a no-op, otherwise
+        # its full reconcile restarts them.
+        if is_unit_paused_set():
+            for rid in relation_ids('neutron-plugin'):
+                neutron_plugin_joined(rid, remote_restart=True)
+            for rid in relation_ids('nova-ceilometer'):
+                nova_ceilometer_joined(rid, remote_restart=True)
+        changes = config_changed()
+        if changes:
+            # no hook dispatcher saves what config_changed() applied
+            changes.save()
 
 if __name__ == '__main__':
     openstack_upgrade()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+_path = os.path.dirname(os.path.realpath(__file__))
+_hooks = os.path.abspath(os.path.join(_path, '../hooks'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+_add_path(_hooks)
+
+
+import json
+
+from charmhelpers.core import hookenv
+from nova_compute_memory import format_reservation, reserved_host_memory
+
+
+def reserved_host_memory_report():
+    '''Action to report the memory reserved for the host and how the
+    automatic reservation adds up. Takes no params.
+    '''
+    auto = bool(hookenv.config('reserved-host-memory-auto'))
+    reservation = reserved_host_memory(record=False)
+    hookenv.action_set({
+        'auto': auto,
+        'reserved-host-memory': (reservation['total'] if auto else
+                                 hookenv.config('reserved-host-memory')),
+        'auto-reserved-host-memory': reservation['total'],
+        'summary': format_reservation(reservation),
+        'breakdown': json.dumps(reservation, indent=2),
+    })
+
+if __name__ == '__main__':
+    reserved_host_memory_report()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+
+_path = os.path.dirname(os.path.realpath(__file__))
+_hooks = os.path.abspath(os.path.join(_path, '../hooks'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+_add_path(_hooks)
+
+
+from charmhelpers.core import hookenv
+from nova_compute_memory import (
+    format_reservation,
+    reserved_host_memory,
+    reset_guests_high_water,
+)
+
+
+def reset_guests_high_water_action():
+    '''Action to size the qemu overhead in the automatic memory reservation
+    from the guests running now instead of the most the host has run.
+    Takes no params.
+    '''
+    reset_guests_high_water()
+    reservation = reserved_host_memory(record=False)
+    hookenv.action_set({
+        'running-guests': reservation['sized-from']['running-guests'],
+        'auto-reserved-host-memory': reservation['total'],
+        'summary': format_reservation(reservation),
+    })
+
+if __name__ == '__main__':
+    reset_guests_high_water_action()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure installed package lookups in ubuntu_apt_pkg.Cache.
+
+Looks up the installed state of packages the way the charm does, one
+filter_installed_packages() style query at a time, on the local system:
+
+    dpkg-query  ``dpkg-query --list`` for every query (the old path)
+    parse       dpkg status file parsed for every query
+    indexed     dpkg status file parsed once, then served from the index
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+CHARM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(CHARM_DIR, 'hooks'))
+
+from charmhelpers.fetch import ubuntu_apt_pkg  # noqa: E402
+
+MODES = ['dpkg-query', 'parse', 'indexed']
+# The packages nova-compute queries most often.
+PACKAGES = ['nova-common', 'nova-compute', 'vaultlocker', 'multipath-tools',
+            'ceph-common', 'python3-nova', 'libvirt-daemon', 'qemu-kvm']
+
+
+def lookup(mode, packages):
+    cache = ubuntu_apt_pkg.Cache()
+    if mode == 'dpkg-query':
+        return cache._dpkg_query_list(packages)
+    if mode == 'parse':
+        ubuntu_apt_pkg._dpkg_status = None
+    return cache._dpkg_list(packages)
+
+
+def measure(mode, packages, runs):
+    lookup(mode, packages)
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        lookup(mode, packages)
+        times.append(time.time() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--package', action='append',
+                        help='package to look up (default: {})'
+                        .format(' '.join(PACKAGES)))
+    parser.add_argument('--json', action='store_true',
+                        help='emit results as JSON')
+    args = parser.parse_args(argv)
+
+    packages = args.package or PACKAGES
+    results = {mode: measure(mode, packages, args.runs) for mode in MODES}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    with open(ubuntu_apt_pkg.DPKG_STATUS, 'rb') as f:
+        stanzas = f.read().count(b'\nPackage: ') + 1
+    print('{} packages in {}, {} looked up per query (median time)'.format(
+        stanzas, ubuntu_apt_pkg.DPKG_STATUS, len(packages)))
+    for mode in MODES:
+        print('{:<12} {:>10.3f} ms'.format(mode, results[mode] * 1000))
+
+
+if __name__ == '__main__':
+    main()
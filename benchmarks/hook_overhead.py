@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the fixed per-hook overhead of the nova-compute charm.
+
+The hook is executed against stub juju hook tools (and stub package query
+tools) which record every invocation.  Wall time and the number of calls made
+to each tool, over all the runs and per run, are reported, so two checkouts of
+the charm can be compared:
+
+    ./benchmarks/hook_overhead.py --charm-dir /path/to/old/checkout
+    ./benchmarks/hook_overhead.py --charm-dir .
+
+The charm tree is copied to a scratch directory for every run so that the
+persistent config and unit state databases start out empty and the checkout
+is never modified.
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+# Tools that are stubbed out, mapped to the (returncode, stdout) they give.
+# Anything not listed here is looked up on the real PATH.
+STUBBED_TOOLS = {
+    'action-get': (0, '{}'),
+    'application-version-set': (0, ''),
+    'apt-cache': (0, '@packages'),
+    'apt-config': (0, ''),
+    'config-get': (0, '@config'),
+    'dpkg-query': (0, '@packages'),
+    'is-leader': (0, 'false'),
+    'juju-log': (0, ''),
+    'leader-get': (0, '{}'),
+    'nc': (1, ''),
+    'network-get': (0, '{}'),
+    'relation-get': (0, '{}'),
+    'relation-ids': (0, '[]'),
+    'relation-list': (0, '[]'),
+    'relation-set': (0, ''),
+    'service': (3, ''),
+    'status-get': (0, '{"status": "unknown", "message": ""}'),
+    'status-set': (0, ''),
+    'systemctl': (3, ''),
+    'unit-get': (0, '"10.0.0.10"'),
+}
+
+# Packages reported as installed by the stub dpkg-query and apt-cache.
+INSTALLED_PACKAGES = {
+    'nova-common': '2:17.0.13-0ubuntu1',
+    'nova-compute': '2:17.0.13-0ubuntu1',
+    'nova-compute-kvm': '2:17.0.13-0ubuntu1',
+}
+
+STUB = """#!{python}
+import json
+import os
+import sys
+
+name = os.path.basename(sys.argv[0])
+with open({log!r}, 'a') as f:
+    f.write(json.dumps([name] + sys.argv[1:]) + '\\n')
+rc, out = {outputs!r}[name]
+if out == '@config':
+    with open({config!r}) as f:
+        out = f.read()
+elif out == '@packages':
+    installed = {packages!r}
+    wanted = [a for a in sys.argv[1:] if not a.startswith('-')]
+    if name == 'apt-cache':
+        wanted = wanted[1:]
+        out = ''.join('Package: {{}}\\nVersion: {{}}\\n\\n'.format(
+            p, installed[p]) for p in wanted if p in installed)
+        rc = 0 if out else 100
+    else:
+        out = '||/ Name Version Architecture Description\\n'
+        out += ''.join('ii  {{}} {{}} amd64 stub\\n'.format(p, installed[p])
+                       for p in wanted if p in installed)
+        rc = 0 if all(p in installed for p in wanted) else 1
+elif name == 'relation-get' and '-' not in sys.argv:
+    out = 'null'
+elif name == 'relation-set' and '--help' in sys.argv:
+    out = '--file'
+sys.stdout.write(out)
+sys.exit(rc)
+"""
+
+
+def default_config(charm_dir):
+    with open(os.path.join(charm_dir, 'config.yaml')) as f:
+        options = yaml.safe_load(f)['options']
+    return {k: v.get('default') for k, v in options.items()}
+
+
+def make_stubs(scratch, charm_dir, call_log):
+    bindir = os.path.join(scratch, 'bin')
+    os.mkdir(bindir)
+    config_file = os.path.join(scratch, 'config.json')
+    with open(config_file, 'w') as f:
+        json.dump(default_config(charm_dir), f)
+    source = STUB.format(python=sys.executable, log=call_log,
+                         outputs=STUBBED_TOOLS, config=config_file,
+                         packages=INSTALLED_PACKAGES)
+    for tool in STUBBED_TOOLS:
+        path = os.path.join(bindir, tool)
+        with open(path, 'w') as f:
+            f.write(source)
+        os.chmod(path, 0o755)
+    return bindir
+
+
+def run_hook(charm_dir, hook):
+    """Run a single hook in a scratch copy of the charm.
+
+    :returns: (wall time in seconds, Counter of tool invocations, returncode)
+    """
+    scratch = tempfile.mkdtemp(prefix='nova-compute-bench.')
+    try:
+        unit_dir = os.path.join(scratch, 'charm')
+        shutil.copytree(charm_dir, unit_dir, symlinks=True,
+                        ignore=shutil.ignore_patterns('.git', '.tox',
+                                                      '*.db', '__pycache__'))
+        call_log = os.path.join(scratch, 'calls.log')
+        open(call_log, 'w').close()
+        bindir = make_stubs(scratch, charm_dir, call_log)
+        env = dict(os.environ)
+        env.update({
+            'PATH': '{}:{}'.format(bindir, env.get('PATH', '')),
+            'CHARM_DIR': unit_dir,
+            'JUJU_CHARM_DIR': unit_dir,
+            'JUJU_HOOK_NAME': hook,
+            'JUJU_UNIT_NAME': 'nova-compute/0',
+            'JUJU_MODEL_UUID': 'bench',
+            'UNIT_STATE_DB': os.path.join(scratch, '.unit-state.db'),
+        })
+        start = time.time()
+        proc = subprocess.run([os.path.join('hooks', hook)], cwd=unit_dir,
+                              env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        elapsed = time.time() - start
+        calls = collections.Counter()
+        with open(call_log) as f:
+            for line in f:
+                calls[json.loads(line)[0]] += 1
+        return elapsed, calls, proc.returncode
+    finally:
+        shutil.rmtree(scratch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--charm-dir', default=os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..')))
+    parser.add_argument('--hook', default='update-status')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='emit results as JSON')
+    args = parser.parse_args(argv)
+
+    times = []
+    calls = collections.Counter()
+    failures = 0
+    for _ in range(args.runs):
+        elapsed, run_calls, rc = run_hook(args.charm_dir, args.hook)
+        times.append(elapsed)
+        calls.update(run_calls)
+        failures += bool(rc)
+
+    result = {
+        'charm_dir': args.charm_dir,
+        'hook': args.hook,
+        'runs': args.runs,
+        'failures': failures,
+        'wall_time_mean': statistics.mean(times),
+        'wall_time_min': min(times),
+        # tool calls summed over all the runs, and per run
+        'tool_calls_total': sum(calls.values()),
+        'tool_calls_per_run': sum(calls.values()) / args.runs,
+        'tool_calls': dict(calls.most_common()),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print('{hook}: {runs} runs, {failures} failed, mean {wall_time_mean:.3f}s,'
+          ' min {wall_time_min:.3f}s, {tool_calls_per_run:g} tool calls'
+          ' per run'.format(**result))
+    for tool, count in calls.most_common():
+        print('  {:<28} {:g}'.format(tool, count / args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure OSConfigRenderer.write_all() time for every OpenStack release.
+
+Each template the charm renders is registered with a minimal context and
+written to a scratch directory by a fresh renderer, as a new hook process
+would.  Three template loading strategies are compared:
+
+    parse        no charm state directory, templates parsed every time
+    bytecode     jinja2 bytecode cache under the charm state directory
+    precompiled  templates precompiled by OSConfigRenderer.precompile()
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+CHARM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(CHARM_DIR, 'hooks'))
+
+from charmhelpers.contrib.openstack import templating  # noqa: E402
+
+RELEASES = ['icehouse', 'juno', 'kilo', 'liberty', 'mitaka', 'newton',
+            'ocata', 'pike', 'queens', 'rocky', 'stein', 'train']
+
+# Templates rendered by the charm, by the basename they are looked up with.
+TEMPLATES = ['nova.conf', 'qemu.conf', 'qemu-kvm', 'libvirtd.conf',
+             'libvirt-bin', 'libvirt-bin.override', 'secret.xml',
+             'usr.bin.nova-api', 'usr.bin.nova-compute',
+             'usr.bin.nova-network', 'vaultlocker.conf.j2']
+
+MODES = ['parse', 'bytecode', 'precompiled']
+
+
+class MinimalContext(object):
+    """Just enough context for every template to render."""
+    interfaces = []
+
+    def __call__(self):
+        return {'ubuntu_release': '18.04'}
+
+
+def time_write_all(release, state_dir, out_dir):
+    os.environ.pop('JUJU_CHARM_DIR', None)
+    if state_dir:
+        os.environ['CHARM_DIR'] = state_dir
+    else:
+        os.environ.pop('CHARM_DIR', None)
+    renderer = templating.OSConfigRenderer(
+        templates_dir=os.path.join(CHARM_DIR, 'templates'),
+        openstack_release=release)
+    for name in TEMPLATES:
+        renderer.register(os.path.join(out_dir, name), [MinimalContext()])
+    start = time.time()
+    renderer.write_all()
+    return time.time() - start, renderer
+
+
+def measure(release, mode, runs):
+    scratch = tempfile.mkdtemp(prefix='nova-compute-render.')
+    try:
+        state_dir = None if mode == 'parse' else scratch
+        out_dir = os.path.join(scratch, 'out')
+        os.mkdir(out_dir)
+        # one untimed pass to fill the bytecode cache / precompile
+        _, renderer = time_write_all(release, state_dir, out_dir)
+        if mode == 'precompiled':
+            renderer.precompile()
+        times = []
+        for _ in range(runs):
+            # remove the output so every file is written each run
+            for name in os.listdir(out_dir):
+                os.unlink(os.path.join(out_dir, name))
+            elapsed, _ = time_write_all(release, state_dir, out_dir)
+            times.append(elapsed)
+        return statistics.mean(times)
+    finally:
+        shutil.rmtree(scratch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--release', action='append', choices=RELEASES,
+                        help='release to measure (default: all)')
+    parser.add_argument('--json', action='store_true',
+                        help='emit results as JSON')
+    args = parser.parse_args(argv)
+
+    # keep juju-log out of the measurement
+    templating.log = lambda *args, **kwargs: None
+    templating.file_changed = lambda path: None
+
+    results = {}
+    for release in args.release or RELEASES:
+        results[release] = {mode: measure(release, mode, args.runs)
+                            for mode in MODES}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{:<10} {:>10} {:>10} {:>12}  (mean write_all() time, ms)'
+          .format('release', *MODES))
+    for release, result in results.items():
+        print('{:<10} {:>10.2f} {:>10.2f} {:>12.2f}'.format(
+            release, *(result[mode] * 1000 for mode in MODES)))
+
+
+if __name__ == '__main__':
+    main()
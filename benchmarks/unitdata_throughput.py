@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure unitdata.Storage get/set/update/getrange throughput.
+
+Every operation is run against a fresh database file in a scratch directory,
+once with the default rollback journal and once with write-ahead logging:
+
+    get       get() of existing keys
+    set       set() of new values, flushed once at the end
+    update    update() of 100 key mappings, flushed once at the end
+    getrange  getrange() of a 100 key prefix
+    flush     set() of one key followed by flush(), as a hook checkpoint
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CHARM_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(CHARM_DIR, 'hooks'))
+
+from charmhelpers.core import unitdata  # noqa: E402
+
+OPERATIONS = ['get', 'set', 'update', 'getrange', 'flush']
+JOURNALS = ['rollback', 'wal']
+# Keys in the range read by getrange and written by update.
+RANGE = 100
+
+
+def populate(db, count):
+    for i in range(count):
+        db.set('key.{}'.format(i), {'value': i})
+    db.update({str(i): i for i in range(RANGE)}, prefix='range.')
+    db.flush()
+
+
+def run(db, operation, count):
+    """Run count operations, returning the number of keys they touched"""
+    if operation == 'get':
+        for i in range(count):
+            db.get('key.{}'.format(i))
+    elif operation == 'set':
+        for i in range(count):
+            db.set('key.{}'.format(i), {'value': -i})
+        db.flush()
+    elif operation == 'update':
+        for i in range(count):
+            db.update({str(k): i for k in range(RANGE)}, prefix='range.')
+        db.flush()
+        return count * RANGE
+    elif operation == 'getrange':
+        for i in range(count):
+            db.getrange('range.', strip=True)
+    elif operation == 'flush':
+        for i in range(count):
+            db.set('checkpoint', i)
+            db.flush()
+    return count
+
+
+def measure(journal, operation, count):
+    scratch = tempfile.mkdtemp(prefix='nova-compute-unitdata.')
+    try:
+        db = unitdata.Storage(os.path.join(scratch, 'unit-state.db'),
+                              wal=journal == 'wal')
+        populate(db, count)
+        # drop the cache so reads start from the database, as a new hook
+        # process would
+        db.close()
+        db = unitdata.Storage(os.path.join(scratch, 'unit-state.db'),
+                              wal=journal == 'wal')
+        start = time.time()
+        keys = run(db, operation, count)
+        elapsed = time.time() - start
+        db.close()
+        return keys / elapsed
+    finally:
+        shutil.rmtree(scratch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000,
+                        help='operations per measurement')
+    parser.add_argument('--json', action='store_true',
+                        help='emit results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for journal in JOURNALS:
+        results[journal] = {op: measure(journal, op, args.count)
+                            for op in OPERATIONS}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{:<10}'.format('journal') +
+          ''.join('{:>12}'.format(op) for op in OPERATIONS) +
+          '  (keys/s)')
+    for journal, result in results.items():
+        print('{:<10}'.format(journal) +
+              ''.join('{:>12.0f}'.format(result[op]) for op in OPERATIONS))
+
+
+if __name__ == '__main__':
+    main()
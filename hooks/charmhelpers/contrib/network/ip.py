@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import binascii
 import glob
+import os
 import re
 import subprocess
 import six
 import socket
+import struct
 
 from functools import partial
 
@@ -539,19 +542,150 @@ def get_hostname(address, fqdn=True):
         return result.split('.')[0]
 
 
-def port_has_listener(address, port):
+PROC_NET_TCP = ('/proc/net/tcp', '/proc/net/tcp6')
+TCP_LISTEN = 10
+# netlink sock_diag constants, see linux/sock_diag.h and linux/inet_diag.h
+_NETLINK_SOCK_DIAG = 4
+_SOCK_DIAG_BY_FAMILY = 20
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_NLM_F_REQUEST_DUMP = 0x301
+_NLMSG_HEADER = struct.Struct('=LHHLL')
+_INET_DIAG_REQ_V2 = struct.Struct('=BBBxL48x')
+# family, state, timer, retrans, then the sockid: sport, dport, src, ...
+# with the ports and addresses in network byte order
+_INET_DIAG_MSG = struct.Struct('=BBBB2s2x16s')
+
+
+def _proc_net_address(hex_address):
+    """Decode an address of /proc/net/tcp{,6}, stored as 32 bit words in
+    host byte order."""
+    raw = binascii.unhexlify(hex_address)
+    if len(raw) == 4:
+        return socket.inet_ntop(socket.AF_INET, struct.pack(
+            '!L', *struct.unpack('=L', raw)))
+    return socket.inet_ntop(socket.AF_INET6, struct.pack(
+        '!4L', *struct.unpack('=4L', raw)))
+
+
+def _tcp_listeners_proc():
+    listeners = {}
+    for path in PROC_NET_TCP:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            next(f, None)
+            for line in f:
+                fields = line.split(None, 4)
+                if len(fields) < 4 or int(fields[3], 16) != TCP_LISTEN:
+                    continue
+                address, port = fields[1].split(':')
+                listeners.setdefault(int(port, 16), set()).add(
+                    _proc_net_address(address))
+    return listeners
+
+
+def _tcp_listeners_sock_diag():
+    listeners = {}
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                         _NETLINK_SOCK_DIAG)
+    try:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6)):
+            request = _INET_DIAG_REQ_V2.pack(
+                family, socket.IPPROTO_TCP, 0, 1 << TCP_LISTEN)
+            sock.send(_NLMSG_HEADER.pack(
+                _NLMSG_HEADER.size + len(request), _SOCK_DIAG_BY_FAMILY,
+                _NLM_F_REQUEST_DUMP, seq + 1, 0) + request)
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                offset = 0
+                while offset < len(data):
+                    length, msg_type, _, _, _ = _NLMSG_HEADER.unpack_from(
+                        data, offset)
+                    if msg_type == _NLMSG_ERROR:
+                        raise OSError('sock_diag request failed')
+                    if msg_type == _NLMSG_DONE or not length:
+                        done = True
+                        break
+                    family, state, _, _, port, src = (
+                        _INET_DIAG_MSG.unpack_from(
+                            data, offset + _NLMSG_HEADER.size))
+                    if state == TCP_LISTEN:
+                        port = struct.unpack('!H', port)[0]
+                        if family == socket.AF_INET:
+                            address = socket.inet_ntop(family, src[:4])
+                        else:
+                            address = socket.inet_ntop(family, src)
+                        listeners.setdefault(port, set()).add(address)
+                    # messages are aligned to 4 bytes
+                    offset += (length + 3) & ~3
+    finally:
+        sock.close()
+    return listeners
+
+
+def tcp_listeners(sock_diag=False):
+    """Get the TCP sockets listening on this host, in one pass.
+
+    The listening sockets are read from /proc/net/tcp and /proc/net/tcp6,
+    or with a netlink sock_diag query if sock_diag is True, falling back to
+    /proc if that fails.
+
+    :param sock_diag: Query the kernel with netlink sock_diag
+    :type sock_diag: bool
+    :returns: Local addresses listening, by port; None if the listening
+              sockets can not be determined
+    :rtype: Optional[Dict[int, Set[str]]]
+    """
+    if sock_diag:
+        try:
+            return _tcp_listeners_sock_diag()
+        except (AttributeError, OSError, socket.error, struct.error):
+            pass
+    try:
+        return _tcp_listeners_proc()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _is_wildcard(address):
+    return address in ('0.0.0.0', '::')
+
+
+def _is_loopback(address):
+    return (address.startswith('127.') or address == '::1' or
+            address.startswith('::ffff:127.'))
+
+
+def port_has_listener(address, port, listeners=None):
     """
     Returns True if the address:port is open and being listened to,
     else False.
 
+    The listening sockets are looked up in listeners, as returned by
+    tcp_listeners(), which is called if they are not given.  As with a
+    connection to it, the wildcard address matches sockets listening on
+    the wildcard or loopback addresses.
+
     @param address: an IP address or hostname
     @param port: integer port
+    @param listeners: the result of tcp_listeners()
 
-    Note calls 'zc' via a subprocess shell
+    Note calls 'nc' via a subprocess if address is not an IP address or
+    the listening sockets can not be determined.
     """
-    cmd = ['nc', '-z', address, str(port)]
-    result = subprocess.call(cmd)
-    return not(bool(result))
+    if listeners is None and is_ip(address):
+        listeners = tcp_listeners()
+    if listeners is None or not is_ip(address):
+        cmd = ['nc', '-z', address, str(port)]
+        result = subprocess.call(cmd)
+        return not(bool(result))
+    for listening in listeners.get(int(port), ()):
+        if (listening == address or _is_wildcard(listening) or
+                (_is_wildcard(address) and _is_loopback(listening))):
+            return True
+    return False
 
 
 def assert_charm_supports_ipv6():
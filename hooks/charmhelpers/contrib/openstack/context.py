@@ -43,7 +43,7 @@ from charmhelpers.core.hookenv import (
     is_relation_made,
     local_unit,
     log,
-    relation_get,
+    snapshot_relation_get as relation_get,
     relation_ids,
     related_units,
     relation_set,
@@ -12,14 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import compileall
+import contextlib
+import hashlib
 import os
+import shutil
+import stat
+import tempfile
+import time
+
+from collections import OrderedDict
 
 import six
 
 from charmhelpers.fetch import apt_install, apt_update
+from charmhelpers.core.host import file_changed, track_file_changes
 from charmhelpers.core.hookenv import (
+    charm_dir,
     log,
     ERROR,
+    DEBUG,
     INFO,
     TRACE
 )
@@ -27,6 +39,7 @@ from charmhelpers.contrib.openstack.utils import OPENSTACK_CODENAMES
 
 try:
     from jinja2 import FileSystemLoader, ChoiceLoader, Environment, exceptions
+    from jinja2 import FileSystemBytecodeCache, ModuleLoader
 except ImportError:
     apt_update(fatal=True)
     if six.PY2:
@@ -34,6 +47,11 @@ except ImportError:
     else:
         apt_install('python3-jinja2', fatal=True)
     from jinja2 import FileSystemLoader, ChoiceLoader, Environment, exceptions
+    from jinja2 import FileSystemBytecodeCache, ModuleLoader
+
+# Directory, relative to the charm directory, holding compiled templates.
+TEMPLATE_CACHE_DIR = '.jinja2'
+HELPER_TEMPLATES = os.path.join(os.path.dirname(__file__), 'templates')
 
 
 class OSConfigException(Exception):
@@ -72,9 +90,8 @@ def get_loader(templates_dir, os_release):
     # the bottom contains tempaltes_dir and possibly a common templates dir
     # shipped with the helper.
     loaders = [FileSystemLoader(templates_dir)]
-    helper_templates = os.path.join(os.path.dirname(__file__), 'templates')
-    if os.path.isdir(helper_templates):
-        loaders.append(FileSystemLoader(helper_templates))
+    if os.path.isdir(HELPER_TEMPLATES):
+        loaders.append(FileSystemLoader(HELPER_TEMPLATES))
 
     for rel, tmpl_dir in tmpl_dirs:
         if os.path.isdir(tmpl_dir):
@@ -88,6 +105,93 @@ def get_loader(templates_dir, os_release):
     return ChoiceLoader(loaders)
 
 
+def context_key(context):
+    """
+    Key identifying the result of a context generator within a render pass.
+
+    Generator instances of the same class constructed with the same arguments
+    produce the same context, so they share a key.  Anything without instance
+    state (eg, a plain function) is keyed on its identity.
+
+    :param context: context generator
+    :returns: hashable key
+    """
+    try:
+        state = sorted(six.iteritems(vars(context)))
+    except TypeError:
+        return id(context)
+    return (type(context), repr(state))
+
+
+def template_cache_dir(os_release):
+    """
+    Directory in the charm state directory for compiled templates of an
+    OpenStack release.
+
+    :param os_release (str): OpenStack release codename.
+    :returns: path, or None when not running within a charm.
+    """
+    base = charm_dir()
+    if not base:
+        return None
+    return os.path.join(base, TEMPLATE_CACHE_DIR, os_release)
+
+
+def templates_fingerprint(templates_dir):
+    """
+    Fingerprint of the names, sizes and mtimes of every template available
+    to the loader, used to tell whether precompiled templates are stale.
+
+    :param templates_dir (str): Base template directory.
+    :returns: hex digest.
+    """
+    digest = hashlib.md5()
+    for top in (templates_dir, HELPER_TEMPLATES):
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                digest.update('{} {} {}\n'.format(
+                    path, st.st_mtime, st.st_size).encode('UTF-8'))
+    return digest.hexdigest()
+
+
+def write_atomic(path, content):
+    """
+    Replace the content of path via a temporary file and a rename, so that
+    readers never see a partially written file.  The mode and ownership of
+    an existing file are preserved and symlinks are written through.
+
+    :param path (str): file to write
+    :param content (bytes): new content
+    """
+    path = os.path.realpath(path)
+    try:
+        existing = os.stat(path)
+    except OSError:
+        existing = None
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix='.{}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(content)
+        if existing:
+            os.chmod(tmp, stat.S_IMODE(existing.st_mode))
+            current = os.stat(tmp)
+            if (current.st_uid, current.st_gid) != (existing.st_uid,
+                                                    existing.st_gid):
+                os.chown(tmp, existing.st_uid, existing.st_gid)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
 class OSConfigTemplate(object):
     """
     Associates a config file template with a list of context generators.
@@ -103,13 +207,39 @@ class OSConfigTemplate(object):
             self.contexts = contexts
 
         self._complete_contexts = []
+        # keys are taken before any generator is called, as calling one may
+        # change its instance state.
+        self._context_keys = [context_key(c) for c in self.contexts]
 
         self.config_template = config_template
 
-    def context(self):
+    def _call_context(self, context, key, results):
+        if results is None:
+            return context()
+        if key in results:
+            _ctxt, source = results[key]
+            if source is not context:
+                # carry over the completeness tracking the generator would
+                # have recorded had it been called.
+                for attr in ('complete', 'missing_data'):
+                    if attr in vars(source):
+                        setattr(context, attr, getattr(source, attr))
+            return _ctxt
+        _ctxt = context()
+        results[key] = (_ctxt, context)
+        return _ctxt
+
+    def context(self, results=None):
+        """
+        Build the template context by calling each context generator.
+
+        :param results: optional dict shared across templates during a render
+            pass; generators whose result is already in it are not called
+            again.
+        """
         ctxt = {}
-        for context in self.contexts:
-            _ctxt = context()
+        for context, key in zip(self.contexts, self._context_keys):
+            _ctxt = self._call_context(context, key, results)
             if _ctxt:
                 ctxt.update(_ctxt)
                 # track interfaces for every complete context.
@@ -118,13 +248,13 @@ class OSConfigTemplate(object):
                  if interface not in self._complete_contexts]
         return ctxt
 
-    def complete_contexts(self):
+    def complete_contexts(self, results=None):
         '''
         Return a list of interfaces that have satisfied contexts.
         '''
         if self._complete_contexts:
             return self._complete_contexts
-        self.context()
+        self.context(results)
         return self._complete_contexts
 
     @property
@@ -220,6 +350,12 @@ class OSConfigRenderer(object):
         self.openstack_release = openstack_release
         self.templates = {}
         self._tmpl_env = None
+        self._context_results = None
+        # {interface: OrderedDict(context key: context generator)}, the
+        # distinct generators of each interface across all config files.
+        self._interface_contexts = OrderedDict()
+        self._context_status = None
+        self._complete_interfaces = None
 
         if None in [Environment, ChoiceLoader, FileSystemLoader]:
             # if this code is running, the object is created pre-install hook.
@@ -245,13 +381,101 @@ class OSConfigRenderer(object):
             contexts=contexts,
             config_template=config_template
         )
+        self._index_interfaces()
+        # write() reports every change to the file, so restart_on_change
+        # does not need to checksum it.
+        track_file_changes(config_file)
         log('Registered config file: {}'.format(config_file),
             level=INFO)
 
+    def _index_interfaces(self):
+        index = OrderedDict()
+        for ostmpl in six.itervalues(self.templates):
+            for context, key in zip(ostmpl.contexts, ostmpl._context_keys):
+                for interface in getattr(context, 'interfaces', []):
+                    index.setdefault(interface, OrderedDict()).setdefault(
+                        key, context)
+        self._interface_contexts = index
+
     def _get_tmpl_env(self):
         if not self._tmpl_env:
             loader = get_loader(self.templates_dir, self.openstack_release)
-            self._tmpl_env = Environment(loader=loader)
+            bytecode_cache = None
+            cache_dir = template_cache_dir(self.openstack_release)
+            if cache_dir:
+                modules = self._precompiled_modules(cache_dir)
+                if modules:
+                    loader = ChoiceLoader([ModuleLoader(modules), loader])
+                bytecode_cache = self._bytecode_cache(cache_dir)
+            self._tmpl_env = Environment(loader=loader,
+                                         bytecode_cache=bytecode_cache)
+
+    def _bytecode_cache(self, cache_dir):
+        # jinja2 checks the cached bytecode against the template source, so
+        # an edited template is simply recompiled.
+        bytecode_dir = os.path.join(cache_dir, 'bytecode')
+        try:
+            if not os.path.isdir(bytecode_dir):
+                os.makedirs(bytecode_dir)
+        except OSError as e:
+            log('Not caching template bytecode: {}'.format(e), level=DEBUG)
+            return None
+        return FileSystemBytecodeCache(bytecode_dir)
+
+    def _precompiled_modules(self, cache_dir):
+        modules = os.path.join(cache_dir, 'modules')
+        try:
+            with open(os.path.join(modules, 'FINGERPRINT')) as f:
+                fingerprint = f.read().strip()
+        except (IOError, OSError):
+            return None
+        if fingerprint != templates_fingerprint(self.templates_dir):
+            log('Ignoring stale precompiled templates in {}'.format(modules),
+                level=DEBUG)
+            return None
+        return modules
+
+    def precompile(self):
+        """
+        Compile every template available for the current release into
+        python modules under the charm state directory.  Later hooks load
+        these instead of parsing the templates, until a template changes.
+
+        This is optional; charms typically call it from the install and
+        upgrade-charm hooks.
+
+        :returns: directory of the compiled templates, or None when not
+            running within a charm.
+        """
+        cache_dir = template_cache_dir(self.openstack_release)
+        if not cache_dir:
+            return None
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        modules = os.path.join(cache_dir, 'modules')
+        # templates for other releases are never looked up by this loader
+        releases = set(six.itervalues(OPENSTACK_CODENAMES))
+        env = Environment(
+            loader=get_loader(self.templates_dir, self.openstack_release))
+        staging = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            env.compile_templates(
+                staging, zip=None, ignore_errors=True,
+                filter_func=lambda name: name.split('/')[0] not in releases)
+            # byte-compile now rather than relying on the interpreter
+            # being able to write bytecode when the modules are imported
+            compileall.compile_dir(staging, quiet=1)
+            with open(os.path.join(staging, 'FINGERPRINT'), 'w') as f:
+                f.write(templates_fingerprint(self.templates_dir))
+            shutil.rmtree(modules, ignore_errors=True)
+            os.rename(staging, modules)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._tmpl_env = None
+        log('Precompiled {} templates into {}'.format(
+            self.openstack_release, modules), level=INFO)
+        return modules
 
     def _get_template(self, template):
         self._get_tmpl_env()
@@ -278,7 +502,7 @@ class OSConfigRenderer(object):
             raise OSConfigException
 
         ostmpl = self.templates[config_file]
-        ctxt = ostmpl.context()
+        ctxt = ostmpl.context(self._context_results)
 
         if ostmpl.is_string_template:
             template = self._get_template_from_string(ostmpl)
@@ -313,6 +537,12 @@ class OSConfigRenderer(object):
     def write(self, config_file):
         """
         Write a single config file, raises if config file is not registered.
+
+        The file is left alone if the rendered content matches what is
+        already there; otherwise it is replaced atomically and the change is
+        reported to restart_on_change.
+
+        :returns: True if the file was changed, False otherwise.
         """
         if config_file not in self.templates:
             log('Config not registered: %s' % config_file, level=ERROR)
@@ -322,16 +552,55 @@ class OSConfigRenderer(object):
         if six.PY3:
             _out = _out.encode('UTF-8')
 
-        with open(config_file, 'wb') as out:
-            out.write(_out)
-
+        try:
+            with open(config_file, 'rb') as current:
+                if current.read() == _out:
+                    log('Template %s unchanged, not writing.' % config_file,
+                        level=DEBUG)
+                    return False
+        except (IOError, OSError):
+            pass
+
+        write_atomic(config_file, _out)
+        file_changed(config_file)
         log('Wrote template %s.' % config_file, level=INFO)
+        return True
+
+    @contextlib.contextmanager
+    def render_pass(self):
+        """
+        Share context generator results between templates for the duration
+        of the block, so each distinct generator is only evaluated once.
+        Nested render passes use the results of the outermost one.
+        """
+        if self._context_results is not None:
+            yield
+            return
+        self._context_results = {}
+        self._context_status = {}
+        try:
+            yield
+        finally:
+            log('Render pass evaluated {} context generators'.format(
+                len(self._context_results)), level=DEBUG)
+            self._context_results = None
+            self._context_status = None
+            self._complete_interfaces = None
 
     def write_all(self):
         """
         Write out all registered config files.
+
+        :returns: list of the config files that were changed.
         """
-        [self.write(k) for k in six.iterkeys(self.templates)]
+        start = time.time()
+        with self.render_pass():
+            changed = [k for k in six.iterkeys(self.templates)
+                       if self.write(k)]
+        log('Rendered {} config files in {:.3f}s, {} changed'.format(
+            len(self.templates), time.time() - start, len(changed)),
+            level=DEBUG)
+        return changed
 
     def set_release(self, openstack_release):
         """
@@ -346,10 +615,27 @@ class OSConfigRenderer(object):
         '''
         Returns a list of context interfaces that yield a complete context.
         '''
-        interfaces = []
-        [interfaces.extend(i.complete_contexts())
-         for i in six.itervalues(self.templates)]
-        return interfaces
+        with self.render_pass():
+            if self._complete_interfaces is None:
+                interfaces = []
+                [interfaces.extend(i.complete_contexts(self._context_results))
+                 for i in six.itervalues(self.templates)]
+                self._complete_interfaces = interfaces
+            return list(self._complete_interfaces)
+
+    def _interface_status(self, interface):
+        '''
+        Relation status of the distinct context generators of an interface,
+        as a list of (related, missing_data), evaluated once per render pass.
+        '''
+        status = []
+        for key, context in six.iteritems(
+                self._interface_contexts.get(interface, {})):
+            if key not in self._context_status:
+                self._context_status[key] = (context.get_related(),
+                                             context.missing_data)
+            status.append(self._context_status[key])
+        return status
 
     def get_incomplete_context_data(self, interfaces):
         '''
@@ -360,20 +646,16 @@ class OSConfigRenderer(object):
         '''
         incomplete_context_data = {}
 
-        for i in six.itervalues(self.templates):
-            for context in i.contexts:
-                for interface in interfaces:
-                    related = False
-                    if interface in context.interfaces:
-                        related = context.get_related()
-                        missing_data = context.missing_data
-                        if missing_data:
-                            incomplete_context_data[interface] = {'missing_data': missing_data}
-                        if related:
-                            if incomplete_context_data.get(interface):
-                                incomplete_context_data[interface].update({'related': True})
-                            else:
-                                incomplete_context_data[interface] = {'related': True}
+        with self.render_pass():
+            for interface in interfaces:
+                for related, missing_data in self._interface_status(interface):
+                    if missing_data:
+                        incomplete_context_data[interface] = {'missing_data': missing_data}
+                    if related:
+                        if incomplete_context_data.get(interface):
+                            incomplete_context_data[interface].update({'related': True})
                         else:
-                            incomplete_context_data[interface] = {'related': False}
+                            incomplete_context_data[interface] = {'related': True}
+                    else:
+                        incomplete_context_data[interface] = {'related': False}
         return incomplete_context_data
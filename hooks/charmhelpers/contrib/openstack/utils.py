@@ -76,13 +76,14 @@ from charmhelpers.contrib.network.ip import (
     get_ipv6_addr,
     is_ipv6,
     port_has_listener,
+    tcp_listeners,
 )
 
 from charmhelpers.core.host import (
     lsb_release,
     mounts,
     umount,
-    service_running,
+    service_states,
     service_pause,
     service_resume,
     service_stop,
@@ -97,6 +98,7 @@ from charmhelpers.fetch import (
     GPGKeyError,
     get_upstream_version,
     filter_missing_packages,
+    installed_versions,
     ubuntu_apt_pkg as apt,
 )
 
@@ -557,17 +559,25 @@ def get_os_version_package(pkg, fatal=True):
 
 # Module local cache variable for the os_release.
 _os_rel = None
+# unitdata key holding the last resolved os_release and what it was
+# resolved from
+OS_RELEASE_KEY = 'charmhelpers.openstack.os_release'
 
 
 def reset_os_release():
     '''Unset the cached os_release version'''
     global _os_rel
     _os_rel = None
+    unitdata.kv().unset(OS_RELEASE_KEY)
 
 
 def os_release(package, base=None, reset_cache=False, source_key=None):
     """Returns OpenStack release codename from a cached global.
 
+    The codename is also kept in unitdata along with the installed version
+    of package and the installation source, and reused by later hooks while
+    neither has changed.
+
     If reset_cache then unset the cached os_release version and return the
     freshly determined version.
 
@@ -595,10 +605,23 @@ def os_release(package, base=None, reset_cache=False, source_key=None):
         reset_os_release()
     if _os_rel:
         return _os_rel
+    resolved_from = {
+        'package': package,
+        'version': installed_versions([package])[package],
+        'source': config(source_key),
+        'base': base,
+    }
+    db = unitdata.kv()
+    saved = db.get(OS_RELEASE_KEY)
+    if saved and saved['resolved-from'] == resolved_from:
+        _os_rel = saved['release']
+        return _os_rel
     _os_rel = (
         get_os_codename_package(package, fatal=False) or
         get_os_codename_install_source(config(source_key)) or
         base)
+    db.set(OS_RELEASE_KEY, {'resolved-from': resolved_from,
+                            'release': _os_rel})
     return _os_rel
 
 
@@ -1246,7 +1269,8 @@ def _check_running_services(services):
     @returns [(service, boolean), ...], : results for checks
              [boolean]                  : just the result of the service checks
     """
-    services_running = [service_running(s) for s in services]
+    states = service_states(services)
+    services_running = [states[s]['running'] for s in services]
     return list(zip(services, services_running)), services_running
 
 
@@ -1264,7 +1288,9 @@ def _check_listening_on_services_ports(services, test=False):
     """
     test = not(not(test))  # ensure test is True or False
     all_ports = list(itertools.chain(*services.values()))
-    ports_states = [port_has_listener('0.0.0.0', p) for p in all_ports]
+    listeners = tcp_listeners()
+    ports_states = [port_has_listener('0.0.0.0', p, listeners)
+                    for p in all_ports]
     map_ports = OrderedDict()
     matched_ports = [p for p, opened in zip(all_ports, ports_states)
                      if opened == test]  # essentially opened xor test
@@ -1284,7 +1310,8 @@ def _check_listening_on_ports_list(ports):
     @param ports: LIST or port numbers.
     @returns [(port_num, boolean), ...], [boolean]
     """
-    ports_open = [port_has_listener('0.0.0.0', p) for p in ports]
+    listeners = tcp_listeners()
+    ports_open = [port_has_listener('0.0.0.0', p, listeners) for p in ports]
     return zip(ports, ports_open), ports_open
 
 
@@ -1345,14 +1372,16 @@ def incomplete_relation_data(configs, required_interfaces):
              {'pgsql-db': {'related': False},
               'shared-db': {'related': True}}}
     """
-    complete_ctxts = configs.complete_contexts()
-    incomplete_relations = [
-        svc_type
-        for svc_type, interfaces in required_interfaces.items()
-        if not set(interfaces).intersection(complete_ctxts)]
-    return {
-        i: configs.get_incomplete_context_data(required_interfaces[i])
-        for i in incomplete_relations}
+    # one render pass, so every interface is only evaluated once
+    with configs.render_pass():
+        complete_ctxts = configs.complete_contexts()
+        incomplete_relations = [
+            svc_type
+            for svc_type, interfaces in required_interfaces.items()
+            if not set(interfaces).intersection(complete_ctxts)]
+        return {
+            i: configs.get_incomplete_context_data(required_interfaces[i])
+            for i in incomplete_relations}
 
 
 def do_action_openstack_upgrade(package, upgrade_callback, configs):
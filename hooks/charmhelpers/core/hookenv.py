@@ -19,6 +19,7 @@
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
 from __future__ import print_function
+import atexit as _stdlib_atexit
 import copy
 from distutils.version import LooseVersion
 from enum import Enum
@@ -108,13 +109,65 @@ def flush(key):
         del cache[item]
 
 
+# Messages held back while log buffering is enabled, as (level, message).
+_log_buffer = None
+
+
 def log(message, level=None):
     """Write a message to the juju log"""
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    if _log_buffer is not None:
+        if level != ERROR:
+            _log_buffer.append((level, message))
+            return
+        flush_log()
+    _juju_log(message, level)
+
+
+def buffer_log():
+    """Hold log messages in memory and send them to juju-log in batches.
+
+    Consecutive messages at the same level are sent with a single juju-log
+    call.  The buffer is flushed before any ERROR message is logged, before
+    an uncaught exception is reported and when the process exits, so order
+    and levels are kept and nothing is lost if the hook fails.
+    """
+    global _log_buffer
+    if _log_buffer is not None:
+        return
+    _log_buffer = []
+    _stdlib_atexit.register(flush_log)
+    excepthook = sys.excepthook
+
+    def flush_excepthook(*args):
+        flush_log()
+        excepthook(*args)
+    sys.excepthook = flush_excepthook
+
+
+def flush_log():
+    """Send any buffered log messages to juju-log."""
+    if not _log_buffer:
+        return
+    batch_level, batch = None, []
+    pending = list(_log_buffer)
+    del _log_buffer[:]
+    for level, message in pending:
+        size = sum(len(m) + 1 for m in batch) + len(message)
+        if batch and (level != batch_level or size > SH_MAX_ARG):
+            _juju_log('\n'.join(batch), batch_level)
+            batch = []
+        batch_level = level
+        batch.append(message)
+    if batch:
+        _juju_log('\n'.join(batch), batch_level)
+
+
+def _juju_log(message, level=None):
     command = ['juju-log']
     if level:
         command += ['-l', level]
-    if not isinstance(message, six.string_types):
-        message = repr(message)
     command += [message[:SH_MAX_ARG]]
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
@@ -474,12 +527,58 @@ def relation_get(attribute=None, unit=None, rid=None):
         raise
 
 
+# Whether relation-set supports --file; probed once per process.
+_relation_set_accepts_file = None
+
+# Settings published in this hook, by relation id; saved to unitdata as the
+# record of what was last published once the hook succeeds.
+_published_relation_settings = None
+
+
+def _relation_set_supports_file():
+    global _relation_set_accepts_file
+    if _relation_set_accepts_file is None:
+        _relation_set_accepts_file = "--file" in subprocess.check_output(
+            ['relation-set', "--help"], universal_newlines=True)
+    return _relation_set_accepts_file
+
+
+def _published_key(rid):
+    return 'hookenv.relation_set.{}'.format(rid)
+
+
+def _last_published(rid):
+    """Settings this unit last published on rid, as far as unitdata knows"""
+    global _published_relation_settings
+    if _published_relation_settings is None:
+        _published_relation_settings = {}
+        atexit(_save_published_relation_settings)
+    if rid not in _published_relation_settings:
+        from charmhelpers.core import unitdata
+        _published_relation_settings[rid] = unitdata.kv().get(
+            _published_key(rid), {})
+    return _published_relation_settings[rid]
+
+
+def _save_published_relation_settings():
+    # only runs when the hook succeeds; if it fails juju discards the
+    # settings, and so must we.
+    from charmhelpers.core import unitdata
+    db = unitdata.kv()
+    for rid, settings in six.iteritems(_published_relation_settings):
+        db.set(_published_key(rid), settings)
+    db.flush()
+
+
 def relation_set(relation_id=None, relation_settings=None, **kwargs):
-    """Set relation information for the current unit"""
+    """Set relation information for the current unit
+
+    Settings identical to those this unit last published on the relation
+    are not sent again, so remote units do not run relation-changed hooks
+    for nothing.
+    """
     relation_settings = relation_settings if relation_settings else {}
     relation_cmd_line = ['relation-set']
-    accepts_file = "--file" in subprocess.check_output(
-        relation_cmd_line + ["--help"], universal_newlines=True)
     if relation_id is not None:
         relation_cmd_line.extend(('-r', relation_id))
     settings = relation_settings.copy()
@@ -489,7 +588,15 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
         # sites pass in things like dicts or numbers.
         if value is not None:
             settings[key] = "{}".format(value)
-    if accepts_file:
+    rid = relation_id or os.environ.get('JUJU_RELATION_ID')
+    if rid:
+        published = _last_published(rid)
+        if all(k in published and published[k] == v
+               for k, v in settings.items()):
+            log('Relation settings for {} unchanged, not publishing'.format(
+                rid), level=DEBUG)
+            return
+    if _relation_set_supports_file():
         # --file was introduced in Juju 1.23.2. Use it by default if
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
@@ -506,8 +613,115 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
             else:
                 relation_cmd_line.append('{}={}'.format(key, value))
         subprocess.check_call(relation_cmd_line)
+    if rid:
+        published.update(settings)
     # Flush cache of any relation-gets for local unit
     flush(local_unit())
+    relation_snapshot().invalidate(unit=local_unit())
+    _run_relation_set_callbacks()
+
+
+_relation_set_callbacks = []
+
+
+def on_relation_set(callback, *args, **kwargs):
+    '''Schedule a callback to run each time this unit publishes relation data
+    with :func:`relation_set`.
+
+    This allows helpers which derive state from relation data to drop
+    anything they have cached for the remainder of the hook.'''
+    _relation_set_callbacks.append((callback, args, kwargs))
+
+
+def _run_relation_set_callbacks():
+    for callback, args, kwargs in _relation_set_callbacks:
+        callback(*args, **kwargs)
+
+
+class RelationSnapshot(object):
+    """In-memory view of the relation data visible to this hook.
+
+    Each (relation id, unit) settings bag is loaded with a single
+    ``relation-get --format=json -r <rid> - <unit>`` call the first time any
+    of its keys is needed, and every later lookup is served from memory.
+    This avoids one relation-get subprocess per attribute when code walks
+    the same units repeatedly looking for different settings.
+
+    Use :func:`relation_snapshot` to get the instance shared by the hook;
+    :func:`relation_set` invalidates the bags of the local unit.
+
+    Example::
+
+        snapshot = relation_snapshot()
+        for rid, unit, data in snapshot.iter_units('cloud-compute'):
+            if data.get('network_manager'):
+                ...
+    """
+
+    def __init__(self):
+        self._bags = {}
+
+    def _resolve(self, rid=None, unit=None):
+        return (rid or relation_id(), unit or remote_unit())
+
+    def bag(self, rid=None, unit=None):
+        """Return the settings of unit on relation rid.
+
+        rid and unit default to the relation and remote unit of the current
+        hook.  The returned dict is shared and must not be modified.
+
+        :returns: Relation settings, or None if they could not be resolved.
+        :rtype: Optional[dict]
+        """
+        key = self._resolve(rid, unit)
+        if None in key:
+            return None
+        if key not in self._bags:
+            self._bags[key] = relation_get(rid=key[0], unit=key[1]) or {}
+        return self._bags[key]
+
+    def get(self, attribute=None, unit=None, rid=None):
+        """Drop-in replacement for :func:`relation_get` backed by the
+        snapshot."""
+        data = self.bag(rid=rid, unit=unit)
+        if data is None:
+            # Outside of a relation context; defer to the hook tool so the
+            # behaviour (and errors) match relation_get exactly.
+            return relation_get(attribute=attribute, unit=unit, rid=rid)
+        if attribute is None:
+            return dict(data)
+        return data.get(attribute)
+
+    def iter_units(self, reltype):
+        """Yield (rid, unit, settings) for every unit related via reltype."""
+        for rid in relation_ids(reltype):
+            for unit in related_units(rid):
+                yield rid, unit, self.bag(rid=rid, unit=unit)
+
+    def invalidate(self, rid=None, unit=None):
+        """Forget cached bags matching rid and/or unit (all if neither)."""
+        for key in list(self._bags):
+            if ((rid is None or key[0] == rid) and
+                    (unit is None or key[1] == unit)):
+                del self._bags[key]
+
+
+_relation_snapshot = None
+
+
+def relation_snapshot():
+    """Return the RelationSnapshot shared by the current hook execution."""
+    global _relation_snapshot
+    if _relation_snapshot is None:
+        _relation_snapshot = RelationSnapshot()
+    return _relation_snapshot
+
+
+def snapshot_relation_get(attribute=None, unit=None, rid=None):
+    """Get relation information via the hook's :class:`RelationSnapshot`.
+
+    Takes the same arguments as :func:`relation_get`."""
+    return relation_snapshot().get(attribute=attribute, unit=unit, rid=rid)
 
 
 def relation_clear(r_id=None):
@@ -944,8 +1158,10 @@ class Hooks(object):
             except SystemExit as x:
                 if x.code is None or x.code == 0:
                     _run_atexit()
+                    _flush_unitdata()
                 raise
             _run_atexit()
+            _flush_unitdata()
         else:
             raise UnregisteredHookError(hook_name)
 
@@ -1333,6 +1549,13 @@ def _run_atstart():
     del _atstart[:]
 
 
+def _flush_unitdata():
+    '''Write back the unit state modified by a successful hook.'''
+    from charmhelpers.core import unitdata
+    if unitdata._KV is not None:
+        unitdata._KV.flush()
+
+
 def _run_atexit():
     '''Hook frameworks must invoke this after the main hook body has
     successfully completed. Do not invoke it if the hook fails.'''
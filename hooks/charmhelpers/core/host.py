@@ -257,6 +257,8 @@ def service(action, service_name, **kwargs):
     :param **kwargs: additional params to be passed to the service command in
                     the form of key=value.
     """
+    if action not in ('is-active', 'status'):
+        _service_states.pop(service_name, None)
     if init_is_systemd():
         cmd = ['systemctl', action, service_name]
     else:
@@ -308,6 +310,72 @@ def service_running(service_name, **kwargs):
         return False
 
 
+# systemd ActiveStates for which ``systemctl is-active`` succeeds
+SYSTEMD_RUNNING_STATES = ('active', 'reloading')
+# Service states queried by service_states() in this hook, by service name;
+# controlling a service through service() drops its state.
+_service_states = {}
+
+
+def service_states(service_names, refresh=False):
+    """Get the state of several services at once.
+
+    On systemd all the services are queried with a single ``systemctl show``
+    call, otherwise (or if that fails) service_running() is called for each
+    service.  States are kept for the rest of the hook so that status,
+    pause/resume and monitoring checks can share them; starting, stopping or
+    otherwise controlling a service with service() drops its state.
+
+    :param service_names: Names of the services
+    :type service_names: Iterable[str]
+    :param refresh: Query all the services again
+    :type refresh: bool
+    :returns: State of each service with the keys running, active_state,
+              sub_state and main_pid (None if not known)
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+    service_names = list(service_names)
+    if refresh:
+        for name in service_names:
+            _service_states.pop(name, None)
+    unknown = [name for name in OrderedDict.fromkeys(service_names)
+               if name not in _service_states]
+    if unknown and init_is_systemd():
+        try:
+            _service_states.update(_systemctl_show(unknown))
+        except subprocess.CalledProcessError:
+            pass
+    for name in unknown:
+        if name not in _service_states:
+            _service_states[name] = {
+                'running': service_running(name), 'active_state': None,
+                'sub_state': None, 'main_pid': None}
+    return {name: dict(_service_states[name]) for name in service_names}
+
+
+def _systemctl_show(service_names):
+    """State of services from one ``systemctl show`` call.
+
+    systemctl prints the properties of each unit in the order they were
+    asked for, separated by blank lines; units that do not exist are
+    reported as inactive.
+    """
+    output = subprocess.check_output(
+        ['systemctl', 'show', '-p', 'ActiveState,SubState,MainPID'] +
+        service_names, universal_newlines=True)
+    states = {}
+    for name, block in zip(service_names, output.strip().split('\n\n')):
+        props = dict(line.split('=', 1) for line in block.splitlines()
+                     if '=' in line)
+        states[name] = {
+            'running': props.get('ActiveState') in SYSTEMD_RUNNING_STATES,
+            'active_state': props.get('ActiveState'),
+            'sub_state': props.get('SubState'),
+            'main_pid': int(props.get('MainPID') or 0) or None,
+        }
+    return states
+
+
 SYSTEMD_SYSTEM = '/run/systemd/system'
 
 
@@ -666,6 +734,25 @@ def path_hash(path):
     }
 
 
+# Paths whose writers report every change through file_changed(), and the
+# changes reported so far in this hook.
+_tracked_paths = set()
+_changed_paths = []
+
+
+def track_file_changes(path):
+    """Declare that every change to the content of 'path' will be reported
+    through file_changed(), so restart_on_change() does not need to checksum
+    the file to notice it.
+    """
+    _tracked_paths.add(path)
+
+
+def file_changed(path):
+    """Record that the content of 'path' has been changed."""
+    _changed_paths.append(path)
+
+
 def check_hash(path, checksum, hash_type='md5'):
     """Validate a file using a cryptographic checksum.
 
@@ -737,12 +824,27 @@ def restart_on_change_helper(lambda_f, restart_map, stopstart=False,
     """
     if restart_functions is None:
         restart_functions = {}
-    checksums = {path: path_hash(path) for path in restart_map}
+    # files whose changes are reported by their writer are not checksummed
+    checksums = {path: path_hash(path) for path in restart_map
+                 if path not in _tracked_paths}
+    reported_from = len(_changed_paths)
     r = lambda_f()
+    reported = set(_changed_paths[reported_from:])
+
+    def changed(path):
+        if path in reported:
+            return True
+        if path not in checksums:
+            return False
+        if path in _tracked_paths:
+            # became tracked while lambda_f ran; its writer reported nothing
+            return False
+        return path_hash(path) != checksums[path]
+
     # create a list of lists of the services to restart
     restarts = [restart_map[path]
                 for path in restart_map
-                if path_hash(path) != checksums[path]]
+                if changed(path)]
     # create a flat list of ordered services without duplicates from lists
     services_list = list(OrderedDict.fromkeys(itertools.chain(*restarts)))
     if services_list:
@@ -149,7 +149,6 @@ associated to the hookname.
 import collections
 import contextlib
 import datetime
-import itertools
 import json
 import os
 import pprint
@@ -164,6 +163,15 @@ class Storage(object):
 
     Modifications are not persisted unless :meth:`flush` is called.
 
+    The kv table is read once and cached in memory; modifications are
+    held in the cache and written back in a single transaction when
+    :meth:`flush` is called.  :class:`charmhelpers.core.hookenv.Hooks`
+    flushes :func:`kv` when a hook completes successfully.
+
+    Passing wal=True (or calling :meth:`enable_wal`) switches the
+    database to write-ahead logging with synchronous=NORMAL, so a flush
+    does not have to fsync the database.
+
     To support dicts, lists, integer, floats, and booleans values
     are automatically json encoded/decoded.
 
@@ -171,7 +179,7 @@ class Storage(object):
     path parameter which causes sqlite3 to only build the db in memory.
     This should only be used for testing purposes.
     """
-    def __init__(self, path=None):
+    def __init__(self, path=None, wal=False):
         self.db_path = path
         if path is None:
             if 'UNIT_STATE_DB' in os.environ:
@@ -186,7 +194,39 @@ class Storage(object):
         self.cursor = self.conn.cursor()
         self.revision = None
         self._closed = False
+        # key -> serialized data, loaded on first use
+        self._cache = None
+        # key -> serialized data, or None if deleted, since the last flush
+        self._dirty = {}
+        # (key, revision) -> serialized data since the last flush
+        self._revisions = {}
+        self.wal = False
         self._init()
+        if wal:
+            self.enable_wal()
+
+    def enable_wal(self):
+        """Use write-ahead logging with synchronous=NORMAL.
+
+        Committed transactions remain atomic and survive a crash of the
+        hook, but may be lost on power failure until the next checkpoint.
+        """
+        if self.wal or self.db_path == ':memory:':
+            return
+        self.flush()
+        self.cursor.execute('pragma journal_mode=wal')
+        self.cursor.execute('pragma synchronous=normal')
+        self.wal = True
+
+    def _data(self):
+        if self._cache is None:
+            self.cursor.execute('select key, data from kv')
+            self._cache = dict(self.cursor.fetchall())
+        return self._cache
+
+    def _record(self, key, serialized):
+        if self.revision:
+            self._revisions[(key, self.revision)] = serialized
 
     def close(self):
         if self._closed:
@@ -197,13 +237,12 @@ class Storage(object):
         self._closed = True
 
     def get(self, key, default=None, record=False):
-        self.cursor.execute('select data from kv where key=?', [key])
-        result = self.cursor.fetchone()
-        if not result:
+        data = self._data().get(key)
+        if data is None:
             return default
         if record:
-            return Record(json.loads(result[0]))
-        return json.loads(result[0])
+            return Record(json.loads(data))
+        return json.loads(data)
 
     def getrange(self, key_prefix, strip=False):
         """
@@ -215,16 +254,10 @@ class Storage(object):
             names in the returned dict
         :return dict: A (possibly empty) dict of key-value mappings
         """
-        self.cursor.execute("select key, data from kv where key like ?",
-                            ['%s%%' % key_prefix])
-        result = self.cursor.fetchall()
-
-        if not result:
-            return {}
-        if not strip:
-            key_prefix = ''
+        offset = len(key_prefix) if strip else 0
         return dict([
-            (k[len(key_prefix):], json.loads(v)) for k, v in result])
+            (k[offset:], json.loads(v)) for k, v in self._data().items()
+            if k.startswith(key_prefix)])
 
     def update(self, mapping, prefix=""):
         """
@@ -241,11 +274,9 @@ class Storage(object):
         """
         Remove a key from the database entirely.
         """
-        self.cursor.execute('delete from kv where key=?', [key])
-        if self.revision and self.cursor.rowcount:
-            self.cursor.execute(
-                'insert into kv_revisions values (?, ?, ?)',
-                [key, self.revision, json.dumps('DELETED')])
+        if self._data().pop(key, None) is not None:
+            self._dirty[key] = None
+            self._record(key, json.dumps('DELETED'))
 
     def unsetrange(self, keys=None, prefix=""):
         """
@@ -256,20 +287,22 @@ class Storage(object):
         :param str prefix: Optional prefix to apply to all keys in ``keys``
             before removing.
         """
+        data = self._data()
         if keys is not None:
             keys = ['%s%s' % (prefix, key) for key in keys]
-            self.cursor.execute('delete from kv where key in (%s)' % ','.join(['?'] * len(keys)), keys)
-            if self.revision and self.cursor.rowcount:
-                self.cursor.execute(
-                    'insert into kv_revisions values %s' % ','.join(['(?, ?, ?)'] * len(keys)),
-                    list(itertools.chain.from_iterable((key, self.revision, json.dumps('DELETED')) for key in keys)))
+            removed = [key for key in keys if data.pop(key, None) is not None]
+            recorded = keys
         else:
-            self.cursor.execute('delete from kv where key like ?',
-                                ['%s%%' % prefix])
-            if self.revision and self.cursor.rowcount:
-                self.cursor.execute(
-                    'insert into kv_revisions values (?, ?, ?)',
-                    ['%s%%' % prefix, self.revision, json.dumps('DELETED')])
+            removed = [key for key in data if key.startswith(prefix)]
+            for key in removed:
+                del data[key]
+            recorded = ['%s%%' % prefix]
+        if not removed:
+            return
+        for key in removed:
+            self._dirty[key] = None
+        for key in recorded:
+            self._record(key, json.dumps('DELETED'))
 
     def set(self, key, value):
         """
@@ -279,48 +312,15 @@ class Storage(object):
         :param value: Any JSON-serializable value to be set
         """
         serialized = json.dumps(value)
-
-        self.cursor.execute('select data from kv where key=?', [key])
-        exists = self.cursor.fetchone()
+        data = self._data()
 
         # Skip mutations to the same value
-        if exists:
-            if exists[0] == serialized:
-                return value
-
-        if not exists:
-            self.cursor.execute(
-                'insert into kv (key, data) values (?, ?)',
-                (key, serialized))
-        else:
-            self.cursor.execute('''
-            update kv
-            set data = ?
-            where key = ?''', [serialized, key])
-
-        # Save
-        if not self.revision:
+        if data.get(key) == serialized:
             return value
 
-        self.cursor.execute(
-            'select 1 from kv_revisions where key=? and revision=?',
-            [key, self.revision])
-        exists = self.cursor.fetchone()
-
-        if not exists:
-            self.cursor.execute(
-                '''insert into kv_revisions (
-                revision, key, data) values (?, ?, ?)''',
-                (self.revision, key, serialized))
-        else:
-            self.cursor.execute(
-                '''
-                update kv_revisions
-                set data = ?
-                where key = ?
-                and   revision = ?''',
-                [serialized, key, self.revision])
-
+        data[key] = serialized
+        self._dirty[key] = serialized
+        self._record(key, serialized)
         return value
 
     def delta(self, mapping, prefix):
@@ -372,12 +372,33 @@ class Storage(object):
         else:
             self.flush()
 
+    def _write_back(self):
+        """Write the pending modifications in the current transaction"""
+        if self._dirty:
+            self.cursor.executemany(
+                'delete from kv where key=?',
+                [(k,) for k, v in self._dirty.items() if v is None])
+            self.cursor.executemany(
+                'insert or replace into kv (key, data) values (?, ?)',
+                [(k, v) for k, v in self._dirty.items() if v is not None])
+            self._dirty = {}
+        if self._revisions:
+            self.cursor.executemany(
+                '''insert or replace into kv_revisions (
+                key, revision, data) values (?, ?, ?)''',
+                [(k, r, v) for (k, r), v in self._revisions.items()])
+            self._revisions = {}
+
     def flush(self, save=True):
         if save:
+            self._write_back()
             self.conn.commit()
         elif self._closed:
             return
         else:
+            self._dirty = {}
+            self._revisions = {}
+            self._cache = None
             self.conn.rollback()
 
     def _init(self):
@@ -394,6 +415,9 @@ class Storage(object):
                data text,
                primary key (key, revision)
                )''')
+        self.cursor.execute('''
+            create index if not exists kv_revisions_revision
+               on kv_revisions (revision)''')
         self.cursor.execute('''
             create table if not exists hooks (
                version integer primary key autoincrement,
@@ -402,7 +426,63 @@ class Storage(object):
                )''')
         self.conn.commit()
 
+    def size(self):
+        """Size of the database in bytes, including its write-ahead log"""
+        if self.db_path == ':memory:':
+            self.cursor.execute('pragma page_count')
+            pages = self.cursor.fetchone()[0]
+            self.cursor.execute('pragma page_size')
+            return pages * self.cursor.fetchone()[0]
+        size = os.path.getsize(self.db_path)
+        if os.path.exists(self.db_path + '-wal'):
+            size += os.path.getsize(self.db_path + '-wal')
+        return size
+
+    def compact(self, max_revisions=None, max_hooks=None, max_age=None):
+        """Prune the hook history and reclaim the space it used.
+
+        Pending modifications are flushed first.  Hook executions beyond
+        the newest max_hooks, or older than max_age seconds, are removed
+        along with the revisions they recorded, then all but the newest
+        max_revisions revisions of each key are removed.  The current
+        values in the kv table are never touched.
+
+        :param int max_revisions: Revisions to keep per key
+        :param int max_hooks: Hook executions to keep
+        :param int max_age: Maximum age in seconds of hook executions kept
+        :return tuple: Size of the database in bytes before and after
+        """
+        assert not self.revision
+        self.flush()
+        before = self.size()
+        if max_hooks is not None:
+            self.cursor.execute('''
+                delete from hooks where version not in (
+                    select version from hooks
+                    order by version desc limit ?)''', [max_hooks])
+        if max_age is not None:
+            cutoff = (datetime.datetime.utcnow() -
+                      datetime.timedelta(seconds=max_age))
+            self.cursor.execute('delete from hooks where date < ?',
+                                [cutoff.isoformat()])
+        self.cursor.execute('''
+            delete from kv_revisions where revision not in (
+                select version from hooks)''')
+        if max_revisions is not None:
+            self.cursor.execute('''
+                delete from kv_revisions where (
+                    select count(*) from kv_revisions newer
+                    where newer.key = kv_revisions.key
+                    and   newer.revision > kv_revisions.revision
+                    ) >= ?''', [max_revisions])
+        self.conn.commit()
+        self.cursor.execute('vacuum')
+        if self.wal:
+            self.cursor.execute('pragma wal_checkpoint(truncate)')
+        return before, self.size()
+
     def gethistory(self, key, deserialize=False):
+        self._write_back()
         self.cursor.execute(
             '''
             select kv.revision, kv.key, kv.data, h.hook, h.date
@@ -416,6 +496,7 @@ class Storage(object):
         return map(_parse_history, self.cursor.fetchall())
 
     def debug(self, fh=sys.stderr):
+        self._write_back()
         self.cursor.execute('select * from kv')
         pprint.pprint(self.cursor.fetchall(), stream=fh)
         self.cursor.execute('select * from kv_revisions')
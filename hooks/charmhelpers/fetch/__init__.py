@@ -103,6 +103,8 @@ if __platform__ == "ubuntu":
     apt_unhold = fetch.apt_unhold
     import_key = fetch.import_key
     get_upstream_version = fetch.get_upstream_version
+    installed_versions = fetch.installed_versions
+    invalidate_package_state = fetch.invalidate_package_state
     apt_pkg = fetch.ubuntu_apt_pkg
     get_apt_dpkg_env = fetch.get_apt_dpkg_env
 elif __platform__ == "centos":
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from collections import OrderedDict
+import os
 import platform
 import re
 import six
@@ -20,6 +21,7 @@ import subprocess
 import sys
 import time
 
+from charmhelpers.core import unitdata
 from charmhelpers.core.host import get_distrib_codename, get_system_env
 
 from charmhelpers.core.hookenv import (
@@ -197,19 +199,67 @@ APT_NO_LOCK = 100  # The return code for "couldn't acquire lock" in APT.
 CMD_RETRY_DELAY = 10  # Wait 10 seconds between command retries.
 CMD_RETRY_COUNT = 3  # Retry a failing fatal command X times.
 
+DPKG_STATUS = ubuntu_apt_pkg.DPKG_STATUS
+# unitdata key caching the installed packages, see installed_versions()
+PACKAGE_STATE_KEY = 'fetch.ubuntu.package-state'
+_package_state = None
+
+
+def _dpkg_status_stat():
+    try:
+        st = os.stat(DPKG_STATUS)
+    except OSError:
+        return None
+    # dpkg replaces the status file, so the inode changes too
+    return [st.st_ino, st.st_size, st.st_mtime]
+
+
+def installed_versions(packages):
+    """Get the installed version of packages.
+
+    The result of querying dpkg is cached in unitdata, shared between
+    hooks for as long as the dpkg status database is unchanged.  Package
+    operations made through this module drop the cache.
+
+    :param packages: Names of packages
+    :type packages: List[str]
+    :returns: Installed version of each package, None if not installed
+    :rtype: Dict[str, Optional[str]]
+    """
+    global _package_state
+    stat = _dpkg_status_stat()
+    if _package_state is None and stat is not None:
+        _package_state = unitdata.kv().get(PACKAGE_STATE_KEY)
+    if not _package_state or _package_state['dpkg-status'] != stat:
+        _package_state = {'dpkg-status': stat, 'packages': {}}
+    versions = _package_state['packages']
+    missing = [p for p in OrderedDict.fromkeys(packages) if p not in versions]
+    if missing:
+        installed = ubuntu_apt_pkg.Cache()._dpkg_list(missing)
+        for package in missing:
+            versions[package] = installed.get(package, {}).get('version')
+        if stat is not None:
+            unitdata.kv().set(PACKAGE_STATE_KEY, _package_state)
+    return {p: versions[p] for p in packages}
+
+
+def invalidate_package_state():
+    """Drop the cached package state after changing installed packages."""
+    global _package_state
+    _package_state = None
+    unitdata.kv().unset(PACKAGE_STATE_KEY)
+
 
 def filter_installed_packages(packages):
     """Return a list of packages that require installation."""
-    cache = apt_cache()
-    _pkgs = []
-    for package in packages:
-        try:
-            p = cache[package]
-            p.current_ver or _pkgs.append(package)
-        except KeyError:
-            log('Package {} has no installation candidate.'.format(package),
-                level='WARNING')
-            _pkgs.append(package)
+    versions = installed_versions(packages)
+    _pkgs = [package for package in packages if not versions[package]]
+    if _pkgs:
+        candidates = apt_cache()._apt_cache_show(_pkgs)
+        for package in _pkgs:
+            if package not in candidates:
+                log('Package {} has no installation candidate.'
+                    .format(package), level='WARNING')
     return _pkgs
 
 
@@ -273,7 +323,10 @@ def apt_install(packages, options=None, fatal=False):
         cmd.extend(packages)
     log("Installing {} with options: {}".format(packages,
                                                 options))
-    _run_apt_command(cmd, fatal)
+    try:
+        _run_apt_command(cmd, fatal)
+    finally:
+        invalidate_package_state()
 
 
 def apt_upgrade(options=None, fatal=False, dist=False):
@@ -298,7 +351,10 @@ def apt_upgrade(options=None, fatal=False, dist=False):
     else:
         cmd.append('upgrade')
     log("Upgrading with options: {}".format(options))
-    _run_apt_command(cmd, fatal)
+    try:
+        _run_apt_command(cmd, fatal)
+    finally:
+        invalidate_package_state()
 
 
 def apt_update(fatal=False):
@@ -323,7 +379,10 @@ def apt_purge(packages, fatal=False):
     else:
         cmd.extend(packages)
     log("Purging {}".format(packages))
-    _run_apt_command(cmd, fatal)
+    try:
+        _run_apt_command(cmd, fatal)
+    finally:
+        invalidate_package_state()
 
 
 def apt_autoremove(purge=True, fatal=False):
@@ -338,7 +397,10 @@ def apt_autoremove(purge=True, fatal=False):
     cmd = ['apt-get', '--assume-yes', 'autoremove']
     if purge:
         cmd.append('--purge')
-    _run_apt_command(cmd, fatal)
+    try:
+        _run_apt_command(cmd, fatal)
+    finally:
+        invalidate_package_state()
 
 
 def apt_mark(packages, mark, fatal=False):
@@ -777,18 +839,11 @@ def get_upstream_version(package):
 
     @returns None (if not installed) or the upstream version
     """
-    cache = apt_cache()
-    try:
-        pkg = cache[package]
-    except Exception:
-        # the package is unknown to the current apt cache.
-        return None
-
-    if not pkg.current_ver:
-        # package is known, but no version is currently installed.
+    version = installed_versions([package])[package]
+    if not version:
         return None
 
-    return ubuntu_apt_pkg.upstream_version(pkg.current_ver.ver_str)
+    return ubuntu_apt_pkg.upstream_version(version)
 
 
 def get_apt_dpkg_env():
@@ -35,11 +35,28 @@ so with this we get rid of the dependency.
 2: https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=845330#10
 """
 
+import io
 import locale
 import os
 import subprocess
 import sys
 
+DPKG_STATUS = '/var/lib/dpkg/status'
+# Fields of the dpkg status file kept in the index, as written by dpkg.
+DPKG_STATUS_FIELDS = ('Package', 'Status', 'Version', 'Architecture',
+                      'Description')
+_DPKG_STATUS_PREFIXES = tuple(f + ':' for f in DPKG_STATUS_FIELDS)
+# Abbreviations of the Status field used by ``dpkg-query --list``.
+DPKG_WANT = {'unknown': 'u', 'install': 'i', 'hold': 'h',
+             'deinstall': 'r', 'purge': 'p'}
+DPKG_STATE = {'not-installed': 'n', 'config-files': 'c',
+              'half-installed': 'H', 'unpacked': 'U',
+              'half-configured': 'F', 'triggers-awaited': 'W',
+              'triggers-pending': 't', 'installed': 'i'}
+
+# (stat of DPKG_STATUS, index) of the last parse
+_dpkg_status = None
+
 
 class _container(dict):
     """Simple container for attributes."""
@@ -55,8 +72,109 @@ class Version(_container):
     """Simple container for version attributes."""
 
 
+def parse_dpkg_status(lines):
+    """Parse the stanzas of a dpkg status file.
+
+    Only the fields in DPKG_STATUS_FIELDS are kept, and only the first line
+    of multi-line fields.  Field names are matched as dpkg writes them.
+
+    :param lines: Lines of the status file
+    :type lines: Iterable[str]
+    :returns: Fields of each stanza, keys in lower case
+    :rtype: Iterator[Dict[str, str]]
+    """
+    fields = {}
+    for line in lines:
+        if line.startswith(_DPKG_STATUS_PREFIXES):
+            key, _, value = line.partition(':')
+            fields[key.lower()] = value.strip()
+        elif fields and not line.strip():
+            yield fields
+            fields = {}
+    if fields:
+        yield fields
+
+
+def dpkg_status_abbrev(status):
+    """Abbreviate a Status field the way ``dpkg-query --list`` does.
+
+    :param status: Status field, eg. 'install ok installed'
+    :type status: str
+    :returns: Abbreviated status, eg. 'ii'
+    :rtype: str
+    """
+    try:
+        want, flag, state = status.split()
+    except ValueError:
+        return ''
+    abbrev = DPKG_WANT.get(want, '?') + DPKG_STATE.get(state, '?')
+    if flag == 'reinstreq':
+        abbrev += 'R'
+    return abbrev
+
+
+def dpkg_status_index(path=DPKG_STATUS):
+    """Index the packages in the dpkg status database in one pass.
+
+    Packages are indexed by name and by name:architecture.  When a package
+    is known for several architectures the name refers to an installed one.
+
+    :param path: Path of the dpkg status file
+    :type path: str
+    :returns: Package name to its name, status, version, architecture and
+              description
+    :rtype: Dict[str, Dict[str, str]]
+    :raises: IOError, OSError
+    """
+    index = {}
+    abbrevs = {}
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        for fields in parse_dpkg_status(f):
+            name = fields.get('package')
+            if not name:
+                continue
+            status = fields.get('status', '')
+            if status not in abbrevs:
+                abbrevs[status] = dpkg_status_abbrev(status)
+            pkg = {
+                'name': name,
+                'status': abbrevs[status],
+                'version': fields.get('version'),
+                'architecture': fields.get('architecture'),
+                'description': fields.get('description', ''),
+            }
+            if pkg['architecture']:
+                index[name + ':' + pkg['architecture']] = pkg
+            if name not in index or pkg['status'] == 'ii':
+                index[name] = pkg
+    return index
+
+
+def _dpkg_status_index():
+    """The index of DPKG_STATUS, parsed again only when it has changed.
+
+    :returns: Index as returned by dpkg_status_index, None if the status
+              file can not be read
+    :rtype: Optional[Dict[str, Dict[str, str]]]
+    """
+    global _dpkg_status
+    try:
+        st = os.stat(DPKG_STATUS)
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        if _dpkg_status is None or _dpkg_status[0] != key:
+            _dpkg_status = (key, dpkg_status_index(DPKG_STATUS))
+    except (IOError, OSError):
+        _dpkg_status = None
+        return None
+    return _dpkg_status[1]
+
+
 class Cache(object):
-    """Simulation of ``apt_pkg`` Cache object."""
+    """Simulation of ``apt_pkg`` Cache object.
+
+    Installed packages are looked up in the dpkg status database, the apt
+    cache is only queried for packages that are not installed.
+    """
     def __init__(self, progress=None):
         pass
 
@@ -76,6 +194,12 @@ class Cache(object):
         :rtype: object
         :raises: KeyError, subprocess.CalledProcessError
         """
+        installed = self._dpkg_list([package]).get(package)
+        if installed:
+            pkg = Package({k: v for k, v in installed.items()
+                           if k != 'status'})
+            pkg.current_ver = Version({'ver_str': installed['version']})
+            return pkg
         apt_result = self._apt_cache_show([package])[package]
         apt_result['name'] = apt_result.pop('package')
         pkg = Package(apt_result)
@@ -91,6 +215,26 @@ class Cache(object):
     def _dpkg_list(self, packages):
         """Get data from system dpkg database for package.
 
+        :param packages: Packages to get data from
+        :type packages: List[str]
+        :returns: Structured data about installed packages, keys like
+                  ``dpkg-query --list``
+        :rtype: dict
+        :raises: subprocess.CalledProcessError
+        """
+        index = _dpkg_status_index()
+        if index is None:
+            return self._dpkg_query_list(packages)
+        pkgs = {}
+        for package in packages:
+            pkg = index.get(package)
+            if pkg and pkg['status'] == 'ii':
+                pkgs[package] = dict(pkg)
+        return pkgs
+
+    def _dpkg_query_list(self, packages):
+        """Get data from system dpkg database for package with dpkg-query.
+
         :param packages: Packages to get data from
         :type packages: List[str]
         :returns: Structured data about installed packages, keys like
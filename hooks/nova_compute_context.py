@@ -22,17 +22,28 @@ from charmhelpers.core.unitdata import kv
 from charmhelpers.contrib.openstack import context
 
 from charmhelpers.core.host import (
-    lsb_release,
     CompareHostReleases,
 )
 from charmhelpers.core.strutils import (
     bool_from_string,
 )
 from charmhelpers.fetch import apt_install, filter_installed_packages
+from nova_compute_cpu import cpu_partitioning_enabled, cpu_sets
+from nova_compute_facts import lsb_release
+from nova_compute_hugepages import (
+    hugepage_allocation,
+    hugepage_mounts,
+    is_hugepages_spec,
+    reserved_hugepages,
+)
+from nova_compute_memory import (
+    format_reservation,
+    hook_reserved_host_memory,
+)
 from charmhelpers.core.hookenv import (
     config,
     log,
-    relation_get,
+    snapshot_relation_get as relation_get,
     relation_ids,
     related_units,
     service_name,
@@ -251,10 +262,23 @@ class NovaComputeLibvirtContext(context.OSContextGenerator):
 
         if config('hugepages'):
             ctxt['hugepages'] = True
+        # a spec mounts a hugetlbfs per page size instead of
+        # /run/hugepages/kvm
+        if config('hugepages') and not is_hugepages_spec(config('hugepages')):
             ctxt['kvm_hugepages'] = 1
         else:
             ctxt['kvm_hugepages'] = 0
 
+        hugepages_allocation = None
+        if is_hugepages_spec(config('hugepages')):
+            try:
+                hugepages_allocation = hugepage_allocation(config('hugepages'))
+            except ValueError as e:
+                log('Invalid hugepages: {}'.format(e), level=ERROR)
+            else:
+                ctxt['hugetlbfs_mounts'] = list(
+                    hugepage_mounts(hugepages_allocation).values())
+
         if config('ksm') in ("1", "0",):
             ctxt['ksm'] = config('ksm')
         else:
@@ -270,6 +294,12 @@ class NovaComputeLibvirtContext(context.OSContextGenerator):
             # consider separate the option's values per semicolons.
             ctxt['reserved_huge_pages'] = (
                 [o.strip() for o in config('reserved-huge-pages').split(";")])
+        elif hugepages_allocation is not None:
+            # pages of the sizes the charm does not allocate belong to
+            # something else on the host
+            reserved = reserved_hugepages(hugepages_allocation)
+            if reserved:
+                ctxt['reserved_huge_pages'] = reserved
 
         if config('pci-passthrough-whitelist'):
             ctxt['pci_passthrough_whitelist'] = \
@@ -281,15 +311,35 @@ class NovaComputeLibvirtContext(context.OSContextGenerator):
         if config('vcpu-pin-set'):
             ctxt['vcpu_pin_set'] = config('vcpu-pin-set')
 
-        if config('cpu-shared-set'):
-            ctxt['cpu_shared_set'] = config('cpu-shared-set')
-        if config('cpu-dedicated-set'):
-            ctxt['cpu_dedicated_set'] = config('cpu-dedicated-set')
-            if ctxt['vcpu_pin_set']:
-                w = ("Ignoring vcpu-pin-set config since that option can't be "
-                     "used with cpu-dedicated-set.")
-                log(w, level=WARNING)
-                ctxt['vcpu_pin_set'] = None
+        if cpu_partitioning_enabled(config('cpu-dedicated-set')):
+            try:
+                auto_cpu_sets = cpu_sets(config('cpu-dedicated-set'),
+                                         config('cpu-host-cores'))
+            except ValueError as e:
+                log('Could not partition the CPUs: {}'.format(e), level=ERROR)
+            else:
+                if config('cpu-shared-set') or config('vcpu-pin-set'):
+                    log('Ignoring cpu-shared-set and vcpu-pin-set config '
+                        'since cpu-dedicated-set is auto.', level=WARNING)
+                ctxt['cpu_shared_set'] = auto_cpu_sets['cpu_shared_set']
+                # NOTE: before train the dedicated CPUs are the ones guests
+                #       may be pinned to.
+                if cmp_os_release >= 'train':
+                    ctxt['cpu_dedicated_set'] = (
+                        auto_cpu_sets['cpu_dedicated_set'])
+                    ctxt['vcpu_pin_set'] = None
+                else:
+                    ctxt['vcpu_pin_set'] = auto_cpu_sets['cpu_dedicated_set']
+        else:
+            if config('cpu-shared-set'):
+                ctxt['cpu_shared_set'] = config('cpu-shared-set')
+            if config('cpu-dedicated-set'):
+                ctxt['cpu_dedicated_set'] = config('cpu-dedicated-set')
+                if ctxt['vcpu_pin_set']:
+                    w = ("Ignoring vcpu-pin-set config since that option "
+                         "can't be used with cpu-dedicated-set.")
+                    log(w, level=WARNING)
+                    ctxt['vcpu_pin_set'] = None
 
         if config('virtio-net-tx-queue-size'):
             ctxt['virtio_net_tx_queue_size'] = (
@@ -298,7 +348,12 @@ class NovaComputeLibvirtContext(context.OSContextGenerator):
             ctxt['virtio_net_rx_queue_size'] = (
                 config('virtio-net-rx-queue-size'))
 
-        ctxt['reserved_host_memory'] = config('reserved-host-memory')
+        if config('reserved-host-memory-auto'):
+            reservation = hook_reserved_host_memory()
+            log(format_reservation(reservation), level=INFO)
+            ctxt['reserved_host_memory'] = reservation['total']
+        else:
+            ctxt['reserved_host_memory'] = config('reserved-host-memory')
 
         db = kv()
         if db.get('host_uuid'):
@@ -0,0 +1,174 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Partitioning of the host CPUs between the host and dedicated guests.
+
+With cpu-dedicated-set set to auto, the first cpu-host-cores cores of every
+NUMA node, with all their hardware threads, are kept for the host, OVS and
+guest emulator threads as the shared set; every other core is dedicated to
+pinned guest vCPUs.  Hardware threads of a core always end up in the same
+set.
+"""
+
+from collections import OrderedDict
+
+from nova_compute_facts import (
+    format_cpu_list,
+    host_facts,
+)
+
+CPU_SETS_AUTO = 'auto'
+
+
+def cpu_partitioning_enabled(cpu_dedicated_set):
+    """Whether the CPU sets are computed from the host topology.
+
+    :param cpu_dedicated_set: Value of the cpu-dedicated-set option
+    :type cpu_dedicated_set: Optional[str]
+    :rtype: bool
+    """
+    return (cpu_dedicated_set or '').strip().lower() == CPU_SETS_AUTO
+
+
+def node_cores(host=None):
+    """Cores of every NUMA node, each as the list of its hardware threads.
+
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :rtype: OrderedDict[int, List[List[int]]]
+    """
+    host = host or host_facts()
+    cores = OrderedDict()
+    for node in host.numa_nodes:
+        cpus = set(node['cpus'])
+        cores[node['node']] = [
+            siblings for siblings in host.thread_siblings
+            if cpus.intersection(siblings)]
+    return cores
+
+
+def cpu_partition(host_cores, host=None):
+    """Split the CPUs of the host into shared and dedicated sets.
+
+    :param host_cores: Cores of every NUMA node kept for the host
+    :type host_cores: int
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :returns: Shared and dedicated CPUs of the host and of every node:
+              {'shared': [...], 'dedicated': [...], 'nodes': {node: {...}}}
+    :rtype: Dict[str, Any]
+    :raises: ValueError if a node does not have more than host_cores cores
+    """
+    if host_cores < 1:
+        raise ValueError('cpu-host-cores must be at least 1')
+    partition = {'shared': [], 'dedicated': [], 'nodes': OrderedDict()}
+    for node, cores in node_cores(host).items():
+        if len(cores) <= host_cores:
+            raise ValueError(
+                'NUMA node {} has {} cores, which leaves none dedicated '
+                'after keeping {} for the host'.format(
+                    node, len(cores), host_cores))
+        shared = sorted(cpu for core in cores[:host_cores] for cpu in core)
+        dedicated = sorted(cpu for core in cores[host_cores:] for cpu in core)
+        partition['nodes'][node] = {'shared': shared, 'dedicated': dedicated}
+        partition['shared'].extend(shared)
+        partition['dedicated'].extend(dedicated)
+    partition['shared'].sort()
+    partition['dedicated'].sort()
+    return partition
+
+
+def cpu_sets(cpu_dedicated_set, host_cores, host=None):
+    """The CPU sets computed for cpu-dedicated-set auto.
+
+    :param cpu_dedicated_set: Value of the cpu-dedicated-set option
+    :type cpu_dedicated_set: Optional[str]
+    :param host_cores: Cores of every NUMA node kept for the host
+    :type host_cores: int
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :returns: cpu_shared_set and cpu_dedicated_set as kernel CPU lists, or
+              None if cpu-dedicated-set is not auto
+    :rtype: Optional[Dict[str, str]]
+    :raises: ValueError if the host does not have enough cores
+    """
+    if not cpu_partitioning_enabled(cpu_dedicated_set):
+        return None
+    partition = cpu_partition(host_cores, host)
+    return {'cpu_shared_set': format_cpu_list(partition['shared']),
+            'cpu_dedicated_set': format_cpu_list(partition['dedicated'])}
+
+
+def parse_cpu_spec(spec):
+    """Parse a nova CPU set such as '0-3,^2,8', which can exclude CPUs.
+
+    :param spec: CPU set
+    :type spec: str
+    :returns: Sorted CPU ids
+    :rtype: List[int]
+    :raises: ValueError if spec is not a CPU set
+    """
+    cpus, excluded = set(), set()
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        target = excluded if part.startswith('^') else cpus
+        first, _, last = part.lstrip('^').partition('-')
+        try:
+            target.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise ValueError('Invalid CPU set: {}'.format(spec))
+    return sorted(cpus - excluded)
+
+
+def partitioned_cpus(cpu_dedicated_set, cpu_shared_set, host_cores,
+                     host=None):
+    """Shared and dedicated CPUs of the host, from the config options.
+
+    With an explicit cpu-dedicated-set and no cpu-shared-set, every other
+    online CPU is shared.
+
+    :param cpu_dedicated_set: Value of the cpu-dedicated-set option
+    :type cpu_dedicated_set: Optional[str]
+    :param cpu_shared_set: Value of the cpu-shared-set option
+    :type cpu_shared_set: Optional[str]
+    :param host_cores: Cores of every NUMA node kept for the host
+    :type host_cores: int
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :returns: {'shared': [...], 'dedicated': [...]}, or None if no CPUs are
+              dedicated
+    :rtype: Optional[Dict[str, List[int]]]
+    :raises: ValueError if the CPU sets are invalid
+    """
+    if cpu_partitioning_enabled(cpu_dedicated_set):
+        partition = cpu_partition(host_cores, host)
+        return {'shared': partition['shared'],
+                'dedicated': partition['dedicated']}
+    dedicated = parse_cpu_spec(cpu_dedicated_set)
+    if not dedicated:
+        return None
+    if cpu_shared_set:
+        shared = parse_cpu_spec(cpu_shared_set)
+    else:
+        host = host or host_facts()
+        shared = sorted(cpu for node in host.numa_nodes
+                        for cpu in node['cpus'] if cpu not in dedicated)
+    if not shared:
+        raise ValueError('No CPUs left for the host')
+    if set(shared) & set(dedicated):
+        raise ValueError('CPUs {} are both shared and dedicated'.format(
+            format_cpu_list(set(shared) & set(dedicated))))
+    return {'shared': shared, 'dedicated': dedicated}
@@ -0,0 +1,251 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Facts about the host, gathered once rather than on every use.
+
+Facts that only change when the host reboots (distribution release, init
+system, CPU and NUMA topology, ...) are saved to unitdata along with the
+kernel boot id and reused by later hooks until the host reboots.  Live
+values, such as the current hugepage pools, are always read from sysfs.
+"""
+
+import glob
+import os
+import re
+
+from charmhelpers.core import host as ch_host
+from charmhelpers.core.unitdata import kv
+
+BOOT_ID = '/proc/sys/kernel/random/boot_id'
+MEMINFO = '/proc/meminfo'
+SYSFS_CPU = '/sys/devices/system/cpu'
+SYSFS_NODE = '/sys/devices/system/node'
+SYSFS_HUGEPAGES = '/sys/kernel/mm/hugepages'
+# unitdata key holding the facts gathered since the host last booted
+HOST_FACTS_KEY = 'nova-compute.host-facts'
+
+_host_facts = None
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a kernel CPU list such as '0-3,8,10-11'.
+
+    :param cpu_list: CPU list
+    :type cpu_list: str
+    :returns: Sorted CPU ids
+    :rtype: List[int]
+    """
+    cpus = set()
+    for part in (cpu_list or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """Format CPU ids as a kernel CPU list such as '0-3,8,10-11'.
+
+    :param cpus: CPU ids
+    :type cpus: Iterable[int]
+    :rtype: str
+    """
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else
+                    '{}-{}'.format(first, last) for first, last in ranges)
+
+
+def _meminfo_kb(meminfo, field):
+    match = re.search(r'^(?:Node \d+ )?{}:\s+(\d+) kB'.format(field),
+                      meminfo or '', re.MULTILINE)
+    return int(match.group(1)) if match else 0
+
+
+def _hugepage_pools(path):
+    pools = {}
+    for pool in glob.glob(os.path.join(path, 'hugepages-*kB')):
+        size = int(os.path.basename(pool)[len('hugepages-'):-len('kB')])
+        pools[size] = {
+            'total': int(_read(os.path.join(pool, 'nr_hugepages')) or 0),
+            'free': int(_read(os.path.join(pool, 'free_hugepages')) or 0),
+        }
+    return pools
+
+
+class HostFacts(object):
+    """Facts about the host, each gathered when first used.
+
+    Unit tests can pass the facts they need, which are then never
+    gathered from or saved to the host.
+
+    :param boot_id: Boot id the facts were gathered in; facts are only
+                    saved to unitdata when it is known
+    :type boot_id: Optional[str]
+    :param facts: Facts already gathered, by name
+    :type facts: Optional[Dict[str, Any]]
+    """
+
+    def __init__(self, boot_id=None, facts=None):
+        self.boot_id = boot_id
+        self._facts = dict(facts or {})
+
+    @classmethod
+    def load(cls):
+        """Facts saved by an earlier hook since the host last booted"""
+        boot_id = _read(BOOT_ID)
+        saved = kv().get(HOST_FACTS_KEY) or {}
+        if not boot_id or saved.get('boot-id') != boot_id:
+            saved = {}
+        return cls(boot_id, saved.get('facts'))
+
+    def _fact(self, name, gather):
+        if name not in self._facts:
+            self._facts[name] = gather()
+            if self.boot_id:
+                kv().set(HOST_FACTS_KEY, {'boot-id': self.boot_id,
+                                          'facts': self._facts})
+        return self._facts[name]
+
+    @property
+    def lsb_release(self):
+        """/etc/lsb-release as a dict"""
+        return dict(self._fact('lsb_release', ch_host.lsb_release))
+
+    @property
+    def distrib_codename(self):
+        return self.lsb_release['DISTRIB_CODENAME'].lower()
+
+    @property
+    def init_is_systemd(self):
+        return self._fact('init_is_systemd', ch_host.init_is_systemd)
+
+    @property
+    def is_container(self):
+        return self._fact('is_container', ch_host.is_container)
+
+    @property
+    def memory_total(self):
+        """Memory usable by the host in bytes, as psutil reports it"""
+        return self._fact(
+            'memory_total',
+            lambda: _meminfo_kb(_read(MEMINFO), 'MemTotal') * 1024)
+
+    @property
+    def numa_nodes(self):
+        """NUMA nodes, each with its online CPUs and memory in bytes.
+
+        Hosts without NUMA are reported as a single node 0.
+
+        :rtype: List[Dict[str, Any]]
+        """
+        return self._fact('numa_nodes', self._gather_numa_nodes)
+
+    def _gather_numa_nodes(self):
+        online = set(parse_cpu_list(_read(os.path.join(SYSFS_CPU, 'online'))))
+        nodes = []
+        for path in glob.glob(os.path.join(SYSFS_NODE, 'node[0-9]*')):
+            nodes.append({
+                'node': int(os.path.basename(path)[len('node'):]),
+                'cpus': [cpu for cpu in parse_cpu_list(
+                    _read(os.path.join(path, 'cpulist')))
+                    if cpu in online],
+                'memory': _meminfo_kb(
+                    _read(os.path.join(path, 'meminfo')), 'MemTotal') * 1024,
+            })
+        if not nodes:
+            nodes.append({'node': 0, 'cpus': sorted(online),
+                          'memory': self.memory_total})
+        return sorted(nodes, key=lambda n: n['node'])
+
+    @property
+    def thread_siblings(self):
+        """Online CPUs grouped by the core they are hardware threads of.
+
+        :rtype: List[List[int]]
+        """
+        return self._fact('thread_siblings', self._gather_thread_siblings)
+
+    def _gather_thread_siblings(self):
+        siblings = set()
+        for node in self.numa_nodes:
+            for cpu in node['cpus']:
+                cpus = parse_cpu_list(_read(os.path.join(
+                    SYSFS_CPU, 'cpu{}'.format(cpu), 'topology',
+                    'thread_siblings_list'))) or [cpu]
+                siblings.add(tuple(cpus))
+        return sorted(list(cpus) for cpus in siblings)
+
+    @property
+    def hugepage_sizes(self):
+        """Hugepage sizes supported by the host in kB"""
+        return self._fact('hugepage_sizes',
+                          lambda: sorted(_hugepage_pools(SYSFS_HUGEPAGES)))
+
+    def hugepages(self, node=None):
+        """Current hugepage pools, read live.
+
+        :param node: NUMA node, or None for the pools of the whole host
+        :type node: Optional[int]
+        :returns: Total and free pages, by page size in kB
+        :rtype: Dict[int, Dict[str, int]]
+        """
+        if node is None:
+            return _hugepage_pools(SYSFS_HUGEPAGES)
+        return _hugepage_pools(os.path.join(
+            SYSFS_NODE, 'node{}'.format(node), 'hugepages'))
+
+
+def host_facts():
+    """The HostFacts of this hook"""
+    global _host_facts
+    if _host_facts is None:
+        _host_facts = HostFacts.load()
+    return _host_facts
+
+
+def reset_host_facts():
+    """Gather the facts again, eg. after changing the host"""
+    global _host_facts
+    _host_facts = None
+    kv().unset(HOST_FACTS_KEY)
+
+
+def lsb_release():
+    """Drop-in for charmhelpers.core.host.lsb_release"""
+    return host_facts().lsb_release
+
+
+def init_is_systemd():
+    """Drop-in for charmhelpers.core.host.init_is_systemd"""
+    return host_facts().init_is_systemd
+
+
+def is_container():
+    """Drop-in for charmhelpers.core.host.is_container"""
+    return host_facts().is_container
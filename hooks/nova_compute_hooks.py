@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import base64
+import itertools
 import json
 import platform
 import sys
@@ -28,6 +29,8 @@ import charmhelpers.core.unitdata as unitdata
 
 from charmhelpers.core.hookenv import (
     Hooks,
+    atexit,
+    buffer_log,
     config,
     is_relation_made,
     local_unit,
@@ -36,7 +39,7 @@ from charmhelpers.core.hookenv import (
     relation_ids,
     remote_service_name,
     related_units,
-    relation_get,
+    snapshot_relation_get as relation_get,
     relation_set,
     service_name,
     UnregisteredHookError,
@@ -52,7 +55,6 @@ from charmhelpers.core.host import (
     service_stop,
     write_file,
     umount,
-    is_container,
 )
 from charmhelpers.fetch import (
     apt_install,
@@ -96,6 +98,7 @@ from nova_compute_utils import (
     restart_map,
     services,
     register_configs,
+    DeferredConfigs,
     NOVA_CONF,
     ceph_config_file, CEPH_SECRET,
     CEPH_BACKEND_SECRET,
@@ -118,6 +121,13 @@ from nova_compute_utils import (
     remove_old_packages,
     MULTIPATH_PACKAGES,
     USE_FQDN_KEY,
+    compact_unit_state,
+    request_config_reconcile,
+    CONFIG_RECONCILE_KEY,
+    CONFIG_UPGRADED_KEY,
+    configure_cpu_isolation,
+    cpu_isolation_services,
+    isolated_cpus,
 )
 
 from charmhelpers.contrib.network.ip import (
@@ -126,6 +136,11 @@ from charmhelpers.contrib.network.ip import (
 
 from charmhelpers.core.unitdata import kv
 
+from nova_compute_cpu import cpu_partitioning_enabled, cpu_sets
+from nova_compute_facts import is_container, reset_host_facts
+from nova_compute_hugepages import hugepage_allocation, is_hugepages_spec
+from nova_compute_trace import start_tracing
+
 from nova_compute_context import (
     nova_metadata_requirement,
     CEPH_SECRET_UUID,
@@ -143,7 +158,9 @@ from socket import gethostname
 import charmhelpers.contrib.openstack.vaultlocker as vaultlocker
 
 hooks = Hooks()
-CONFIGS = register_configs()
+# NOTE: the restart map and config renderer are resolved on first use by a
+#       hook handler rather than at import time; see DeferredConfigs.
+CONFIGS = DeferredConfigs(register_configs)
 MIGRATION_AUTH_TYPES = ["ssh"]
 LIBVIRTD_PID = '/var/run/libvirtd.pid'
 
@@ -168,18 +185,92 @@ def install():
         db.flush()
 
     install_vaultlocker()
+    CONFIGS.precompile()
+
+
+# unitdata key holding the config and relation ids that config-changed last
+# applied in full.
+CONFIG_APPLIED_KEY = 'config-changed.applied'
+
+# config-changed steps in the order they run, as (step, keys, relations).
+CONFIG_STEPS = []
+
+
+def config_step(keys=None, relations=None):
+    """Register a config-changed step.
+
+    The step runs when any config option in keys, or the set of relation ids
+    of any interface in relations, has changed since config-changed last
+    completed.  Steps registered with neither run on every config-changed,
+    and steps with an empty keys list only on a full reconcile.  Every step
+    runs on a full reconcile, which happens on the first config-changed,
+    after an OpenStack upgrade and after upgrade-charm.
+    """
+    def wrap(f):
+        CONFIG_STEPS.append((f, keys, relations))
+        return f
+    return wrap
+
+
+class ConfigChanges(object):
+    """What changed since config-changed last completed.
+
+    The comparison is against what config-changed itself last applied rather
+    than Config.previous(), which is saved by every successful hook and so
+    may already include changes config-changed has not acted on yet.
+    """
+
+    def __init__(self):
+        db = kv()
+        self.applied = db.get(CONFIG_APPLIED_KEY)
+        self.full = self.applied is None or bool(db.get(CONFIG_RECONCILE_KEY))
+        self.upgraded = bool(db.get(CONFIG_UPGRADED_KEY))
+        self._relation_ids = {}
+
+    def relation_ids(self, name):
+        if name not in self._relation_ids:
+            self._relation_ids[name] = sorted(relation_ids(name))
+        return self._relation_ids[name]
+
+    def affects(self, keys=None, relations=None):
+        if self.full or (keys is None and relations is None):
+            return True
+        applied_config = self.applied.get('config', {})
+        applied_relations = self.applied.get('relations', {})
+        return (any(config(k) != applied_config.get(k) for k in keys or ()) or
+                any(self.relation_ids(r) != applied_relations.get(r)
+                    for r in relations or ()))
+
+    def save(self):
+        relations = set(itertools.chain.from_iterable(
+            r or () for _, _, r in CONFIG_STEPS))
+        db = kv()
+        db.set(CONFIG_APPLIED_KEY, {
+            'config': dict(config()),
+            'relations': {r: self.relation_ids(r) for r in relations},
+        })
+        db.set(CONFIG_RECONCILE_KEY, False)
+        db.set(CONFIG_UPGRADED_KEY, False)
+        db.flush()
 
 
 @hooks.hook('config-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 @harden()
 def config_changed():
+    """Apply the config-changed steps affected by what changed.
 
+    :returns: The changes applied, which are saved once the hook completes,
+              or None if the unit is paused
+    :rtype: Optional[ConfigChanges]
+    """
     if is_unit_paused_set():
         log("Do not run config_changed when paused", "WARNING")
         return
 
-    if config('ephemeral-unmount'):
+    changes = ConfigChanges()
+    if (config('ephemeral-unmount') and
+            changes.affects(keys=['ephemeral-unmount'])):
         umount(config('ephemeral-unmount'), persist=True)
 
     if config('prefer-ipv6'):
@@ -191,14 +282,49 @@ def config_changed():
         message = ("Invalid migration-auth-type")
         status_set('blocked', message)
         raise Exception(message)
+
+    if is_hugepages_spec(config('hugepages')):
+        try:
+            hugepage_allocation(config('hugepages'))
+        except ValueError as e:
+            message = 'Invalid hugepages: {}'.format(e)
+            status_set('blocked', message)
+            raise Exception(message)
+
+    if cpu_partitioning_enabled(config('cpu-dedicated-set')):
+        try:
+            cpu_sets(config('cpu-dedicated-set'), config('cpu-host-cores'))
+        except ValueError as e:
+            message = 'Invalid cpu-host-cores: {}'.format(e)
+            status_set('blocked', message)
+            raise Exception(message)
+
+    try:
+        isolated_cpus()
+    except ValueError as e:
+        message = 'Invalid CPU isolation: {}'.format(e)
+        status_set('blocked', message)
+        raise Exception(message)
     global CONFIGS
-    send_remote_restart = False
     if not config('action-managed-upgrade'):
         if openstack_upgrade_available('nova-common'):
             status_set('maintenance', 'Running openstack upgrade')
             do_openstack_upgrade(CONFIGS)
-            send_remote_restart = True
+            changes.upgraded = changes.full = True
+
+    for step, keys, relations in CONFIG_STEPS:
+        if changes.affects(keys, relations):
+            step(changes)
+        else:
+            log('Skipping config-changed step {}, nothing it depends on '
+                'changed'.format(step.__name__), level=DEBUG)
+    # record what was applied once the hook has completed successfully
+    atexit(changes.save)
+    return changes
+
 
+@config_step(keys=['sysctl'])
+def configure_sysctl(changes):
     sysctl_settings = config('sysctl')
     if sysctl_settings and not is_container():
         create_sysctl(
@@ -212,8 +338,17 @@ def config_changed():
             # existence.
             ignore=True)
 
+
+# runs on every config-changed, as it did before config-changed was split
+# into steps
+@config_step()
+def remove_default_libvirt_network(changes):
     remove_libvirt_network('default')
 
+
+@config_step(keys=['enable-live-migration', 'migration-auth-type'],
+             relations=['cloud-compute'])
+def configure_migration_keys(changes):
     if migration_enabled() and config('migration-auth-type') == 'ssh':
         # Check-in with nova-c-c and register new ssh key, if it has just been
         # generated.
@@ -221,6 +356,9 @@ def config_changed():
         initialize_ssh_keys()
         import_authorized_keys()
 
+
+@config_step(keys=['enable-resize'], relations=['cloud-compute'])
+def configure_resize(changes):
     if config('enable-resize') is True:
         enable_shell(user='nova')
         status_set('maintenance', 'SSH key exchange')
@@ -229,31 +367,66 @@ def config_changed():
     else:
         disable_shell(user='nova')
 
+
+@config_step(keys=['instances-path'])
+def configure_instances_path(changes):
     if config('instances-path') is not None:
         fp = config('instances-path')
         fix_path_ownership(fp, user='nova')
 
+
+@config_step()
+def update_relations(changes):
+    # relation_set() does not republish unchanged settings
     for rid in relation_ids('cloud-compute'):
         compute_joined(rid)
 
     for rid in relation_ids('neutron-plugin'):
-        neutron_plugin_joined(rid, remote_restart=send_remote_restart)
+        neutron_plugin_joined(rid, remote_restart=changes.upgraded)
 
     for rid in relation_ids('nova-ceilometer'):
-        nova_ceilometer_joined(rid, remote_restart=send_remote_restart)
+        nova_ceilometer_joined(rid, remote_restart=changes.upgraded)
 
     if is_relation_made("nrpe-external-master"):
         update_nrpe_config()
 
+
+@config_step(keys=['hugepages'])
+def configure_hugepages(changes):
     if config('hugepages'):
         install_hugepages()
 
+
+@config_step(keys=['isolate-dedicated-cpus', 'cpu-dedicated-set',
+                   'cpu-shared-set', 'cpu-host-cores'])
+def isolate_cpus(changes):
+    apply_cpu_isolation()
+
+
+def apply_cpu_isolation():
+    """Isolate the dedicated CPUs and restart the services whose CPU
+    affinity changed, which only applies on restart."""
+    changed = configure_cpu_isolation()
+    if changed.get('systemd') and not is_unit_paused_set():
+        for service in cpu_isolation_services():
+            service_restart(service)
+    return changed
+
+
+@config_step()
+def configure_cpu_smt(changes):
     # Disable smt for ppc64, required for nova/libvirt/kvm
     arch = platform.machine()
     log('CPU architecture: {}'.format(arch))
     if arch in ['ppc64el', 'ppc64le']:
         set_ppc64_cpu_smt_state('off')
 
+
+@config_step(keys=['virt-type', 'libvirt-image-backend', 'rbd-pool',
+                   'ceph-osd-replication-count', 'ceph-pool-weight',
+                   'restrict-ceph-pools'],
+             relations=['ceph', 'ceph-access'])
+def configure_ceph(changes):
     # NOTE(jamespage): trigger any configuration related changes
     #                  for cephx permissions restrictions and
     #                  keys on disk for ceph-access backends
@@ -264,19 +437,34 @@ def config_changed():
         for unit in related_units(rid):
             ceph_access(rid=rid, unit=unit)
 
+
+@config_step()
+def write_configs(changes):
     CONFIGS.write_all()
 
+
+# network_manager() comes from the cloud-compute relation data, which the
+# relation ids do not track, so this runs on every config-changed
+@config_step()
+def configure_apparmor(changes):
     NovaComputeAppArmorContext().setup_aa_profile()
     if (network_manager() in ['flatmanager', 'flatdhcpmanager'] and
             config('multi-host').lower() == 'yes'):
         NovaAPIAppArmorContext().setup_aa_profile()
         NovaNetworkAppArmorContext().setup_aa_profile()
 
+
+@config_step(keys=['encrypt', 'use-multipath', 'ephemeral-device'],
+             relations=['secrets-storage'])
+def configure_storage(changes):
     install_vaultlocker()
     install_multipath()
 
     configure_local_ephemeral_storage()
 
+
+@config_step()
+def start_iscsid(changes):
     check_and_start_iscsid()
 
 
@@ -304,7 +492,7 @@ def amqp_joined(relation_id=None):
 
 @hooks.hook('amqp-relation-changed')
 @hooks.hook('amqp-relation-departed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def amqp_changed():
     if 'amqp' not in CONFIGS.complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
@@ -313,7 +501,7 @@ def amqp_changed():
 
 
 @hooks.hook('image-service-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def image_service_changed():
     if 'image-service' not in CONFIGS.complete_contexts():
         log('image-service relation incomplete. Peer not ready?')
@@ -323,7 +511,7 @@ def image_service_changed():
 
 @hooks.hook('ephemeral-backend-relation-changed',
             'ephemeral-backend-relation-broken')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def ephemeral_backend_hook():
     if 'ephemeral-backend' not in CONFIGS.complete_contexts():
         log('ephemeral-backend relation incomplete. Peer not ready?')
@@ -342,19 +530,32 @@ def compute_joined(rid=None):
             'migration', cidr_network=config('libvirt-migration-network')),
     }
 
-    if migration_enabled():
+    migration = migration_enabled()
+    if migration:
         auth_type = config('migration-auth-type')
         settings['migration_auth_type'] = auth_type
         if auth_type == 'ssh':
             settings['ssh_public_key'] = public_ssh_key()
-        relation_set(relation_id=rid, **settings)
     if config('enable-resize'):
         settings['nova_ssh_public_key'] = public_ssh_key(user='nova')
-        relation_set(relation_id=rid, **settings)
+    try:
+        auto_cpu_sets = cpu_sets(config('cpu-dedicated-set'),
+                                 config('cpu-host-cores'))
+    except ValueError as e:
+        log('Not publishing the CPU sets: {}'.format(e), 'WARNING')
+        auto_cpu_sets = None
+    if not auto_cpu_sets:
+        # clear the CPU sets published while partitioning was on
+        auto_cpu_sets = {'cpu_shared_set': None, 'cpu_dedicated_set': None}
+        if not (migration or config('enable-resize')):
+            relation_set(relation_id=rid, **auto_cpu_sets)
+            return
+    settings.update(auto_cpu_sets)
+    relation_set(relation_id=rid, **settings)
 
 
 @hooks.hook('cloud-compute-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def compute_changed():
     # rewriting all configs to pick up possible net or vol manager
     # config advertised from controller.
@@ -366,7 +567,7 @@ def compute_changed():
 
 @hooks.hook('ceph-access-relation-joined')
 @hooks.hook('ceph-relation-joined')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def ceph_joined():
     pkgs = filter_installed_packages(['ceph-common'])
     if pkgs:
@@ -403,7 +604,7 @@ def get_ceph_request():
 
 
 @hooks.hook('ceph-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def ceph_changed(rid=None, unit=None):
     if 'ceph' not in CONFIGS.complete_contexts():
         log('ceph relation incomplete. Peer not ready?')
@@ -531,7 +732,7 @@ def ceph_broken():
 
 
 @hooks.hook('amqp-relation-broken', 'image-service-relation-broken')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def relation_broken():
     CONFIGS.write_all()
 
@@ -539,6 +740,8 @@ def relation_broken():
 @hooks.hook('upgrade-charm.real')
 @harden()
 def upgrade_charm():
+    # the facts the earlier charm stored may be missing or stale
+    reset_host_facts()
     apt_install(filter_installed_packages(determine_packages()),
                 fatal=True)
     # NOTE: ensure psutil install for hugepages configuration
@@ -565,6 +768,12 @@ def upgrade_charm():
             .format(asok_path))
         shutil.chown(asok_path, group='kvm')
 
+    # templates may have changed with the charm
+    CONFIGS.precompile()
+    # the config-changed hook which follows must redo every step, as the
+    # charm code behind them may have changed
+    request_config_reconcile()
+
 
 @hooks.hook('nova-ceilometer-relation-joined')
 def nova_ceilometer_joined(relid=None, remote_restart=False):
@@ -575,7 +784,7 @@ def nova_ceilometer_joined(relid=None, remote_restart=False):
 
 
 @hooks.hook('nova-ceilometer-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def nova_ceilometer_relation_changed():
     CONFIGS.write_all()
 
@@ -611,7 +820,7 @@ def neutron_plugin_joined(relid=None, remote_restart=False):
 
 
 @hooks.hook('neutron-plugin-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def neutron_plugin_changed():
     enable_nova_metadata, _ = nova_metadata_requirement()
     if enable_nova_metadata:
@@ -652,7 +861,7 @@ def lxd_joined(relid=None):
 
 
 @hooks.hook('lxd-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def lxc_changed():
     nonce = relation_get('nonce')
     db = kv()
@@ -716,7 +925,7 @@ def cloud_credentials_joined():
 
 
 @hooks.hook('cloud-credentials-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map)
 def cloud_credentials_changed():
     CONFIGS.write(NOVA_CONF)
 
@@ -730,6 +939,17 @@ def check_and_start_iscsid():
 @harden()
 def update_status():
     log('Updating status.')
+    compact_unit_state()
+    try:
+        changed = apply_cpu_isolation()
+    except ValueError as e:
+        log('Not checking the CPU isolation: {}'.format(e), 'WARNING')
+    except (OSError, subprocess.CalledProcessError) as e:
+        log('Could not correct the CPU isolation: {}'.format(e), 'WARNING')
+    else:
+        if changed:
+            log('Corrected the CPU isolation, which had drifted: {}'.format(
+                changed), 'WARNING')
 
 
 @hooks.hook('pre-series-upgrade')
@@ -742,6 +962,8 @@ def pre_series_upgrade():
 @hooks.hook('post-series-upgrade')
 def post_series_upgrade():
     log("Running complete series upgrade hook", "INFO")
+    # the release and the packages of the host changed
+    reset_host_facts()
     service_stop('nova-compute')
     service_stop(libvirt_daemon())
     # After package upgrade the service is broken and leaves behind a
@@ -763,6 +985,9 @@ def shared_db_relation_joined():
 
 
 def main():
+    buffer_log()
+    start_tracing()
+    unitdata.kv().enable_wal()
     try:
         hooks.execute(sys.argv)
     except UnregisteredHookError as e:
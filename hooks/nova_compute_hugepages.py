@@ -0,0 +1,307 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hugepage pools of several page sizes, allocated per NUMA node.
+
+The hugepages option takes a spec of one or more page sizes separated by
+semicolons, each with the pages to allocate for it separated by commas::
+
+    1G:16@node0,16@node1;2M:50%
+
+A number of pages, or a percentage of the memory, given with @nodeN is
+allocated on that NUMA node; without one, a number of pages is split evenly
+across all the nodes and a percentage applies to the memory of every node.
+The pools of the nodes a page size does not name are left alone, eg. 1G
+pages the kernel command line allocated for DPDK.
+
+Pages are allocated through the per node nr_hugepages of sysfs and a
+hugetlbfs is mounted for every page size, by a script that also runs at boot.
+The sysctl settings the pages need replace those of a plain number of 2M
+pages, without vm.nr_hugepages.
+"""
+
+import os
+import re
+import subprocess
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+    WARNING,
+)
+from charmhelpers.core.host import write_file
+from charmhelpers.core import sysctl
+
+from nova_compute_facts import (
+    SYSFS_NODE,
+    host_facts,
+    init_is_systemd,
+)
+
+HUGEPAGES_SCRIPT = '/usr/local/sbin/nova-compute-hugepages'
+HUGEPAGES_SERVICE = '/etc/systemd/system/nova-compute-hugepages.service'
+# one hugetlbfs is mounted under this directory per page size, eg. kvm-1G
+HUGEPAGES_MOUNT_DIR = '/run/hugepages'
+# written by charmhelpers.core.hugepage for a plain number of pages too
+HUGEPAGE_SYSCTL = '/etc/sysctl.d/10-hugepage.conf'
+# minimum vm.max_map_count, as charmhelpers.core.hugepage sets it
+MAX_MAP_COUNT = 65536
+
+_SIZE_UNITS = {'K': 1, 'M': 1024, 'G': 1024 * 1024}
+
+HUGEPAGES_SERVICE_UNIT = """[Unit]
+Description=Allocate the hugepages of nova-compute
+DefaultDependencies=no
+After=local-fs.target
+Before=libvirtd.service libvirt-bin.service nova-compute.service
+
+[Service]
+Type=oneshot
+RemainAfterExit=yes
+ExecStart={script}
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+def is_hugepages_spec(value):
+    """Whether a hugepages option value is a spec rather than a plain
+    number or percentage of 2M pages"""
+    return ':' in (value or '')
+
+
+def page_size_kb(size):
+    """Parse a page size such as 2M, 1G, 1GB or 2048kB.
+
+    :param size: Page size
+    :type size: str
+    :returns: Page size in kB
+    :rtype: int
+    :raises: ValueError if size is not a page size
+    """
+    match = re.match(r'^\s*(\d+)\s*([KMG])i?B?\s*$', size, re.IGNORECASE)
+    if not match:
+        raise ValueError('Invalid hugepage size: {}'.format(size))
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def page_size_label(size_kb):
+    """Shortest label of a page size in kB, eg. 1G for 1048576"""
+    for unit in ('G', 'M', 'K'):
+        if size_kb % _SIZE_UNITS[unit] == 0:
+            return '{}{}'.format(size_kb // _SIZE_UNITS[unit], unit)
+
+
+def parse_hugepages_spec(spec):
+    """Parse a hugepages spec such as '1G:16@node0,16@node1;2M:50%'.
+
+    :param spec: Hugepages spec
+    :type spec: str
+    :returns: For every page size in kB, its allocations as tuples of
+              (amount, whether amount is a percentage, node or None)
+    :rtype: OrderedDict[int, List[Tuple[float, bool, Optional[int]]]]
+    :raises: ValueError if the spec is invalid
+    """
+    pools = OrderedDict()
+    for section in spec.split(';'):
+        if not section.strip():
+            continue
+        size, sep, allocations = section.partition(':')
+        if not sep:
+            raise ValueError(
+                'Invalid hugepages spec {}: no page size'.format(section))
+        size_kb = page_size_kb(size)
+        if size_kb in pools:
+            raise ValueError('Page size {} given twice'.format(size.strip()))
+        pools[size_kb] = []
+        for allocation in allocations.split(','):
+            match = re.match(
+                r'^\s*(\d+(?:\.\d+)?)(%?)\s*(?:@\s*node(\d+))?\s*$',
+                allocation)
+            if not match:
+                raise ValueError('Invalid hugepages allocation {} for page '
+                                 'size {}'.format(allocation, size.strip()))
+            amount, pct, node = match.groups()
+            if not pct and '.' in amount:
+                raise ValueError('Invalid number of hugepages: {}'
+                                 .format(amount))
+            pools[size_kb].append((float(amount) if pct else int(amount),
+                                   bool(pct),
+                                   int(node) if node is not None else None))
+    return pools
+
+
+def hugepage_allocation(spec, host=None):
+    """Pages to allocate on each NUMA node for a hugepages spec.
+
+    :param spec: Hugepages spec
+    :type spec: str
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :returns: Pages of every node the spec names, by page size in kB
+    :rtype: OrderedDict[int, OrderedDict[int, int]]
+    :raises: ValueError if the spec is invalid or does not fit the host
+    """
+    host = host or host_facts()
+    nodes = OrderedDict((n['node'], n) for n in host.numa_nodes)
+    supported = host.hugepage_sizes
+    allocation = OrderedDict()
+    for size_kb, allocations in parse_hugepages_spec(spec).items():
+        if supported and size_kb not in supported:
+            raise ValueError('Page size {} is not supported by this host, '
+                             'only {}'.format(
+                                 page_size_label(size_kb),
+                                 ', '.join(page_size_label(s)
+                                           for s in supported)))
+        pages = OrderedDict()
+        for amount, pct, node in allocations:
+            if node is not None and node not in nodes:
+                raise ValueError('NUMA node {} does not exist'.format(node))
+            targets = [node] if node is not None else list(nodes)
+            for target in targets:
+                pages.setdefault(target, 0)
+            if pct:
+                for target in targets:
+                    pages[target] += int(nodes[target]['memory'] * amount /
+                                         100 / (size_kb * 1024))
+            else:
+                # split evenly, any remainder going to the first nodes
+                share, remainder = divmod(amount, len(targets))
+                for i, target in enumerate(targets):
+                    pages[target] += share + (1 if i < remainder else 0)
+        allocation[size_kb] = OrderedDict(
+            (node, pages[node]) for node in nodes if node in pages)
+    for node, facts in nodes.items():
+        used = sum(size_kb * 1024 * pages.get(node, 0)
+                   for size_kb, pages in allocation.items())
+        if used > facts['memory']:
+            raise ValueError('Hugepages need {} MB on NUMA node {} which only '
+                             'has {} MB'.format(used // 2 ** 20, node,
+                                                facts['memory'] // 2 ** 20))
+    return allocation
+
+
+def hugepage_mounts(allocation):
+    """hugetlbfs mount point of every page size with pages allocated.
+
+    :rtype: OrderedDict[int, str]
+    """
+    return OrderedDict(
+        (size_kb, os.path.join(HUGEPAGES_MOUNT_DIR,
+                               'kvm-{}'.format(page_size_label(size_kb))))
+        for size_kb, pages in sorted(allocation.items())
+        if sum(pages.values()))
+
+
+def reserved_hugepages(allocation, host=None):
+    """Pages of the sizes not in the allocation already allocated on the
+    host, reserved for other consumers in the reserved_huge_pages format of
+    nova.
+
+    :rtype: List[str]
+    """
+    host = host or host_facts()
+    reserved = []
+    for node in host.numa_nodes:
+        for size_kb, pool in sorted(host.hugepages(node['node']).items()):
+            if size_kb not in allocation and pool['total']:
+                reserved.append('node:{},size:{},count:{}'.format(
+                    node['node'], size_kb, pool['total']))
+    return reserved
+
+
+def _nr_hugepages_path(node, size_kb):
+    return os.path.join(SYSFS_NODE, 'node{}'.format(node), 'hugepages',
+                        'hugepages-{}kB'.format(size_kb), 'nr_hugepages')
+
+
+def hugepage_sysctl(allocation):
+    """sysctl settings for the pages of an allocation, sized as
+    charmhelpers.core.hugepage sizes them for a plain number of pages.
+
+    :rtype: Dict[str, int]
+    """
+    pages = sum(sum(p.values()) for p in allocation.values())
+    settings = {
+        'vm.max_map_count': max(MAX_MAP_COUNT, 2 * pages),
+        # the hugetlbfs are mounted for root
+        'vm.hugetlb_shm_group': 0,
+    }
+    shmmax = sum(size_kb * 1024 * sum(p.values())
+                 for size_kb, p in allocation.items())
+    if shmmax > int(subprocess.check_output(['sysctl', '-n',
+                                             'kernel.shmmax'])):
+        settings['kernel.shmmax'] = shmmax
+    return settings
+
+
+def hugepages_script(allocation):
+    """Shell script allocating the pages and mounting their hugetlbfs"""
+    lines = ['#!/bin/sh', '# Allocates the hugepages of nova-compute, '
+             'generated by its charm.', 'set -e', '']
+    for size_kb, pages in allocation.items():
+        for node, count in pages.items():
+            lines.append('echo {} > {}'.format(
+                count, _nr_hugepages_path(node, size_kb)))
+    for size_kb, mnt_point in hugepage_mounts(allocation).items():
+        lines.extend([
+            'mkdir -p {}'.format(mnt_point),
+            'mountpoint -q {mnt} || mount -t hugetlbfs -o pagesize={size}K '
+            'nodev {mnt}'.format(mnt=mnt_point, size=size_kb),
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def install_hugepages_spec(spec):
+    """Allocate the hugepages of a spec now and at every boot.
+
+    :param spec: Hugepages spec
+    :type spec: str
+    :returns: Pages actually allocated on every node, by page size in kB
+    :rtype: OrderedDict[int, OrderedDict[int, int]]
+    """
+    host = host_facts()
+    allocation = hugepage_allocation(spec, host)
+    sysctl.create(hugepage_sysctl(allocation), HUGEPAGE_SYSCTL)
+    write_file(HUGEPAGES_SCRIPT, hugepages_script(allocation).encode('UTF-8'),
+               perms=0o755)
+    if init_is_systemd():
+        write_file(HUGEPAGES_SERVICE, HUGEPAGES_SERVICE_UNIT.format(
+            script=HUGEPAGES_SCRIPT).encode('UTF-8'), perms=0o644)
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+        subprocess.check_call(['systemctl', 'enable',
+                               os.path.basename(HUGEPAGES_SERVICE)])
+    else:
+        log('Hugepages are not allocated again at boot without systemd',
+            level=WARNING)
+    subprocess.check_call([HUGEPAGES_SCRIPT])
+
+    allocated = OrderedDict()
+    for size_kb, pages in allocation.items():
+        allocated[size_kb] = OrderedDict()
+        for node, count in pages.items():
+            actual = host.hugepages(node).get(size_kb, {}).get('total', 0)
+            allocated[size_kb][node] = actual
+            if actual < count:
+                # the kernel allocates what it can find contiguous memory for
+                log('Only {} of {} {} pages allocated on NUMA node {}'.format(
+                    actual, count, page_size_label(size_kb), node),
+                    level=WARNING)
+            else:
+                log('Allocated {} {} pages on NUMA node {}'.format(
+                    actual, page_size_label(size_kb), node), level=DEBUG)
+    return allocated
@@ -0,0 +1,313 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Isolation of the dedicated CPUs from the host.
+
+With isolate-dedicated-cpus set, the host is kept off the dedicated CPUs:
+
+* the kernel command line, through a GRUB drop-in, takes the dedicated
+  CPUs out of the scheduler (isolcpus), the timer tick (nohz_full) and RCU
+  callbacks (rcu_nocbs), which needs a reboot;
+* every IRQ, and the default for new ones, is routed to the shared CPUs;
+* systemd runs all the services, and explicitly libvirt and nova-compute,
+  on the shared CPUs.
+
+reconcile_cpu_isolation() brings the host in line and reports what it had
+to change, so that update-status can correct and log any drift.  IRQs are
+only routed back to every CPU if the charm isolated the CPUs before, so the
+affinity of hosts it never isolated is left as the operator set it.
+"""
+
+import glob
+import os
+import re
+import subprocess
+
+from collections import OrderedDict
+
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+    WARNING,
+)
+from charmhelpers.core.host import write_file
+from charmhelpers.core.unitdata import kv
+
+from nova_compute_facts import (
+    format_cpu_list,
+    host_facts,
+    parse_cpu_list,
+)
+
+PROC_CMDLINE = '/proc/cmdline'
+PROC_IRQ = '/proc/irq'
+GRUB_DROPIN = '/etc/default/grub.d/90-nova-compute-isolation.cfg'
+SYSTEMD_CONF_DROPIN = (
+    '/etc/systemd/system.conf.d/90-nova-compute-cpu-affinity.conf')
+SYSTEMD_UNIT_DROPIN = (
+    '/etc/systemd/system/{}.service.d/90-nova-compute-cpu-affinity.conf')
+# unitdata key set while the IRQs are routed to the shared CPUs
+IRQS_ISOLATED_KEY = 'nova-compute.irqs-isolated'
+
+ISOLATION_PARAMS = ('isolcpus', 'nohz_full', 'rcu_nocbs')
+
+GRUB_DROPIN_CONTENT = """# Generated by the nova-compute charm.
+GRUB_CMDLINE_LINUX_DEFAULT="$GRUB_CMDLINE_LINUX_DEFAULT {params}"
+"""
+
+CPU_AFFINITY_DROPIN = """# Generated by the nova-compute charm.
+[{section}]
+CPUAffinity={cpus}
+"""
+
+
+def kernel_cmdline():
+    """The command line the running kernel booted with"""
+    try:
+        with open(PROC_CMDLINE) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ''
+
+
+def isolation_params(dedicated):
+    """Kernel parameters isolating the dedicated CPUs.
+
+    :param dedicated: Dedicated CPUs
+    :type dedicated: List[int]
+    :rtype: OrderedDict[str, str]
+    """
+    cpus = format_cpu_list(dedicated)
+    return OrderedDict((param, cpus) for param in ISOLATION_PARAMS)
+
+
+def booted_isolation(cmdline=None):
+    """CPUs the running kernel isolates, by parameter.
+
+    Flags before the CPU list, as in isolcpus=domain,managed_irq,2-7, are
+    ignored.
+
+    :rtype: Dict[str, List[int]]
+    """
+    booted = {}
+    for arg in (kernel_cmdline() if cmdline is None else cmdline).split():
+        param, _, value = arg.partition('=')
+        if param in ISOLATION_PARAMS:
+            cpus = [v for v in value.split(',')
+                    if not re.match(r'^[a-z_]+$', v)]
+            booted[param] = parse_cpu_list(','.join(cpus))
+    return booted
+
+
+def reboot_required(dedicated):
+    """Whether the running kernel does not isolate exactly the dedicated
+    CPUs.
+
+    :param dedicated: Dedicated CPUs
+    :type dedicated: List[int]
+    :rtype: bool
+    """
+    booted = booted_isolation()
+    return any(booted.get(param) != sorted(dedicated)
+               for param in ISOLATION_PARAMS)
+
+
+def _write_if_changed(path, content):
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except (IOError, OSError):
+        pass
+    write_file(path, content.encode('UTF-8'), perms=0o644)
+    return True
+
+
+def _remove(path):
+    if not os.path.exists(path):
+        return False
+    os.unlink(path)
+    return True
+
+
+def configure_grub(dedicated):
+    """Write, or remove without dedicated CPUs, the GRUB drop-in.
+
+    Should update-grub fail, the drop-in is put back as it was, so that the
+    next run tries again, and the error raised.
+
+    :returns: Whether the drop-in changed
+    :rtype: bool
+    :raises: OSError or subprocess.CalledProcessError if update-grub fails
+    """
+    try:
+        with open(GRUB_DROPIN) as f:
+            previous = f.read()
+    except (IOError, OSError):
+        previous = None
+    if dedicated:
+        changed = _write_if_changed(GRUB_DROPIN, GRUB_DROPIN_CONTENT.format(
+            params=' '.join('{}={}'.format(param, cpus) for param, cpus in
+                            isolation_params(dedicated).items())))
+    else:
+        changed = _remove(GRUB_DROPIN)
+    if changed:
+        try:
+            subprocess.check_call(['update-grub'])
+        except (OSError, subprocess.CalledProcessError) as e:
+            log('Could not update the GRUB configuration: {}'.format(e),
+                level=WARNING)
+            if previous is None:
+                _remove(GRUB_DROPIN)
+            else:
+                write_file(GRUB_DROPIN, previous.encode('UTF-8'), perms=0o644)
+            raise
+    return changed
+
+
+def _cpu_mask(cpus):
+    # 32 bit words separated by commas, as the kernel formats masks
+    mask = '{:x}'.format(sum(1 << cpu for cpu in cpus))
+    mask = mask.zfill((len(mask) + 7) // 8 * 8)
+    return ','.join(mask[i:i + 8] for i in range(0, len(mask), 8))
+
+
+def _mask_value(mask):
+    return int(mask.replace(',', ''), 16)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _write(path, value):
+    try:
+        with open(path, 'w') as f:
+            f.write(value)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def configure_irq_affinity(cpus, exact=False):
+    """Route every IRQ, and by default new ones, to the given CPUs.
+
+    IRQs already routed to some of them, eg. by irqbalance, are left alone
+    unless exact is set.  Per CPU and kernel managed IRQs cannot be moved.
+
+    :param cpus: CPUs to route IRQs to
+    :type cpus: List[int]
+    :param exact: Whether IRQs must be routed to all of the CPUs
+    :type exact: bool
+    :returns: IRQs moved, with 'default' for the default affinity
+    :rtype: List[str]
+    """
+    moved = []
+    mask = _cpu_mask(cpus)
+    default = os.path.join(PROC_IRQ, 'default_smp_affinity')
+    current = _read(default)
+    if current is not None and _mask_value(current) != _mask_value(mask):
+        if _write(default, mask):
+            moved.append('default')
+    allowed = set(cpus)
+    cpu_list = format_cpu_list(cpus)
+    for path in sorted(glob.glob(os.path.join(PROC_IRQ, '[0-9]*',
+                                              'smp_affinity_list')),
+                       key=lambda p: int(p.split(os.sep)[-2])):
+        current = set(parse_cpu_list(_read(path)))
+        if current == allowed or (current <= allowed and not exact):
+            continue
+        irq = path.split(os.sep)[-2]
+        if _write(path, cpu_list):
+            moved.append(irq)
+        else:
+            log('IRQ {} cannot be moved to CPUs {}'.format(irq, cpu_list),
+                level=DEBUG)
+    return moved
+
+
+def configure_cpu_affinity(shared, services):
+    """Run the systemd services, and the given ones explicitly, on the
+    shared CPUs, or on any CPU without shared CPUs.
+
+    :param shared: CPUs to run the services on, or None
+    :type shared: Optional[List[int]]
+    :param services: Services pinned with a drop-in of their own
+    :type services: List[str]
+    :returns: Drop-ins changed
+    :rtype: List[str]
+    """
+    dropins = [(SYSTEMD_CONF_DROPIN, 'Manager')]
+    dropins.extend((SYSTEMD_UNIT_DROPIN.format(service), 'Service')
+                   for service in services)
+    changed = []
+    for path, section in dropins:
+        if shared:
+            if _write_if_changed(path, CPU_AFFINITY_DROPIN.format(
+                    section=section, cpus=format_cpu_list(shared))):
+                changed.append(path)
+        elif _remove(path):
+            changed.append(path)
+    if SYSTEMD_CONF_DROPIN in changed:
+        # the manager only reads system.conf when it is executed
+        subprocess.check_call(['systemctl', 'daemon-reexec'])
+    elif changed:
+        subprocess.check_call(['systemctl', 'daemon-reload'])
+    return changed
+
+
+def reconcile_cpu_isolation(cpus, services):
+    """Isolate the dedicated CPUs, or undo an earlier isolation without any.
+
+    :param cpus: Shared and dedicated CPUs as partitioned_cpus() returns
+                 them, or None to undo the isolation
+    :type cpus: Optional[Dict[str, List[int]]]
+    :param services: Services pinned to the shared CPUs explicitly
+    :type services: List[str]
+    :returns: What had to change, by part: 'grub', 'irqs' and 'systemd'
+    :rtype: Dict[str, Any]
+    """
+    if host_facts().is_container:
+        log('Not isolating CPUs in a container', level=DEBUG)
+        return {}
+    changed = {}
+    if configure_grub(cpus['dedicated'] if cpus else None):
+        changed['grub'] = True
+    dropins = configure_cpu_affinity(cpus['shared'] if cpus else None,
+                                     services)
+    if dropins:
+        changed['systemd'] = dropins
+    db = kv()
+    if cpus:
+        if not db.get(IRQS_ISOLATED_KEY):
+            db.set(IRQS_ISOLATED_KEY, True)
+            db.flush()
+        moved = configure_irq_affinity(cpus['shared'])
+    elif db.get(IRQS_ISOLATED_KEY):
+        # IRQs go to every CPU again once the isolation is undone, whether
+        # in this run or in an earlier one that failed after it
+        online = [cpu for node in host_facts().numa_nodes
+                  for cpu in node['cpus']]
+        moved = configure_irq_affinity(online, exact=True)
+        db.unset(IRQS_ISOLATED_KEY)
+        db.flush()
+    else:
+        moved = None
+    if moved:
+        changed['irqs'] = moved
+    return changed
@@ -0,0 +1,215 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory to reserve for the host, sized from what runs on it.
+
+With reserved-host-memory-auto set, reserved_host_memory_mb is the sum of:
+
+* a base for the kernel and the host services, which grows with the memory
+  the host can use for small pages; memory held in hugepage pools is
+  excluded, as neither the host nor its page tables use it;
+* the memory target of every co-located ceph OSD, as its admin socket
+  reports it, or the ceph default of 4096 MB if it cannot be read;
+* the DPDK socket memory of Open vSwitch, which nova counts as free memory
+  although no guest can have it;
+* the qemu overhead of the guests, for the most guests the host has run,
+  rounded up; that figure only goes down when the reset-guests-high-water
+  action resets it, so that guests coming and going do not rewrite
+  nova.conf and restart nova-compute.
+
+The reservation is computed once per hook.
+"""
+
+import glob
+import json
+import os
+import re
+import subprocess
+
+from collections import OrderedDict
+
+from charmhelpers.core.unitdata import kv
+
+from nova_compute_facts import host_facts
+
+PROC = '/proc'
+# unitdata key holding the most guests seen running on the host
+GUESTS_HIGH_WATER_KEY = 'nova-compute.guests-high-water'
+CEPH_OSD_DIR = '/var/lib/ceph/osd'
+
+HOST_BASE_MB = 1024
+# share of the small page memory used by page tables, slab and the like
+HOST_MEMORY_SHARE = 0.02
+# default osd_memory_target of ceph
+OSD_MEMORY_MB = 4096
+# seconds to wait for the admin socket of an OSD
+CEPH_DAEMON_TIMEOUT = 10
+QEMU_OVERHEAD_MB = 128
+GUEST_STEP = 10
+QEMU_PROCESS = re.compile(r'^(qemu-system-.*|qemu-kvm|kvm)$')
+# seconds to wait for ovsdb before assuming no DPDK
+OVS_VSCTL_TIMEOUT = 10
+
+_reservation = None
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def hugepages_mb(host=None):
+    """Memory held in the hugepage pools of the host in MB"""
+    host = host or host_facts()
+    return sum(size_kb * pool['total'] // 1024
+               for size_kb, pool in host.hugepages().items())
+
+
+def ceph_osds():
+    """Ceph OSDs hosted on this machine"""
+    return sorted(os.path.basename(path) for path in
+                  glob.glob(os.path.join(CEPH_OSD_DIR, 'ceph-*')))
+
+
+def osd_memory_mb(osd):
+    """osd_memory_target of a ceph OSD in MB, OSD_MEMORY_MB if the OSD
+    cannot tell.
+
+    :param osd: Data directory name of the OSD, eg. ceph-3
+    :type osd: str
+    :rtype: int
+    """
+    try:
+        value = subprocess.check_output(
+            ['ceph', 'daemon', 'osd.{}'.format(osd.rpartition('-')[2]),
+             'config', 'get', 'osd_memory_target'],
+            stderr=subprocess.DEVNULL,
+            timeout=CEPH_DAEMON_TIMEOUT).decode('UTF-8')
+        return int(json.loads(value)['osd_memory_target']) // 2 ** 20
+    except (OSError, ValueError, KeyError, subprocess.CalledProcessError,
+            subprocess.TimeoutExpired):
+        return OSD_MEMORY_MB
+
+
+def dpdk_socket_memory_mb():
+    """DPDK socket memory of Open vSwitch over all the NUMA nodes in MB, 0
+    without DPDK"""
+    try:
+        value = subprocess.check_output(
+            ['ovs-vsctl', '--no-wait',
+             '--timeout={}'.format(OVS_VSCTL_TIMEOUT),
+             'get', 'Open_vSwitch', '.',
+             'other_config:dpdk-socket-mem'],
+            stderr=subprocess.DEVNULL).decode('UTF-8')
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    return sum(int(mb) for mb in re.findall(r'\d+', value))
+
+
+def running_guests():
+    """Number of qemu processes running guests"""
+    guests = 0
+    for path in glob.glob(os.path.join(PROC, '[0-9]*', 'comm')):
+        name = _read(path)
+        if name and QEMU_PROCESS.match(name):
+            guests += 1
+    return guests
+
+
+def guests_high_water(running, record=True):
+    """The most guests seen running on the host, including now.
+
+    :param running: Guests running now
+    :type running: int
+    :param record: Whether to record running if it is the most seen
+    :type record: bool
+    :rtype: int
+    """
+    db = kv()
+    high_water = db.get(GUESTS_HIGH_WATER_KEY) or 0
+    if running > high_water:
+        high_water = running
+        if record:
+            db.set(GUESTS_HIGH_WATER_KEY, high_water)
+            db.flush()
+    return high_water
+
+
+def reset_guests_high_water():
+    """Forget the most guests seen, so that the guests running the next
+    time the reservation is computed count instead"""
+    db = kv()
+    db.unset(GUESTS_HIGH_WATER_KEY)
+    db.flush()
+
+
+def reserved_host_memory(host=None, record=True):
+    """Memory to reserve for the host, with how it adds up.
+
+    :param host: Facts about the host, host_facts() by default
+    :type host: Optional[nova_compute_facts.HostFacts]
+    :param record: Whether to record the guests running if they are the
+                   most seen, False to only report the reservation
+    :type record: bool
+    :returns: The total in MB, the reservation of every part in MB and the
+              figures they were sized from:
+              {'total': MB, 'parts': {...}, 'sized-from': {...}}
+    :rtype: Dict[str, Any]
+    """
+    host = host or host_facts()
+    memory_mb = host.memory_total // 2 ** 20
+    hugepages = hugepages_mb(host)
+    osds = OrderedDict((osd, osd_memory_mb(osd)) for osd in ceph_osds())
+    running = running_guests()
+    high_water = guests_high_water(running, record=record)
+    guests = max(GUEST_STEP, -(-high_water // GUEST_STEP) * GUEST_STEP)
+    parts = OrderedDict([
+        ('host', HOST_BASE_MB + int(
+            max(memory_mb - hugepages, 0) * HOST_MEMORY_SHARE)),
+        ('ceph-osd', sum(osds.values())),
+        ('ovs-dpdk', dpdk_socket_memory_mb()),
+        ('guests', guests * QEMU_OVERHEAD_MB),
+    ])
+    return {
+        'total': sum(parts.values()),
+        'parts': parts,
+        'sized-from': OrderedDict([
+            ('memory-mb', memory_mb),
+            ('hugepages-mb', hugepages),
+            ('ceph-osds', list(osds)),
+            ('osd-memory-mb', osds),
+            ('running-guests', running),
+            ('most-guests', high_water),
+            ('guests', guests),
+        ]),
+    }
+
+
+def hook_reserved_host_memory():
+    """reserved_host_memory() of the host, computed once per hook"""
+    global _reservation
+    if _reservation is None:
+        _reservation = reserved_host_memory()
+    return _reservation
+
+
+def format_reservation(reservation):
+    """One line summary of a reserved_host_memory() breakdown"""
+    return '{} MB reserved for the host: {}'.format(
+        reservation['total'],
+        ', '.join('{} {} MB'.format(part, mb)
+                  for part, mb in reservation['parts'].items()))
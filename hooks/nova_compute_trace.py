@@ -0,0 +1,226 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record where a hook spends its time running subprocesses.
+
+When enabled, every subprocess.call, check_call and check_output made by the
+charm and charmhelpers is timed.  The trace of each hook is written as JSON
+to TRACE_DIR in the charm directory, keeping the newest MAX_TRACES, and is
+summarised by the hook-trace-report action.
+"""
+
+import atexit
+import functools
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+from charmhelpers.core.hookenv import (
+    charm_dir,
+    config,
+    hook_name,
+    log,
+    DEBUG,
+)
+
+TRACE_ENV = 'NOVA_COMPUTE_HOOK_TRACE'
+TRACE_DIR = '.hook-traces'
+MAX_TRACES = 100
+TRACED_FUNCTIONS = ('call', 'check_call', 'check_output')
+# Commands are truncated to this many characters in the trace.
+MAX_COMMAND = 256
+
+_tracer = None
+
+
+def tracing_enabled():
+    """Whether the hook-trace config option or TRACE_ENV enable tracing"""
+    if os.environ.get(TRACE_ENV, '').lower() in ('1', 'true', 'yes'):
+        return True
+    return bool(config('hook-trace'))
+
+
+def trace_dir():
+    return os.path.join(charm_dir(), TRACE_DIR)
+
+
+def _command(args, kwargs):
+    cmd = args[0] if args else kwargs.get('args', '')
+    if not isinstance(cmd, str):
+        cmd = ' '.join(str(a) for a in cmd)
+    return cmd[:MAX_COMMAND]
+
+
+def _caller(frame):
+    # the first frame outside this module and subprocess
+    skip = (__name__, 'subprocess')
+    while frame and frame.f_globals.get('__name__') in skip:
+        frame = frame.f_back
+    if not frame:
+        return None
+    return '{}.{}:{}'.format(frame.f_globals.get('__name__'),
+                             frame.f_code.co_name, frame.f_lineno)
+
+
+class HookTracer(object):
+    """Times the subprocess calls made during a hook."""
+
+    def __init__(self, hook):
+        self.hook = hook
+        self.start = time.time()
+        self.calls = []
+        self._originals = {}
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            if sys._getframe(1).f_globals.get('__name__') == 'subprocess':
+                # eg, check_call() calling call(); already being timed
+                return func(*args, **kwargs)
+            start = time.time()
+            returncode = None
+            try:
+                result = func(*args, **kwargs)
+                returncode = result if name == 'call' else 0
+                return result
+            except subprocess.CalledProcessError as e:
+                returncode = e.returncode
+                raise
+            finally:
+                self.calls.append({
+                    'command': _command(args, kwargs),
+                    'function': name,
+                    'caller': _caller(sys._getframe(1)),
+                    'start': round(start - self.start, 6),
+                    'duration': round(time.time() - start, 6),
+                    'returncode': returncode,
+                })
+        return traced
+
+    def install(self):
+        """Replace the subprocess functions, including any a loaded module
+        imported by name, with timed versions."""
+        for name in TRACED_FUNCTIONS:
+            original = getattr(subprocess, name)
+            traced = self._wrap(name, original)
+            self._originals[name] = (original, traced)
+            setattr(subprocess, name, traced)
+        for module in list(sys.modules.values()):
+            for name, (original, traced) in self._originals.items():
+                if getattr(module, name, None) is original:
+                    setattr(module, name, traced)
+
+    def uninstall(self):
+        for module in list(sys.modules.values()):
+            for name, (original, traced) in self._originals.items():
+                if getattr(module, name, None) is traced:
+                    setattr(module, name, original)
+        self._originals = {}
+
+    def trace(self):
+        return {
+            'hook': self.hook,
+            'start': self.start,
+            'duration': round(time.time() - self.start, 6),
+            'calls': self.calls,
+        }
+
+    def write(self, directory=None):
+        """Write the trace to directory and remove all but the newest
+        MAX_TRACES traces.
+
+        :returns: path of the trace
+        """
+        directory = directory or trace_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+        path = os.path.join(
+            directory, '{:.6f}-{}.json'.format(self.start, self.hook))
+        # commands may carry secrets, so keep traces private
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.trace(), f)
+        for old in sorted(glob.glob(os.path.join(directory, '*.json')),
+                          key=_trace_start)[:-MAX_TRACES]:
+            os.unlink(old)
+        return path
+
+
+def _trace_start(path):
+    try:
+        return float(os.path.basename(path).split('-', 1)[0])
+    except ValueError:
+        return 0.0
+
+
+def start_tracing():
+    """Trace the subprocess calls of this hook if tracing is enabled.
+
+    The trace is written when the hook exits, whether or not it succeeded.
+    """
+    global _tracer
+    if _tracer is not None or not tracing_enabled():
+        return
+    _tracer = HookTracer(hook_name())
+    _tracer.install()
+    atexit.register(_write_trace)
+
+
+def _write_trace():
+    try:
+        path = _tracer.write()
+        log('Wrote hook trace to {}'.format(path), level=DEBUG)
+    except (IOError, OSError) as e:
+        log('Unable to write hook trace: {}'.format(e), level=DEBUG)
+
+
+def load_traces(directory=None):
+    """Load the recorded traces, oldest first."""
+    traces = []
+    for path in sorted(glob.glob(os.path.join(directory or trace_dir(),
+                                              '*.json')),
+                       key=_trace_start):
+        try:
+            with open(path) as f:
+                traces.append(json.load(f))
+        except (IOError, OSError, ValueError):
+            continue
+    return traces
+
+
+def slowest_calls(traces, top=10, hook=None):
+    """The top slowest subprocess calls, as (hook, call) tuples."""
+    calls = [(t['hook'], c) for t in traces
+             if hook is None or t['hook'] == hook
+             for c in t['calls']]
+    calls.sort(key=lambda hc: hc[1]['duration'], reverse=True)
+    return calls[:top]
+
+
+def hook_totals(traces, hook=None):
+    """Per hook totals of runs, wall time and time spent in subprocesses."""
+    totals = {}
+    for t in traces:
+        if hook is not None and t['hook'] != hook:
+            continue
+        total = totals.setdefault(t['hook'], {
+            'runs': 0, 'duration': 0.0, 'subprocess': 0.0, 'calls': 0})
+        total['runs'] += 1
+        total['duration'] += t['duration']
+        total['subprocess'] += sum(c['duration'] for c in t['calls'])
+        total['calls'] += len(t['calls'])
+    return totals
@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
 import os
 import re
 import pwd
 import subprocess
 import platform
+import time
 import uuid
 
 from itertools import chain
@@ -37,17 +40,18 @@ from charmhelpers.fetch import (
     apt_mark,
     filter_missing_packages,
     filter_installed_packages,
+    installed_versions,
 )
 
 from charmhelpers.core.fstab import Fstab
 from charmhelpers.core.host import (
     mkdir,
     service_restart,
-    lsb_release,
     rsync,
     CompareHostReleases,
     mount,
     fstab_add,
+    service_states,
 )
 
 from charmhelpers.core.hookenv import (
@@ -56,7 +60,9 @@ from charmhelpers.core.hookenv import (
     log,
     related_units,
     relation_ids,
-    relation_get,
+    relation_snapshot,
+    snapshot_relation_get as relation_get,
+    status_get,
     status_set,
     DEBUG,
     INFO,
@@ -64,6 +70,7 @@ from charmhelpers.core.hookenv import (
     storage_list,
     storage_get,
     hook_name,
+    on_relation_set,
 )
 
 from charmhelpers.core.decorators import retry_on_exception
@@ -85,6 +92,19 @@ from charmhelpers.contrib.openstack.utils import (
 
 from charmhelpers.core.hugepage import hugepage_support
 
+from nova_compute_cpu import partitioned_cpus
+from nova_compute_facts import format_cpu_list, host_facts, lsb_release
+from nova_compute_hugepages import (
+    hugepage_allocation,
+    install_hugepages_spec,
+    is_hugepages_spec,
+)
+from nova_compute_isolation import (
+    kernel_cmdline,
+    reboot_required,
+    reconcile_cpu_isolation,
+)
+
 from nova_compute_context import (
     nova_metadata_requirement,
     CloudComputeContext,
@@ -172,6 +192,7 @@ LIBVIRT_BIN_OVERRIDES = '/etc/init/libvirt-bin.override'
 NOVA_CONF = '%s/nova.conf' % NOVA_CONF_DIR
 VENDORDATA_FILE = '%s/vendor_data.json' % NOVA_CONF_DIR
 QEMU_KVM = '/etc/default/qemu-kvm'
+QEMU_HUGEFSDIR = '/etc/init.d/qemu-hugefsdir'
 NOVA_API_AA_PROFILE_PATH = ('/etc/apparmor.d/{}'.format(NOVA_API_AA_PROFILE))
 NOVA_COMPUTE_AA_PROFILE_PATH = ('/etc/apparmor.d/{}'
                                 ''.format(NOVA_COMPUTE_AA_PROFILE))
@@ -193,6 +214,57 @@ def use_fqdn_hint():
     return db.get(USE_FQDN_KEY, False)
 
 
+# unitdata key holding the last full status assessment of update-status
+ASSESS_STATUS_KEY = 'nova-compute.assess-status'
+# update-status reuses an assessment for at most this many seconds
+ASSESS_STATUS_INTERVAL = 60 * 60
+
+# unitdata keys holding a request for the next config-changed to redo every
+# step, and whether that follows an OpenStack upgrade
+CONFIG_RECONCILE_KEY = 'config-changed.reconcile'
+CONFIG_UPGRADED_KEY = 'config-changed.upgraded'
+
+
+def request_config_reconcile(upgraded=False):
+    """Make the next config-changed run every step.
+
+    :param upgraded: Whether OpenStack was upgraded, which also restarts
+                     the subordinate services
+    :type upgraded: bool
+    """
+    db = kv()
+    db.set(CONFIG_RECONCILE_KEY, True)
+    if upgraded:
+        db.set(CONFIG_UPGRADED_KEY, True)
+    db.flush()
+
+
+# unitdata key holding the time the unit state database was last compacted
+UNIT_STATE_COMPACTED_KEY = 'unit-state.compacted'
+UNIT_STATE_COMPACT_INTERVAL = 24 * 60 * 60
+# hook history kept in the unit state database; update-status alone adds
+# several hook executions every five minutes
+UNIT_STATE_RETENTION = {
+    'max_revisions': 10,
+    'max_hooks': 5000,
+    'max_age': 30 * 24 * 60 * 60,
+}
+
+
+def compact_unit_state():
+    """Prune the unit state history if it was not done in the last day"""
+    db = kv()
+    now = time.time()
+    last = db.get(UNIT_STATE_COMPACTED_KEY)
+    if last and 0 <= now - last < UNIT_STATE_COMPACT_INTERVAL:
+        return
+    before, after = db.compact(**UNIT_STATE_RETENTION)
+    db.set(UNIT_STATE_COMPACTED_KEY, now)
+    db.flush()
+    log('Compacted unit state database from {} to {} bytes'
+        .format(before, after), level=INFO)
+
+
 BASE_RESOURCE_MAP = {
     NOVA_CONF: {
         'services': ['nova-compute'],
@@ -326,12 +398,51 @@ def vaultlocker_installed():
     return len(filter_installed_packages(['vaultlocker'])) == 0
 
 
+# Resource map cached for the remainder of the hook execution; see
+# resource_map() and reset_resource_map().
+_resource_map = None
+_resource_map_builds = 0
+
+
 def resource_map():
+    '''
+    Return the map of resources that will be managed for a single hook
+    execution.
+
+    The map is built on first call and cached for the rest of the hook; it is
+    dropped by reset_resource_map() whenever the inputs it is derived from
+    change (OpenStack upgrade, relation data published by this unit).
+    Callers must treat the returned map as read-only.
+    '''
+    global _resource_map
+    global _resource_map_builds
+    if _resource_map is None:
+        _resource_map_builds += 1
+        log('Building resource map (build {} in {} hook)'
+            .format(_resource_map_builds, hook_name()), level=DEBUG)
+        _resource_map = _build_resource_map()
+    return _resource_map
+
+
+def reset_resource_map():
+    '''Drop the cached resource map so that the next call rebuilds it.'''
+    global _resource_map
+    _resource_map = None
+
+
+def resource_map_builds():
+    '''Number of times the resource map has been built during this hook.'''
+    return _resource_map_builds
+
+
+on_relation_set(reset_resource_map)
+
+
+def _build_resource_map():
     '''
     Dynamically generate a map of resources that will be managed for a single
     hook execution.
     '''
-    # TODO: Cache this on first call?
     if config('virt-type').lower() == 'lxd':
         resource_map = deepcopy(BASE_RESOURCE_MAP)
     else:
@@ -436,6 +547,37 @@ def register_configs():
     return configs
 
 
+class DeferredConfigs(object):
+    '''
+    Stand-in for the OSConfigRenderer returned by register_configs().
+
+    The renderer is only built when an attribute is first accessed, so hooks
+    that never render or assess configuration do not pay for evaluating the
+    resource map at module import time.
+    '''
+
+    def __init__(self, factory=None):
+        self._factory = factory or register_configs
+        self._configs = None
+
+    def resolve(self):
+        '''Build the underlying renderer on first use and return it.'''
+        if self._configs is None:
+            self._configs = self._factory()
+        return self._configs
+
+    def reset(self):
+        '''Forget the renderer so that the next access rebuilds it.'''
+        self._configs = None
+
+    @property
+    def resolved(self):
+        return self._configs is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
 def determine_packages_arch():
     '''Generate list of architecture-specific packages'''
     packages = []
@@ -549,8 +691,9 @@ def _network_config():
 
 
 def neutron_plugin():
-    return (_network_config().get('neutron_plugin') or
-            _network_config().get('quantum_plugin'))
+    net_config = _network_config()
+    return (net_config.get('neutron_plugin') or
+            net_config.get('quantum_plugin'))
 
 
 def network_manager():
@@ -679,9 +822,7 @@ def import_authorized_keys(user='root', prefix=None):
 
 
 def do_openstack_upgrade(configs):
-    # NOTE(jamespage) horrible hack to make utils forget a cached value
-    import charmhelpers.contrib.openstack.utils as utils
-    utils.os_rel = None
+    reset_os_release()
     new_src = config('openstack-origin')
     new_os_rel = get_os_codename_install_source(new_src)
     log('Performing OpenStack upgrade to %s.' % (new_os_rel))
@@ -696,12 +837,17 @@ def do_openstack_upgrade(configs):
 
     apt_upgrade(options=dpkg_opts, fatal=True, dist=True)
     reset_os_release()
+    reset_resource_map()
     apt_install(determine_packages(), fatal=True)
 
     remove_old_packages()
 
     configs.set_release(openstack_release=new_os_rel)
+    configs.precompile()
     configs.write_all()
+    # whether in config-changed or from the openstack-upgrade action, the
+    # config-changed that applies the upgrade must redo every step
+    request_config_reconcile(upgraded=True)
     if not is_unit_paused_set():
         for s in services():
             service_restart(s)
@@ -819,21 +965,20 @@ def assert_charm_supports_ipv6():
 
 
 def get_hugepage_number():
-    # TODO: defaults to 2M - this should probably be configurable
-    #       and support multiple pool sizes - e.g. 2M and 1G.
+    """Number of 2M hugepages configured"""
     # NOTE(jamespage): 2M in bytes
     hugepage_size = 2048 * 1024
     hugepage_config = config('hugepages')
     hugepages = None
-    if hugepage_config:
+    if is_hugepages_spec(hugepage_config):
+        hugepages = sum(hugepage_allocation(hugepage_config).get(
+            2048, {}).values())
+    elif hugepage_config:
         if hugepage_config.endswith('%'):
-            # NOTE(jamespage): return units of virtual_memory is
-            #                  bytes
-            import psutil
-            mem = psutil.virtual_memory()
             hugepage_config_pct = hugepage_config.strip('%')
             hugepage_multiplier = float(hugepage_config_pct) / 100
-            hugepages = int((mem.total * hugepage_multiplier) / hugepage_size)
+            hugepages = int((host_facts().memory_total *
+                             hugepage_multiplier) / hugepage_size)
         else:
             hugepages = int(hugepage_config)
     return hugepages
@@ -842,7 +987,10 @@ def get_hugepage_number():
 def install_hugepages():
     """ Configure hugepages """
     hugepage_config = config('hugepages')
-    if hugepage_config:
+    if is_hugepages_spec(hugepage_config):
+        install_hugepages_spec(hugepage_config)
+        remove_hugepage_count()
+    elif hugepage_config:
         mnt_point = '/run/hugepages/kvm'
         hugepage_support(
             'nova',
@@ -858,12 +1006,75 @@ def install_hugepages():
             service_restart('qemu-kvm')
         rsync(
             charm_dir() + '/files/qemu-hugefsdir',
-            '/etc/init.d/qemu-hugefsdir'
+            QEMU_HUGEFSDIR
         )
-        subprocess.check_call('/etc/init.d/qemu-hugefsdir')
+        subprocess.check_call(QEMU_HUGEFSDIR)
         subprocess.check_call(['update-rc.d', 'qemu-hugefsdir', 'defaults'])
 
 
+def remove_hugepage_count():
+    """Remove the qemu-hugefsdir init script a plain count of hugepages
+    set up, once a spec replaces it.
+
+    install_hugepages_spec() rewrites the sysctl settings without
+    vm.nr_hugepages and KVM_HUGEPAGES is cleared in qemu-kvm when the
+    configs are written.
+    """
+    if os.path.exists(QEMU_HUGEFSDIR):
+        subprocess.check_call(['update-rc.d', '-f', 'qemu-hugefsdir',
+                               'remove'])
+        os.unlink(QEMU_HUGEFSDIR)
+
+
+def isolated_cpus():
+    """Shared and dedicated CPUs to isolate from each other.
+
+    :returns: {'shared': [...], 'dedicated': [...]}, or None if
+              isolate-dedicated-cpus is not set
+    :rtype: Optional[Dict[str, List[int]]]
+    :raises: ValueError if there are no valid CPU sets to isolate
+    """
+    if not config('isolate-dedicated-cpus'):
+        return None
+    cpus = partitioned_cpus(config('cpu-dedicated-set'),
+                            config('cpu-shared-set'),
+                            config('cpu-host-cores'))
+    if not cpus:
+        raise ValueError('isolate-dedicated-cpus needs cpu-dedicated-set')
+    return cpus
+
+
+def cpu_isolation_services():
+    """Services pinned to the shared CPUs with a drop-in of their own"""
+    return [libvirt_daemon(), 'nova-compute']
+
+
+def configure_cpu_isolation():
+    """Isolate the dedicated CPUs from the host, or undo the isolation.
+
+    :returns: What had to change, as reconcile_cpu_isolation() reports it
+    :rtype: Dict[str, Any]
+    """
+    return reconcile_cpu_isolation(isolated_cpus(), cpu_isolation_services())
+
+
+def check_cpu_isolation(configs):
+    """Custom status check for the isolation of the dedicated CPUs.
+
+    @param configs: a templating.OSConfigRenderer() object
+    @returns (state, message) or (None, None)
+    """
+    try:
+        cpus = isolated_cpus()
+    except ValueError as e:
+        return 'blocked', 'Invalid CPU isolation: {}'.format(e)
+    if (cpus and not host_facts().is_container and
+            reboot_required(cpus['dedicated'])):
+        return ('blocked', 'Reboot required to isolate CPUs {}'.format(
+            format_cpu_list(cpus['dedicated'])))
+    return None, None
+
+
 def get_optional_relations():
     """Return a dictionary of optional relations.
 
@@ -895,8 +1106,77 @@ def assess_status(configs):
     else:
         services_to_check = services()
 
+    if hook_name() != 'update-status':
+        # other hooks change the unit in ways the fingerprint can miss; the
+        # hook has already flushed unitdata, so flush the unset too
+        db = kv()
+        db.unset(ASSESS_STATUS_KEY)
+        db.flush()
+        assess_status_func(configs, services_to_check)()
+        os_application_version_set(VERSION_PACKAGE)
+        return
+
+    db = kv()
+    now = time.time()
+    fingerprint = status_fingerprint(services_to_check)
+    last = db.get(ASSESS_STATUS_KEY) or {}
+    if (last.get('fingerprint') == fingerprint and
+            0 <= now - last.get('time', 0) < ASSESS_STATUS_INTERVAL):
+        log('Unit unchanged since its last assessment, reusing its status',
+            level=DEBUG)
+        status_set(*last['status'])
+        return
+
     assess_status_func(configs, services_to_check)()
     os_application_version_set(VERSION_PACKAGE)
+    db.set(ASSESS_STATUS_KEY, {'fingerprint': fingerprint, 'time': now,
+                               'status': list(status_get())})
+    db.flush()
+
+
+def status_relations():
+    """Units and data of the relations the workload status is assessed from,
+    read through the relation snapshot of the hook.
+
+    :returns: {relation name: {relation id: {unit: settings}}}
+    :rtype: Dict[str, Dict[str, Dict[str, dict]]]
+    """
+    names = set()
+    for interfaces in (list(REQUIRED_INTERFACES.values()) +
+                       list(get_optional_relations().values())):
+        names.update(interfaces)
+    snapshot = relation_snapshot()
+    return {name: {rid: {unit: snapshot.bag(rid=rid, unit=unit)
+                         for unit in related_units(rid)}
+                   for rid in relation_ids(name)}
+            for name in names}
+
+
+def status_fingerprint(services_to_check):
+    """Fingerprint of everything the workload status is assessed from.
+
+    Covers the charm config, the membership and data of the relations the
+    status checks, the state and main PID of the services checked, the
+    installed version of the packages the status depends on and the kernel
+    command line.
+
+    :param services_to_check: Services the status is assessed with
+    :type services_to_check: List[str]
+    :rtype: str
+    """
+    states = service_states(services_to_check, refresh=True)
+    state = {
+        'config': dict(config()),
+        'relations': status_relations(),
+        'paused': is_unit_paused_set(),
+        'services': {name: [state['running'], state.get('main_pid')]
+                     for name, state in states.items()},
+        'packages': installed_versions([VERSION_PACKAGE, 'vaultlocker']),
+        # a reboot can apply the isolation of the dedicated CPUs
+        'cmdline': kernel_cmdline(),
+    }
+    return hashlib.sha256(json.dumps(
+        state, sort_keys=True, default=str).encode('UTF-8')).hexdigest()
 
 
 def assess_status_func(configs, services_=None):
@@ -927,6 +1207,7 @@ def assess_status_func(configs, services_=None):
     required_interfaces.update(optional_relations)
     return make_assess_status_func(
         configs, required_interfaces,
+        charm_func=check_cpu_isolation,
         services=services_ or services(), ports=None)
 
 
@@ -0,0 +1,56 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import mock
+
+from test_utils import CharmTestCase
+
+import cpu_topology_report as actions
+import nova_compute_facts as facts
+
+
+class CPUTopologyReportTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(CPUTopologyReportTestCase, self).setUp(actions, ['hookenv'])
+        self.test_config = {'cpu-dedicated-set': 'auto',
+                            'cpu-host-cores': 1}
+        self.hookenv.config.side_effect = self.test_config.get
+        self.hookenv.action_get.return_value = None
+        host = facts.HostFacts(facts={
+            'numa_nodes': [{'node': 0, 'cpus': [0, 1, 2, 3]}],
+            'thread_siblings': [[0, 2], [1, 3]],
+        })
+        p = mock.patch('nova_compute_cpu.host_facts', return_value=host)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_cpu_topology_report(self):
+        actions.cpu_topology_report()
+        outmap = self.hookenv.action_set.call_args[0][0]
+        self.assertTrue(outmap['auto'])
+        self.assertEqual(json.loads(outmap['topology']),
+                         {'node0': ['0,2', '1,3']})
+        self.assertEqual(outmap['cpu-shared-set'], '0,2')
+        self.assertEqual(outmap['cpu-dedicated-set'], '1,3')
+        self.assertEqual(json.loads(outmap['nodes']),
+                         {'node0': {'shared': '0,2', 'dedicated': '1,3'}})
+
+    def test_cpu_topology_report_too_few_cores(self):
+        self.hookenv.action_get.return_value = 2
+        actions.cpu_topology_report()
+        self.assertFalse(self.hookenv.action_set.called)
+        self.assertTrue(self.hookenv.action_fail.called)
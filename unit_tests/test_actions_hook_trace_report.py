@@ -0,0 +1,120 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+from tempfile import mkdtemp
+
+import mock
+
+from test_utils import CharmTestCase
+
+import hook_trace_report as actions
+import nova_compute_trace as trace
+
+
+class HookTracerTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(HookTracerTestCase, self).setUp(trace, ['config', 'charm_dir'])
+        self.tmpdir = mkdtemp(prefix='hook-trace-test.')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.charm_dir.return_value = self.tmpdir
+
+    def test_trace_subprocess_calls(self):
+        tracer = trace.HookTracer('config-changed')
+        tracer.install()
+        try:
+            subprocess.check_call(['true'])
+            self.assertEqual(subprocess.call(['false']), 1)
+            with self.assertRaises(subprocess.CalledProcessError):
+                subprocess.check_output('exit 3', shell=True)
+        finally:
+            tracer.uninstall()
+        subprocess.call(['true'])
+        self.assertEqual(
+            [(c['function'], c['command'], c['returncode'])
+             for c in tracer.calls],
+            [('check_call', 'true', 0),
+             ('call', 'false', 1),
+             ('check_output', 'exit 3', 3)])
+        self.assertTrue(tracer.calls[0]['caller'].startswith(
+            '{}.test_trace_subprocess_calls:'.format(__name__)))
+
+    def test_write_rotates(self):
+        with mock.patch.object(trace, 'MAX_TRACES', 2):
+            for i in range(3):
+                tracer = trace.HookTracer('update-status')
+                tracer.start = 1000 + i
+                path = tracer.write()
+        self.assertEqual(oct(os.stat(path).st_mode & 0o777), '0o600')
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmpdir, trace.TRACE_DIR))),
+            ['1001.000000-update-status.json',
+             '1002.000000-update-status.json'])
+
+    def test_tracing_enabled(self):
+        self.config.return_value = False
+        self.assertFalse(trace.tracing_enabled())
+        with mock.patch.dict(os.environ, {trace.TRACE_ENV: '1'}):
+            self.assertTrue(trace.tracing_enabled())
+        self.config.return_value = True
+        self.assertTrue(trace.tracing_enabled())
+
+
+class MainTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(MainTestCase, self).setUp(actions, ['trace'])
+        self.trace.slowest_calls = trace.slowest_calls
+        self.trace.hook_totals = trace.hook_totals
+
+    def _call(self, command, duration, caller='nova_compute_utils.f:1'):
+        return {'command': command, 'function': 'check_call',
+                'caller': caller, 'start': 0.0, 'duration': duration,
+                'returncode': 0}
+
+    @mock.patch('charmhelpers.core.hookenv.action_get')
+    @mock.patch('charmhelpers.core.hookenv.action_set')
+    def test_hook_trace_report(self, action_set, action_get):
+        action_get.side_effect = {'top': 2}.get
+        self.trace.load_traces.return_value = [
+            {'hook': 'config-changed', 'duration': 90.0,
+             'calls': [self._call('update-rc.d', 60.0),
+                       self._call('virsh net-list', 1.0)]},
+            {'hook': 'update-status', 'duration': 2.0,
+             'calls': [self._call('juju-log', 1.5)]},
+        ]
+        actions.hook_trace_report()
+        result = action_set.call_args[0][0]
+        self.assertEqual(result['traces'], 2)
+        self.assertEqual(result['slowest-calls'].splitlines(), [
+            '   60.000s  rc=0  config-changed  nova_compute_utils.f:1  '
+            'update-rc.d',
+            '    1.500s  rc=0  update-status  nova_compute_utils.f:1  '
+            'juju-log'])
+        self.assertEqual(result['hook-totals'].splitlines(), [
+            'config-changed: 1 runs, 90.000s total, 61.000s in 2 '
+            'subprocess calls',
+            'update-status: 1 runs, 2.000s total, 1.500s in 1 '
+            'subprocess calls'])
+
+    @mock.patch('charmhelpers.core.hookenv.action_get')
+    @mock.patch('charmhelpers.core.hookenv.action_fail')
+    def test_hook_trace_report_no_traces(self, action_fail, action_get):
+        action_get.return_value = None
+        self.trace.load_traces.return_value = []
+        actions.hook_trace_report()
+        self.assertTrue(action_fail.called)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import mock
 import os
 import shutil
@@ -31,9 +32,19 @@ class MainTestCase(CharmTestCase):
     def setUp(self):
         self.sysfs = sysfs = mkdtemp(prefix=tmpdir)
         self.addCleanup(shutil.rmtree, sysfs)
-        p = mock.patch('hugepagereport.SYSFS', new=sysfs)
+        self.proc = proc = mkdtemp(prefix=tmpdir)
+        self.addCleanup(shutil.rmtree, proc)
+        self.test_config = {}
+        for name, value in (('SYSFS', sysfs), ('PROC', proc),
+                            ('KERNELCMD', os.path.join(proc, 'cmdline'))):
+            p = mock.patch('hugepagereport.{}'.format(name), new=value)
+            p.start()
+            self.addCleanup(p.stop)
+        p = mock.patch('charmhelpers.core.hookenv.config',
+                       side_effect=self.test_config.get)
         p.start()
         self.addCleanup(p.stop)
+        self.write(proc, 'cmdline', 'BOOT_IMAGE=/vmlinuz ro')
         hpath = "{}/devices/system/node/node0/hugepages/hugepages-1048576kB"
         self.hugepagestats = hpath.format(sysfs)
         os.makedirs(self.hugepagestats)
@@ -41,6 +52,13 @@ class MainTestCase(CharmTestCase):
             with open(os.path.join(self.hugepagestats, fn), 'w') as f:
                 f.write(val)
 
+    def write(self, root, path, content):
+        path = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
     @mock.patch('charmhelpers.core.hookenv.action_get')
     @mock.patch('charmhelpers.core.hookenv.action_set')
     def test_hugepagesreport(self, mock_action_set, mock_action_get):
@@ -53,3 +71,81 @@ class MainTestCase(CharmTestCase):
         self.assert_('hugepagestats' in d)
         self.assert_(
             d['hugepagestats'].find('/free_hugepages') != -1)
+
+    @mock.patch.object(actions, 'hugepage_allocation')
+    @mock.patch('charmhelpers.core.hookenv.action_set')
+    def test_hugepagesreport_structured(self, mock_action_set,
+                                        hugepage_allocation):
+        dummy_action = []
+        mock_action_set.side_effect = dummy_action.append
+        self.test_config['hugepages'] = '1G:16;2M:512'
+        hugepage_allocation.return_value = {1048576: {0: 12, 1: 4},
+                                            2048: {0: 256, 1: 256}}
+        self.write(self.proc, 'cmdline',
+                   'ro hugepages=512 hugepagesz=1G hugepages=16 quiet')
+        self.write(self.proc, 'meminfo',
+                   'MemTotal:       16384000 kB\n'
+                   'HugePages_Total:    1024\n'
+                   'HugePages_Rsvd:       10\n'
+                   'Hugepagesize:       2048 kB\n')
+        self.write(self.proc, 'mounts',
+                   'proc /proc proc rw 0 0\n'
+                   'nodev /run/hugepages/kvm-1G hugetlbfs rw,pagesize=1024M '
+                   '0 0\n')
+        self.write(self.proc, '1234/comm', 'qemu-system-x86')
+        self.write(self.proc, '1234/numa_maps',
+                   '7f0000000000 bind:0 file=/run/hugepages/kvm-1G/qemu '
+                   'huge dirty=8 N0=8 kernelpagesize_kB=1048576\n'
+                   '7f1000000000 default anon=10 N0=4 N1=6 '
+                   'kernelpagesize_kB=4\n')
+        self.write(self.proc, '99/comm', 'bash')
+        node1 = os.path.join(self.sysfs, 'devices/system/node/node1/'
+                             'hugepages/hugepages-1048576kB')
+        self.write(node1, 'nr_hugepages', '2')
+        host = os.path.join(self.sysfs, 'kernel/mm/hugepages/'
+                            'hugepages-1048576kB')
+        for name, value in (('nr_hugepages', '14'), ('free_hugepages', '6'),
+                            ('resv_hugepages', '1')):
+            self.write(host, name, value)
+
+        actions.hugepages_report()
+        d = dummy_action[0]
+        report = json.loads(d['report'])
+        self.assertEqual(report['nodes'], {
+            'node0': {'1G': {'total': 12, 'free': 224, 'surplus': 0}},
+            'node1': {'1G': {'total': 2, 'free': 0, 'surplus': 0}}})
+        self.assertEqual(report['host'], {'1G': {
+            'total': 14, 'free': 6, 'surplus': 0, 'reserved': 1,
+            'overcommit': 0}})
+        self.assertEqual(report['meminfo'], {
+            'HugePages_Total': '1024', 'HugePages_Rsvd': '10',
+            'Hugepagesize': '2048 kB'})
+        self.assertEqual(report['cmdline'],
+                         {'pages': {'default': '512', '1G': '16'}})
+        self.assertEqual(report['mounts'], [
+            {'mount': '/run/hugepages/kvm-1G',
+             'options': 'rw,pagesize=1024M'}])
+        self.assertEqual(report['processes'], [
+            {'pid': 1234, 'name': 'qemu-system-x86',
+             'hugepages': {'1G': {'node0': 8}}}])
+        shortfalls = [(s['source'], s['size'], s['node'], s['requested'],
+                       s['allocated']) for s in report['shortfalls']]
+        self.assertEqual(shortfalls, [
+            ('hugepages config', '1G', 'node1', 4, 2),
+            ('hugepages config', '2M', 'node0', 256, 0),
+            ('hugepages config', '2M', 'node1', 256, 0),
+            ('kernel cmdline', '2M', 'all', 512, 0),
+            ('kernel cmdline', '1G', 'all', 16, 14)])
+        self.assertIn('hint', report['shortfalls'][0])
+        self.assertNotIn('hint', report['shortfalls'][1])
+        self.assertIn('node1: 2 of 4 1G pages allocated (hugepages config)',
+                      d['shortfalls'])
+
+    @mock.patch('charmhelpers.core.hookenv.action_fail')
+    @mock.patch('charmhelpers.core.hookenv.action_set')
+    def test_hugepagesreport_no_cmdline(self, mock_action_set,
+                                        mock_action_fail):
+        os.unlink(os.path.join(self.proc, 'cmdline'))
+        actions.hugepages_report()
+        self.assertFalse(mock_action_set.called)
+        self.assertTrue(mock_action_fail.called)
@@ -32,7 +32,8 @@ from test_utils import (
 
 TO_PATCH = [
     'config_changed',
-    'do_openstack_upgrade'
+    'do_openstack_upgrade',
+    'is_unit_paused_set',
 ]
 
 
@@ -56,12 +57,15 @@ class TestNovaComputeUpgradeActions(CharmTestCase):
 
         upgrade_avail.return_value = True
         config.return_value = True
+        self.is_unit_paused_set.return_value = True
 
         def fake_relation_ids(thing):
             return {'neutron-plugin': ['1'],
                     'nova-ceilometer': ['2']}[thing]
 
         relation_ids.side_effect = fake_relation_ids
+        # config_changed() does nothing while paused
+        self.config_changed.return_value = None
 
         openstack_upgrade.openstack_upgrade()
 
@@ -71,6 +75,25 @@ class TestNovaComputeUpgradeActions(CharmTestCase):
         nova_ceilometer_joined.assert_called_once_with(
             "2", remote_restart=True)
 
+    @patch.object(openstack_upgrade, 'neutron_plugin_joined')
+    @patch('charmhelpers.contrib.openstack.utils.config')
+    @patch('charmhelpers.contrib.openstack.utils.action_set')
+    @patch('charmhelpers.contrib.openstack.utils.openstack_upgrade_available')
+    @patch('charmhelpers.contrib.openstack.utils.juju_log')
+    def test_openstack_upgrade_not_paused(self, log, upgrade_avail,
+                                          action_set, config,
+                                          neutron_plugin_joined):
+        upgrade_avail.return_value = True
+        config.return_value = True
+        self.is_unit_paused_set.return_value = False
+
+        openstack_upgrade.openstack_upgrade()
+
+        # the full reconcile of config_changed() restarts the plugins
+        self.assertFalse(neutron_plugin_joined.called)
+        self.assertTrue(self.config_changed.called)
+        self.config_changed.return_value.save.assert_called_once_with()
+
     @patch('charmhelpers.contrib.openstack.utils.config')
     @patch('charmhelpers.contrib.openstack.utils.action_set')
     @patch('charmhelpers.contrib.openstack.utils.openstack_upgrade_available')  # noqa
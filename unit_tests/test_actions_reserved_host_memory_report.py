@@ -0,0 +1,54 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from test_utils import CharmTestCase
+
+import reserved_host_memory_report as actions
+
+
+class ReservedHostMemoryReportTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(ReservedHostMemoryReportTestCase, self).setUp(
+            actions, ['hookenv', 'reserved_host_memory'])
+        self.test_config = {'reserved-host-memory': 512,
+                            'reserved-host-memory-auto': False}
+        self.hookenv.config.side_effect = self.test_config.get
+        self.reserved_host_memory.return_value = {
+            'total': 5120,
+            'parts': {'host': 1024, 'ceph-osd': 4096},
+            'sized-from': {'ceph-osds': ['ceph-0']}}
+
+    def test_reserved_host_memory_report(self):
+        actions.reserved_host_memory_report()
+        # reporting does not record the guests running
+        self.reserved_host_memory.assert_called_once_with(record=False)
+        outmap = self.hookenv.action_set.call_args[0][0]
+        self.assertFalse(outmap['auto'])
+        self.assertEqual(outmap['reserved-host-memory'], 512)
+        self.assertEqual(outmap['auto-reserved-host-memory'], 5120)
+        self.assertEqual(outmap['summary'],
+                         '5120 MB reserved for the host: host 1024 MB, '
+                         'ceph-osd 4096 MB')
+        self.assertEqual(json.loads(outmap['breakdown'])['sized-from'],
+                         {'ceph-osds': ['ceph-0']})
+
+    def test_reserved_host_memory_report_auto(self):
+        self.test_config['reserved-host-memory-auto'] = True
+        actions.reserved_host_memory_report()
+        outmap = self.hookenv.action_set.call_args[0][0]
+        self.assertTrue(outmap['auto'])
+        self.assertEqual(outmap['reserved-host-memory'], 5120)
@@ -0,0 +1,40 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test_utils import CharmTestCase
+
+import reset_guests_high_water as actions
+
+
+class ResetGuestsHighWaterTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(ResetGuestsHighWaterTestCase, self).setUp(
+            actions, ['hookenv', 'reserved_host_memory',
+                      'reset_guests_high_water'])
+        self.reserved_host_memory.return_value = {
+            'total': 2304,
+            'parts': {'host': 1024, 'guests': 1280},
+            'sized-from': {'running-guests': 4}}
+
+    def test_reset_guests_high_water(self):
+        actions.reset_guests_high_water_action()
+        self.reset_guests_high_water.assert_called_once_with()
+        self.reserved_host_memory.assert_called_once_with(record=False)
+        self.hookenv.action_set.assert_called_once_with({
+            'running-guests': 4,
+            'auto-reserved-host-memory': 2304,
+            'summary': '2304 MB reserved for the host: host 1024 MB, '
+                       'guests 1280 MB',
+        })
@@ -0,0 +1,477 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the changes made to the charmhelpers vendored in hooks/."""
+
+import datetime
+import json
+import os
+import sqlite3
+
+from mock import MagicMock, call, patch
+
+from charmhelpers.contrib.network import ip as ch_ip
+from charmhelpers.contrib.openstack import templating
+from charmhelpers.contrib.openstack import utils as ch_utils
+from charmhelpers.core import hookenv, unitdata
+from charmhelpers.core import host as ch_host
+from charmhelpers.fetch import ubuntu as fetch_ubuntu
+
+from test_utils import CharmTestCase, ScratchDirTestCase, TestKV
+
+
+class UnitdataTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(UnitdataTests, self).setUp(unitdata, [])
+
+    def test_write_back(self):
+        path = self.path('unit-state.db')
+        db = unitdata.Storage(path, wal=True)
+        self.addCleanup(db.close)
+
+        def stored():
+            conn = sqlite3.connect(path)
+            try:
+                return dict(conn.execute('select key, data from kv'))
+            finally:
+                conn.close()
+
+        db.set('host_uuid', 'abc')
+        db.update({'a': 1, 'b': [2]}, prefix='cfg.')
+        self.assertEqual(db.get('host_uuid'), 'abc')
+        self.assertEqual(db.getrange('cfg.', strip=True), {'a': 1, 'b': [2]})
+        # nothing is written until the flush
+        self.assertEqual(stored(), {})
+        db.flush()
+        self.assertEqual(stored(), {'host_uuid': '"abc"', 'cfg.a': '1',
+                                    'cfg.b': '[2]'})
+        self.assertEqual(
+            sqlite3.connect(path).execute('pragma journal_mode').fetchone(),
+            ('wal',))
+
+        with db.hook_scope('config-changed'):
+            db.unsetrange(prefix='cfg.')
+            db.set('host_uuid', 'def')
+        self.assertEqual(stored(), {'host_uuid': '"def"'})
+        self.assertEqual([h[2] for h in db.gethistory('host_uuid')],
+                         ['"def"'])
+
+        db.set('host_uuid', 'ghi')
+        db.flush(False)
+        self.assertEqual(db.get('host_uuid'), 'def')
+
+    def test_compact(self):
+        db = unitdata.Storage(':memory:')
+        self.addCleanup(db.close)
+        for i in range(5):
+            with db.hook_scope('update-status'):
+                db.set('env', {'JUJU_CONTEXT_ID': i})
+                db.set('unit-paused', i < 2)
+        self.assertEqual(len(db.gethistory('env')), 5)
+        before, after = db.compact(max_revisions=3, max_hooks=4)
+        self.assertTrue(before > 0 and after > 0)
+        self.assertEqual([json.loads(h[2]) for h in db.gethistory('env')],
+                         [{'JUJU_CONTEXT_ID': i} for i in (2, 3, 4)])
+        self.assertEqual([json.loads(h[2])
+                          for h in db.gethistory('unit-paused')], [False])
+        self.assertEqual(db.get('env'), {'JUJU_CONTEXT_ID': 4})
+        db.cursor.execute('select count(*) from hooks')
+        self.assertEqual(db.cursor.fetchone(), (4,))
+        # everything is older than a day in the future
+        future = datetime.datetime(2100, 1, 1)
+        with patch.object(unitdata.datetime, 'datetime') as _datetime:
+            _datetime.utcnow.return_value = future
+            db.compact(max_age=86400)
+        self.assertEqual(db.gethistory('env'), [])
+        self.assertEqual(db.get('unit-paused'), False)
+
+    def test_flushed_on_hook_exit(self):
+        kv = MagicMock()
+        registry = hookenv.Hooks()
+        registry.register('config-changed', lambda: None)
+        with patch.object(unitdata, '_KV', kv):
+            registry.execute(['hooks/config-changed'])
+        kv.flush.assert_called_once_with()
+
+
+class HookenvTests(CharmTestCase):
+
+    def setUp(self):
+        super(HookenvTests, self).setUp(hookenv, [])
+
+    @patch.object(hookenv, 'local_unit')
+    @patch.object(hookenv.subprocess, 'check_call')
+    @patch.object(hookenv.subprocess, 'check_output')
+    def test_relation_set_unchanged_not_published(self, check_output,
+                                                  check_call, local_unit):
+        check_output.return_value = ''
+        kv = MagicMock()
+        kv.get.return_value = {'hostname': 'host1'}
+        with patch.object(hookenv, '_relation_set_accepts_file', None), \
+                patch.object(hookenv, '_published_relation_settings', None), \
+                patch.object(hookenv, '_atexit', []), \
+                patch('charmhelpers.core.unitdata.kv') as _kv:
+            _kv.return_value = kv
+            hookenv.relation_set(relation_id='cloud-compute:1',
+                                 hostname='host1')
+            check_call.assert_not_called()
+            hookenv.relation_set(relation_id='cloud-compute:1',
+                                 hostname='host1', ssh_public_key='key')
+            hookenv.relation_set(relation_id='cloud-compute:1',
+                                 hostname='host1', ssh_public_key='key')
+            hookenv.relation_set(relation_id='cloud-compute:1',
+                                 ssh_public_key=None)
+            self.assertEqual(check_call.call_count, 2)
+            check_call.assert_called_with(
+                ['relation-set', '-r', 'cloud-compute:1',
+                 'ssh_public_key='])
+            # the capability probe runs once
+            check_output.assert_called_once_with(
+                ['relation-set', '--help'], universal_newlines=True)
+            kv.set.assert_not_called()
+            hookenv._run_atexit()
+            kv.set.assert_called_once_with(
+                'hookenv.relation_set.cloud-compute:1',
+                {'hostname': 'host1', 'ssh_public_key': None})
+            kv.flush.assert_called_once_with()
+
+    @patch.object(hookenv, '_juju_log')
+    def test_buffered_log(self, _juju_log):
+        with patch.object(hookenv, '_log_buffer', []):
+            hookenv.log('one')
+            hookenv.log('two')
+            hookenv.log('three', level=hookenv.DEBUG)
+            hookenv.log('four', level=hookenv.INFO)
+            hookenv.log('five', level=hookenv.INFO)
+            _juju_log.assert_not_called()
+            hookenv.log('failed', level=hookenv.ERROR)
+            _juju_log.assert_has_calls([
+                call('one\ntwo', None),
+                call('three', hookenv.DEBUG),
+                call('four\nfive', hookenv.INFO),
+                call('failed', hookenv.ERROR),
+            ])
+            hookenv.log('six')
+            hookenv.flush_log()
+            _juju_log.assert_called_with('six', None)
+            self.assertEqual(_juju_log.call_count, 5)
+
+
+class HostTests(CharmTestCase):
+
+    def setUp(self):
+        super(HostTests, self).setUp(ch_host, [])
+
+    @patch.object(ch_host.subprocess, 'call')
+    @patch.object(ch_host.subprocess, 'check_output')
+    @patch.object(ch_host, 'init_is_systemd')
+    def test_service_states_batched(self, _init_is_systemd, _check_output,
+                                    _call):
+        _init_is_systemd.return_value = True
+        _check_output.return_value = (
+            'MainPID=1234\nActiveState=active\nSubState=running\n\n'
+            'MainPID=0\nActiveState=inactive\nSubState=dead\n\n'
+            'MainPID=0\nActiveState=reloading\nSubState=reload\n')
+        _call.return_value = 0
+        with patch.object(ch_host, '_service_states', {}):
+            self.assertEqual(
+                ch_utils._ows_check_services_running(
+                    ['nova-compute', 'libvirtd', 'iscsid'], None),
+                ('blocked',
+                 'Services not running that should be: libvirtd'))
+            self.assertEqual(
+                ch_utils.check_actually_paused(['nova-compute', 'libvirtd']),
+                ('blocked', 'Services should be paused but these services '
+                 'running: nova-compute'))
+            _check_output.assert_called_once_with(
+                ['systemctl', 'show', '-p', 'ActiveState,SubState,MainPID',
+                 'nova-compute', 'libvirtd', 'iscsid'],
+                universal_newlines=True)
+            self.assertEqual(
+                ch_host.service_states(['nova-compute'])['nova-compute'],
+                {'running': True, 'active_state': 'active',
+                 'sub_state': 'running', 'main_pid': 1234})
+            # controlling a service drops its state
+            ch_host.service_stop('nova-compute')
+            _check_output.return_value = (
+                'MainPID=0\nActiveState=inactive\nSubState=dead\n')
+            self.assertFalse(
+                ch_host.service_states(['nova-compute'])['nova-compute'][
+                    'running'])
+            _check_output.assert_called_with(
+                ['systemctl', 'show', '-p', 'ActiveState,SubState,MainPID',
+                 'nova-compute'],
+                universal_newlines=True)
+
+
+class NetworkIPTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(NetworkIPTests, self).setUp(ch_ip, [])
+
+    @patch.object(ch_ip.subprocess, 'call')
+    def test_tcp_listeners(self, _call):
+        header = ('  sl  local_address rem_address   st tx_queue rx_queue '
+                  'tr tm->when retrnsmt   uid  timeout inode\n')
+        tcp = self.path('tcp')
+        with open(tcp, 'w') as f:
+            f.write(header)
+            # 0.0.0.0:16509 and 127.0.0.1:6640 listening, then a connection
+            f.write('   0: 00000000:407D 00000000:0000 0A 00000000:00000000 '
+                    '00:00000000 00000000     0        0 1\n')
+            f.write('   1: 0100007F:19F0 00000000:0000 0A 00000000:00000000 '
+                    '00:00000000 00000000     0        0 2\n')
+            f.write('   2: 0100007F:9C40 0100007F:407D 01 00000000:00000000 '
+                    '00:00000000 00000000     0        0 3\n')
+        tcp6 = self.path('tcp6')
+        with open(tcp6, 'w') as f:
+            f.write(header)
+            # [::1]:5900 and [fe80::1]:8775 listening
+            f.write('   0: 00000000000000000000000001000000:170C '
+                    '00000000000000000000000000000000:0000 0A '
+                    '00000000:00000000 00:00000000 00000000 0 0 4\n')
+            f.write('   1: 000080FE000000000000000001000000:2247 '
+                    '00000000000000000000000000000000:0000 0A '
+                    '00000000:00000000 00:00000000 00000000 0 0 5\n')
+        with patch.object(ch_ip, 'PROC_NET_TCP', (tcp, tcp6)):
+            listeners = ch_ip.tcp_listeners()
+            self.assertEqual(listeners, {
+                16509: {'0.0.0.0'}, 6640: {'127.0.0.1'}, 5900: {'::1'},
+                8775: {'fe80::1'}})
+            self.assertEqual(
+                list(ch_utils._check_listening_on_ports_list(
+                    [16509, 6640, 5900, 8775, 40000])[1]),
+                [True, True, True, False, False])
+            self.assertTrue(ch_ip.port_has_listener('fe80::1', 8775))
+            self.assertTrue(ch_ip.port_has_listener('10.0.0.1', 16509))
+            self.assertFalse(ch_ip.port_has_listener('10.0.0.1', 6640))
+        self.assertFalse(_call.called)
+        # nc is still used for hostnames
+        _call.return_value = 0
+        self.assertTrue(ch_ip.port_has_listener('localhost', 22))
+        _call.assert_called_once_with(['nc', '-z', 'localhost', '22'])
+
+
+class FetchUbuntuTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(FetchUbuntuTests, self).setUp(fetch_ubuntu, [])
+
+    @patch.object(fetch_ubuntu, 'log')
+    @patch.object(fetch_ubuntu, '_run_apt_command')
+    @patch.object(fetch_ubuntu.ubuntu_apt_pkg, 'Cache')
+    @patch('charmhelpers.core.unitdata.kv')
+    def test_package_state_cache(self, _kv, _cache, _run_apt_command, _log):
+        _kv.return_value = TestKV()
+        _kv.return_value.unset = MagicMock(
+            side_effect=_kv.return_value.data.pop)
+        _cache.return_value._dpkg_list.return_value = {
+            'nova-common': {'name': 'nova-common',
+                            'version': '2:21.0.0-0ubuntu1'}}
+        _cache.return_value._apt_cache_show.return_value = {
+            'vaultlocker': {'package': 'vaultlocker'}}
+        self.write('status', 'Package: nova-common\n')
+        status = self.path('status')
+        with patch.object(fetch_ubuntu, 'DPKG_STATUS', status), \
+                patch.object(fetch_ubuntu, '_package_state', None):
+            self.assertEqual(
+                fetch_ubuntu.filter_installed_packages(
+                    ['nova-common', 'vaultlocker', 'bogus']),
+                ['vaultlocker', 'bogus'])
+            _log.assert_called_with(
+                'Package bogus has no installation candidate.',
+                level='WARNING')
+            self.assertEqual(fetch_ubuntu.get_upstream_version('nova-common'),
+                             '21.0.0')
+            self.assertEqual(
+                fetch_ubuntu.filter_missing_packages(['nova-common']),
+                ['nova-common'])
+            # one dpkg query for all of the above
+            _cache.return_value._dpkg_list.assert_called_once_with(
+                ['nova-common', 'vaultlocker', 'bogus'])
+
+            # a later hook reuses the state kept in unitdata
+            fetch_ubuntu._package_state = None
+            fetch_ubuntu.filter_installed_packages(['vaultlocker'])
+            self.assertEqual(_cache.return_value._dpkg_list.call_count, 1)
+
+            # until dpkg changes the status database
+            with open(status, 'a') as f:
+                f.write('Package: vaultlocker\n')
+            fetch_ubuntu.filter_installed_packages(['vaultlocker'])
+            self.assertEqual(_cache.return_value._dpkg_list.call_count, 2)
+
+            fetch_ubuntu.apt_install(['vaultlocker'])
+            _kv.return_value.unset.assert_called_once_with(
+                fetch_ubuntu.PACKAGE_STATE_KEY)
+            fetch_ubuntu.filter_installed_packages(['vaultlocker'])
+            self.assertEqual(_cache.return_value._dpkg_list.call_count, 3)
+
+
+class OpenStackUtilsTests(CharmTestCase):
+
+    def setUp(self):
+        super(OpenStackUtilsTests, self).setUp(ch_utils, [])
+        self.test_kv = TestKV()
+
+    @patch.object(ch_utils, 'config')
+    @patch.object(ch_utils, 'get_os_codename_install_source')
+    @patch.object(ch_utils, 'get_os_codename_package')
+    @patch.object(ch_utils, 'installed_versions')
+    @patch('charmhelpers.core.unitdata.kv')
+    def test_os_release_persisted(self, _kv, _installed_versions,
+                                  _get_os_codename_package,
+                                  _get_os_codename_install_source, _config):
+        _kv.return_value = self.test_kv
+        self.test_kv.unset = MagicMock(side_effect=self.test_kv.data.pop)
+        versions = {'nova-common': '2:21.0.0-0ubuntu1'}
+        _installed_versions.side_effect = lambda pkgs: {
+            p: versions.get(p) for p in pkgs}
+        _config.return_value = 'cloud:bionic-ussuri'
+        _get_os_codename_package.return_value = 'ussuri'
+        self.addCleanup(setattr, ch_utils, '_os_rel', None)
+
+        def os_release():
+            # as a new hook would
+            ch_utils._os_rel = None
+            return ch_utils.os_release('nova-common', base='icehouse')
+
+        self.assertEqual(os_release(), 'ussuri')
+        self.assertEqual(os_release(), 'ussuri')
+        self.assertEqual(_get_os_codename_package.call_count, 1)
+        # a new origin or package version resolves it again
+        _config.return_value = 'cloud:bionic-victoria'
+        _get_os_codename_package.return_value = 'ussuri'
+        self.assertEqual(os_release(), 'ussuri')
+        versions['nova-common'] = '2:22.0.0-0ubuntu1'
+        _get_os_codename_package.return_value = 'victoria'
+        self.assertEqual(os_release(), 'victoria')
+        self.assertEqual(_get_os_codename_package.call_count, 3)
+        ch_utils.reset_os_release()
+        self.assertIsNone(self.test_kv.get(ch_utils.OS_RELEASE_KEY))
+        self.assertEqual(os_release(), 'victoria')
+        self.assertEqual(_get_os_codename_package.call_count, 4)
+
+
+class TemplatingTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(TemplatingTests, self).setUp(templating, [])
+
+    @patch('charmhelpers.contrib.openstack.templating.log')
+    def test_render_pass_shares_context_results(self, _log):
+        calls = []
+
+        class FakeContext(object):
+            interfaces = ['fake']
+
+            def __init__(self, value='a'):
+                self.value = value
+
+            def __call__(self):
+                calls.append(self.value)
+                return {'value': self.value}
+
+        renderer = templating.OSConfigRenderer(
+            templates_dir=self.root, openstack_release='queens')
+        for name, ctxt in (('a', FakeContext()), ('b', FakeContext()),
+                           ('c', FakeContext('c'))):
+            renderer.register(self.path(name), [ctxt],
+                              config_template='{{ value }}')
+        renderer.write_all()
+        self.assertEqual(sorted(calls), ['a', 'c'])
+        with open(self.path('b')) as f:
+            self.assertEqual(f.read(), 'a')
+        # results only last for one render pass
+        renderer.write_all()
+        self.assertEqual(len(calls), 4)
+
+    @patch('charmhelpers.contrib.openstack.templating.log')
+    def test_renderer_write_skips_unchanged(self, _log):
+        path = self.path('nova.conf')
+        self.addCleanup(ch_host._tracked_paths.discard, path)
+        ctxt = MagicMock(interfaces=[])
+        ctxt.return_value = {'value': 'a'}
+        renderer = templating.OSConfigRenderer(
+            templates_dir=self.root, openstack_release='queens')
+        renderer.register(path, [ctxt], config_template='{{ value }}')
+
+        def restart_on_write():
+            with patch.object(ch_host, 'service') as service:
+                ch_host.restart_on_change_helper(
+                    lambda: renderer.write(path), {path: ['nova-compute']})
+            return service.call_args_list
+
+        with patch.object(ch_host, 'path_hash') as path_hash:
+            self.assertEqual(restart_on_write(),
+                             [call('restart', 'nova-compute')])
+            os.chmod(path, 0o640)
+            inode = os.stat(path).st_ino
+            self.assertEqual(restart_on_write(), [])
+            self.assertEqual(os.stat(path).st_ino, inode)
+            ctxt.return_value = {'value': 'b'}
+            self.assertEqual(restart_on_write(),
+                             [call('restart', 'nova-compute')])
+            path_hash.assert_not_called()
+        self.assertNotEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'b')
+        self.assertEqual(os.listdir(self.root), ['nova.conf'])
+
+    @patch('charmhelpers.contrib.openstack.templating.log')
+    def test_incomplete_context_data_indexed(self, _log):
+        related = []
+
+        class FakeContext(object):
+            missing_data = []
+
+            def __init__(self, interfaces, value=None):
+                self.interfaces = interfaces
+                self.value = value
+
+            def __call__(self):
+                self.missing_data = [] if self.value else ['value']
+                return {'value': self.value} if self.value else {}
+
+            def get_related(self):
+                related.append(self.interfaces)
+                return self.interfaces != ['cloud-compute']
+
+        renderer = templating.OSConfigRenderer(
+            templates_dir=self.root, openstack_release='queens')
+        # the same generators registered for several files
+        for name in ('a', 'b', 'c'):
+            renderer.register(
+                self.path(name),
+                [FakeContext(['amqp']), FakeContext(['image-service'], 'x'),
+                 FakeContext(['cloud-compute'])],
+                config_template='{{ value }}')
+        self.assertEqual(list(renderer._interface_contexts),
+                         ['amqp', 'image-service', 'cloud-compute'])
+        self.assertEqual(
+            ch_utils.incomplete_relation_data(renderer, {
+                'messaging': ['amqp'],
+                'image': ['image-service'],
+                'compute': ['cloud-compute', 'amqp']}),
+            {'messaging': {'amqp': {'missing_data': ['value'],
+                                    'related': True}},
+             'compute': {'amqp': {'missing_data': ['value'],
+                                  'related': True},
+                         'cloud-compute': {'related': False}}})
+        # each distinct generator is checked once for the whole assessment
+        self.assertEqual(sorted(related), [['amqp'], ['cloud-compute']])
+        renderer.get_incomplete_context_data(['amqp'])
+        self.assertEqual(len(related), 3)
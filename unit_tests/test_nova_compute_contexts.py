@@ -527,6 +527,33 @@ class NovaComputeContextTests(CharmTestCase):
              'default_ephemeral_format': 'ext4',
              'reserved_host_memory': 512}, libvirt())
 
+    @patch.object(context, 'reserved_hugepages')
+    @patch.object(context, 'hugepage_allocation')
+    def test_libvirt_hugepages_spec(self, hugepage_allocation,
+                                    reserved_hugepages):
+        self.kv.return_value = FakeUnitdata(**{'host_uuid': self.host_uuid})
+        self.os_release.return_value = 'kilo'
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'lucid'}
+        self.test_config.set('hugepages', '1G:16;2M:512')
+        hugepage_allocation.return_value = {1048576: {0: 8, 1: 8},
+                                            2048: {0: 256, 1: 256}}
+        reserved_hugepages.return_value = ['node:0,size:64,count:4']
+        libvirt = context.NovaComputeLibvirtContext()()
+        hugepage_allocation.assert_called_once_with('1G:16;2M:512')
+        self.assertEqual(libvirt['hugetlbfs_mounts'],
+                         ['/run/hugepages/kvm-2M', '/run/hugepages/kvm-1G'])
+        self.assertEqual(libvirt['reserved_huge_pages'],
+                         ['node:0,size:64,count:4'])
+        # the pages are not mounted on /run/hugepages/kvm
+        self.assertEqual(libvirt['kvm_hugepages'], 0)
+
+        # reserved-huge-pages is used as set
+        self.test_config.set('reserved-huge-pages',
+                             'node:0,size:2048,count:64')
+        self.assertEqual(
+            context.NovaComputeLibvirtContext()()['reserved_huge_pages'],
+            ['node:0,size:2048,count:64'])
+
     def test_libvirt_context_libvirtd_force_raw_images(self):
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'zesty'}
         self.os_release.return_value = 'ocata'
@@ -659,6 +686,46 @@ class NovaComputeContextTests(CharmTestCase):
              'cpu_shared_set': "4-12,^8,15",
              'cpu_dedicated_set': "0-3,^10,33"}, libvirt())
 
+    @patch.object(context, 'cpu_sets')
+    def test_libvirt_auto_cpu_sets(self, cpu_sets):
+        self.kv.return_value = FakeUnitdata(**{'host_uuid': self.host_uuid})
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'bionic'}
+        self.test_config.set('cpu-dedicated-set', 'auto')
+        self.test_config.set('cpu-host-cores', 2)
+        self.test_config.set('vcpu-pin-set', '^0^2')
+        cpu_sets.return_value = {'cpu_shared_set': '0-1,4-5',
+                                 'cpu_dedicated_set': '2-3,6-7'}
+        self.os_release.return_value = 'train'
+        ctxt = context.NovaComputeLibvirtContext()()
+        cpu_sets.assert_called_with('auto', 2)
+        self.assertEqual(ctxt['cpu_shared_set'], '0-1,4-5')
+        self.assertEqual(ctxt['cpu_dedicated_set'], '2-3,6-7')
+        self.assertEqual(ctxt['vcpu_pin_set'], None)
+
+        self.os_release.return_value = 'stein'
+        ctxt = context.NovaComputeLibvirtContext()()
+        self.assertEqual(ctxt['vcpu_pin_set'], '2-3,6-7')
+        self.assertNotIn('cpu_dedicated_set', ctxt)
+
+        cpu_sets.side_effect = ValueError('too few cores')
+        ctxt = context.NovaComputeLibvirtContext()()
+        self.assertNotIn('cpu_shared_set', ctxt)
+
+    @patch.object(context, 'hook_reserved_host_memory')
+    def test_libvirt_reserved_host_memory_auto(self, reserved_host_memory):
+        self.kv.return_value = FakeUnitdata(**{'host_uuid': self.host_uuid})
+        self.lsb_release.return_value = {'DISTRIB_CODENAME': 'bionic'}
+        self.test_config.set('reserved-host-memory-auto', True)
+        reserved_host_memory.return_value = {
+            'total': 3072,
+            'parts': {'host': 2048, 'guests': 1024},
+            'sized-from': {}}
+        ctxt = context.NovaComputeLibvirtContext()()
+        self.assertEqual(ctxt['reserved_host_memory'], 3072)
+        self.log.assert_any_call(
+            '3072 MB reserved for the host: host 2048 MB, guests 1024 MB',
+            level=context.INFO)
+
     def test_vcpu_pin_set(self):
         self.kv.return_value = FakeUnitdata(**{'host_uuid': self.host_uuid})
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'lucid'}
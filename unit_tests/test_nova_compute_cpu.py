@@ -0,0 +1,80 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from test_utils import CharmTestCase
+
+import nova_compute_cpu as cpu
+import nova_compute_facts as facts
+
+TO_PATCH = [
+    'host_facts',
+]
+
+
+class NovaComputeCPUTests(CharmTestCase):
+
+    def setUp(self):
+        super(NovaComputeCPUTests, self).setUp(cpu, TO_PATCH)
+        # two nodes of three cores with two threads each
+        self.host = facts.HostFacts(facts={
+            'numa_nodes': [
+                {'node': 0, 'cpus': [0, 1, 2, 6, 7, 8]},
+                {'node': 1, 'cpus': [3, 4, 5, 9, 10, 11]}],
+            'thread_siblings': [[0, 6], [1, 7], [2, 8],
+                                [3, 9], [4, 10], [5, 11]],
+        })
+        self.host_facts.return_value = self.host
+
+    def test_cpu_partitioning_enabled(self):
+        self.assertTrue(cpu.cpu_partitioning_enabled('auto'))
+        self.assertTrue(cpu.cpu_partitioning_enabled(' Auto '))
+        self.assertFalse(cpu.cpu_partitioning_enabled('0-3'))
+        self.assertFalse(cpu.cpu_partitioning_enabled(None))
+
+    def test_cpu_partition(self):
+        self.assertEqual(cpu.cpu_partition(1), {
+            'shared': [0, 3, 6, 9],
+            'dedicated': [1, 2, 4, 5, 7, 8, 10, 11],
+            'nodes': {0: {'shared': [0, 6], 'dedicated': [1, 2, 7, 8]},
+                      1: {'shared': [3, 9], 'dedicated': [4, 5, 10, 11]}}})
+        self.assertEqual(cpu.cpu_sets('auto', 2), {
+            'cpu_shared_set': '0-1,3-4,6-7,9-10',
+            'cpu_dedicated_set': '2,5,8,11'})
+        self.assertEqual(cpu.cpu_sets('0-3', 2), None)
+
+    def test_cpu_partition_without_smt(self):
+        host = facts.HostFacts(facts={
+            'numa_nodes': [{'node': 0, 'cpus': [0, 1, 2, 3]}],
+            'thread_siblings': [[0], [1], [2], [3]],
+        })
+        self.assertEqual(cpu.cpu_sets('auto', 1, host), {
+            'cpu_shared_set': '0', 'cpu_dedicated_set': '1-3'})
+
+    def test_cpu_partition_invalid(self):
+        self.assertRaises(ValueError, cpu.cpu_partition, 0)
+        self.assertRaises(ValueError, cpu.cpu_partition, 3)
+
+    def test_partitioned_cpus(self):
+        self.assertEqual(cpu.parse_cpu_spec('0-3,^2,8'), [0, 1, 3, 8])
+        self.assertRaises(ValueError, cpu.parse_cpu_spec, '0-3,x')
+        self.assertEqual(cpu.partitioned_cpus('auto', None, 1), {
+            'shared': [0, 3, 6, 9],
+            'dedicated': [1, 2, 4, 5, 7, 8, 10, 11]})
+        self.assertEqual(cpu.partitioned_cpus('2-5,8-11', None, 1), {
+            'shared': [0, 1, 6, 7], 'dedicated': [2, 3, 4, 5, 8, 9, 10, 11]})
+        self.assertEqual(cpu.partitioned_cpus('4-11', '0-1', 1), {
+            'shared': [0, 1], 'dedicated': list(range(4, 12))})
+        self.assertEqual(cpu.partitioned_cpus(None, '0-1', 1), None)
+        self.assertRaises(ValueError, cpu.partitioned_cpus, '0-11', None, 1)
+        self.assertRaises(ValueError, cpu.partitioned_cpus, '2-11', '0-2', 1)
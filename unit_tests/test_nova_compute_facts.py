@@ -0,0 +1,122 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+
+from mock import patch
+
+from test_utils import ScratchDirTestCase, TestKV
+
+import nova_compute_facts as facts
+
+TO_PATCH = [
+    'ch_host',
+    'kv',
+]
+
+
+class NovaComputeFactsTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(NovaComputeFactsTests, self).setUp(facts, TO_PATCH)
+        self.test_kv = TestKV()
+        self.kv.return_value = self.test_kv
+        self.ch_host.lsb_release.return_value = {
+            'DISTRIB_CODENAME': 'bionic'}
+        self.ch_host.is_container.return_value = False
+        for name in ('BOOT_ID', 'MEMINFO', 'SYSFS_CPU', 'SYSFS_NODE',
+                     'SYSFS_HUGEPAGES'):
+            patcher = patch.object(facts, name, self.path(name.lower()))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(facts, '_host_facts', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.write('boot_id', 'boot-1')
+        self.write('meminfo', 'MemTotal:       16384000 kB\n'
+                              'MemFree:         8192000 kB\n')
+        # two nodes, two cores per node with two threads each
+        self.write('sysfs_cpu/online', '0-7')
+        for cpu in range(8):
+            self.write('sysfs_cpu/cpu{}/topology/thread_siblings_list'
+                       .format(cpu), '{},{}'.format(cpu % 4, cpu % 4 + 4))
+        for node, cpus in ((0, '0-1,4-5'), (1, '2-3,6-7')):
+            self.write('sysfs_node/node{}/cpulist'.format(node), cpus)
+            self.write('sysfs_node/node{}/meminfo'.format(node),
+                       'Node {} MemTotal:        8192000 kB\n'.format(node))
+            self.write('sysfs_node/node{}/hugepages/hugepages-2048kB/'
+                       'nr_hugepages'.format(node), '512')
+            self.write('sysfs_node/node{}/hugepages/hugepages-2048kB/'
+                       'free_hugepages'.format(node), '100')
+        for size in (2048, 1048576):
+            self.write('sysfs_hugepages/hugepages-{}kB/nr_hugepages'
+                       .format(size), '1024' if size == 2048 else '0')
+            self.write('sysfs_hugepages/hugepages-{}kB/free_hugepages'
+                       .format(size), '200' if size == 2048 else '0')
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(facts.parse_cpu_list('0-3,8,10-11\n'),
+                         [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(facts.parse_cpu_list(''), [])
+        self.assertEqual(facts.format_cpu_list([11, 0, 1, 2, 3, 8, 10]),
+                         '0-3,8,10-11')
+        self.assertEqual(facts.format_cpu_list([]), '')
+
+    def test_topology(self):
+        host = facts.host_facts()
+        self.assertEqual(host.memory_total, 16384000 * 1024)
+        self.assertEqual(host.numa_nodes, [
+            {'node': 0, 'cpus': [0, 1, 4, 5], 'memory': 8192000 * 1024},
+            {'node': 1, 'cpus': [2, 3, 6, 7], 'memory': 8192000 * 1024}])
+        self.assertEqual(host.thread_siblings,
+                         [[0, 4], [1, 5], [2, 6], [3, 7]])
+        self.assertEqual(host.hugepage_sizes, [2048, 1048576])
+        self.assertEqual(host.hugepages(), {
+            2048: {'total': 1024, 'free': 200},
+            1048576: {'total': 0, 'free': 0}})
+        self.assertEqual(host.hugepages(node=1), {
+            2048: {'total': 512, 'free': 100}})
+
+    def test_topology_without_numa(self):
+        shutil.rmtree(self.path('sysfs_node'))
+        self.assertEqual(facts.host_facts().numa_nodes, [
+            {'node': 0, 'cpus': list(range(8)),
+             'memory': 16384000 * 1024}])
+
+    def test_facts_kept_until_reboot(self):
+        self.assertEqual(facts.lsb_release(), {'DISTRIB_CODENAME': 'bionic'})
+        self.assertEqual(facts.host_facts().distrib_codename, 'bionic')
+        self.assertFalse(facts.is_container())
+        self.assertEqual(self.ch_host.lsb_release.call_count, 1)
+
+        # a later hook in the same boot
+        facts._host_facts = None
+        self.ch_host.lsb_release.return_value = {'DISTRIB_CODENAME': 'focal'}
+        self.assertEqual(facts.lsb_release(), {'DISTRIB_CODENAME': 'bionic'})
+        self.assertFalse(facts.is_container())
+        self.assertEqual(self.ch_host.lsb_release.call_count, 1)
+        self.assertEqual(self.ch_host.is_container.call_count, 1)
+
+        # after a reboot
+        facts._host_facts = None
+        self.write('boot_id', 'boot-2')
+        self.assertEqual(facts.lsb_release(), {'DISTRIB_CODENAME': 'focal'})
+        self.assertEqual(self.ch_host.lsb_release.call_count, 2)
+
+    def test_given_facts_not_saved(self):
+        host = facts.HostFacts(facts={'is_container': True})
+        self.assertTrue(host.is_container)
+        host.lsb_release
+        self.assertEqual(self.test_kv.get(facts.HOST_FACTS_KEY), None)
+        self.assertFalse(self.ch_host.is_container.called)
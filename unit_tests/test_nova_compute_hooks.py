@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import importlib
+import subprocess
 
 from mock import (
     ANY,
@@ -23,7 +24,7 @@ from mock import (
 
 from nova_compute_hooks import update_nrpe_config
 
-from test_utils import CharmTestCase
+from test_utils import CharmTestCase, TestKV
 
 with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
     mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
@@ -37,6 +38,7 @@ with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
 TO_PATCH = [
     # charmhelpers.core.hookenv
     'Hooks',
+    'atexit',
     'config',
     'local_unit',
     'log',
@@ -55,6 +57,7 @@ TO_PATCH = [
     'restart_on_change',
     'service_restart',
     'is_container',
+    'reset_host_facts',
     'service_running',
     'service_start',
     # charmhelpers.contrib.openstack.utils
@@ -91,9 +94,12 @@ TO_PATCH = [
     'gethostname',
     'create_sysctl',
     'install_hugepages',
+    'configure_cpu_isolation',
+    'isolated_cpus',
     'uuid',
     # unitdata
     'unitdata',
+    'kv',
     # templating
     'render',
     'remove_old_packages',
@@ -112,6 +118,13 @@ class NovaComputeRelationsTests(CharmTestCase):
         self.gethostname.return_value = 'testserver'
         self.get_relation_ip.return_value = '10.0.0.50'
         self.is_container.return_value = False
+        self.test_kv = TestKV()
+        self.kv.return_value = self.test_kv
+        patcher = patch('nova_compute_utils.kv', return_value=self.test_kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.configure_cpu_isolation.return_value = {}
+        self.isolated_cpus.return_value = None
 
     @patch.object(hooks, 'kv')
     @patch.object(hooks, 'os_release')
@@ -152,6 +165,64 @@ class NovaComputeRelationsTests(CharmTestCase):
         self.configure_local_ephemeral_storage.assert_called_once_with()
         self.service_start.assert_not_called()
 
+    @patch.object(hooks, 'neutron_plugin_joined')
+    def test_config_changed_after_upgrade_action(self, neutron_plugin_joined):
+        self.test_config.set('action-managed-upgrade', True)
+        self.migration_enabled.return_value = False
+        self.relation_ids.side_effect = lambda x: {
+            'neutron-plugin': ['rid1']}.get(x, [])
+        # what do_openstack_upgrade() records from the action
+        hooks.request_config_reconcile(upgraded=True)
+        changes = hooks.config_changed()
+        neutron_plugin_joined.assert_called_with('rid1', remote_restart=True)
+        # the action saves what config_changed() applied
+        self.assertEqual(self.atexit.call_args[0][0], changes.save)
+        changes.save()
+        hooks.config_changed()
+        neutron_plugin_joined.assert_called_with('rid1', remote_restart=False)
+
+    @patch.object(hooks, 'NovaComputeAppArmorContext')
+    @patch.object(hooks, 'ceph_changed')
+    def test_config_changed_only_affected_steps(self, ceph_changed,
+                                                aa_context):
+        self.openstack_upgrade_available.return_value = False
+        self.service_running.return_value = True
+        self.migration_enabled.return_value = False
+        self.test_config.set('hugepages', '10')
+        self.relation_ids.side_effect = lambda x: {
+            'ceph': ['ceph:0']}.get(x, [])
+        self.related_units.return_value = ['ceph/0']
+        hooks.config_changed()
+        self.assertEqual(self.install_hugepages.call_count, 1)
+        self.assertEqual(ceph_changed.call_count, 1)
+        self.assertEqual(self.remove_libvirt_network.call_count, 1)
+        # the hook completed, so record what it applied
+        self.atexit.call_args[0][0]()
+
+        self.test_config.set('debug', True)
+        hooks.config_changed()
+        self.assertEqual(self.install_hugepages.call_count, 1)
+        self.assertEqual(ceph_changed.call_count, 1)
+        # unkeyed steps run every time
+        self.assertEqual(self.remove_libvirt_network.call_count, 2)
+        self.assertEqual(
+            aa_context.return_value.setup_aa_profile.call_count, 2)
+        self.assertEqual(self.configure_local_ephemeral_storage.call_count, 1)
+
+        self.test_config.set('hugepages', '20')
+        self.relation_ids.side_effect = lambda x: {
+            'ceph': ['ceph:0', 'ceph:1']}.get(x, [])
+        hooks.config_changed()
+        self.assertEqual(self.install_hugepages.call_count, 2)
+        self.assertEqual(ceph_changed.call_count, 3)
+        self.assertEqual(self.remove_libvirt_network.call_count, 3)
+
+        # upgrade-charm forces every step to run again
+        hooks.request_config_reconcile()
+        hooks.config_changed()
+        self.assertEqual(self.remove_libvirt_network.call_count, 4)
+        self.assertEqual(self.configure_local_ephemeral_storage.call_count, 2)
+
     def test_config_changed_with_openstack_upgrade_action(self):
         self.openstack_upgrade_available.return_value = True
         self.test_config.set('action-managed-upgrade', True)
@@ -292,6 +363,61 @@ class NovaComputeRelationsTests(CharmTestCase):
                 'Invalid migration-auth-type')
         self.service_start.assert_not_called()
 
+    @patch.object(hooks, 'status_set')
+    @patch.object(hooks, 'compute_joined')
+    def test_config_changed_invalid_cpu_isolation(self, compute_joined,
+                                                  status_set):
+        self.isolated_cpus.side_effect = ValueError(
+            'isolate-dedicated-cpus needs cpu-dedicated-set')
+        with self.assertRaises(Exception):
+            hooks.config_changed()
+        status_set.assert_called_with(
+            'blocked', 'Invalid CPU isolation: isolate-dedicated-cpus needs '
+            'cpu-dedicated-set')
+
+    @patch.object(hooks, 'cpu_isolation_services')
+    @patch.object(hooks, 'service_restart')
+    def test_isolate_cpus(self, service_restart, cpu_isolation_services):
+        cpu_isolation_services.return_value = ['libvirtd', 'nova-compute']
+        hooks.isolate_cpus(None)
+        self.assertFalse(service_restart.called)
+        self.configure_cpu_isolation.return_value = {
+            'irqs': ['24'], 'systemd': ['/etc/systemd/system.conf.d/x.conf']}
+        hooks.isolate_cpus(None)
+        service_restart.assert_has_calls([call('libvirtd'),
+                                          call('nova-compute')])
+
+    @patch.object(hooks, 'is_unit_paused_set')
+    @patch.object(hooks, 'cpu_isolation_services')
+    @patch.object(hooks, 'service_restart')
+    @patch.object(hooks, 'compact_unit_state')
+    def test_update_status_corrects_cpu_isolation(self, compact_unit_state,
+                                                  service_restart,
+                                                  cpu_isolation_services,
+                                                  is_unit_paused_set):
+        is_unit_paused_set.return_value = False
+        cpu_isolation_services.return_value = ['libvirtd', 'nova-compute']
+        self.configure_cpu_isolation.return_value = {'irqs': ['24']}
+        hooks.update_status()
+        self.log.assert_called_with(
+            "Corrected the CPU isolation, which had drifted: "
+            "{'irqs': ['24']}", 'WARNING')
+        self.assertFalse(service_restart.called)
+
+        # drop-ins only apply once the services restart
+        self.configure_cpu_isolation.return_value = {
+            'systemd': ['/etc/systemd/system/libvirtd.service.d/x.conf']}
+        hooks.update_status()
+        service_restart.assert_has_calls([call('libvirtd'),
+                                          call('nova-compute')])
+
+        self.configure_cpu_isolation.side_effect = (
+            subprocess.CalledProcessError(1, 'systemctl'))
+        hooks.update_status()
+        self.log.assert_called_with(
+            "Could not correct the CPU isolation: Command 'systemctl' "
+            "returned non-zero exit status 1.", 'WARNING')
+
     @patch.object(hooks, 'compute_joined')
     def test_config_changed_use_multipath_false(self,
                                                 compute_joined):
@@ -379,7 +505,22 @@ class NovaComputeRelationsTests(CharmTestCase):
     def test_compute_joined_no_migration_no_resize(self):
         self.migration_enabled.return_value = False
         hooks.compute_joined()
-        self.assertFalse(self.relation_set.called)
+        self.relation_set.assert_called_once_with(
+            relation_id=None, cpu_shared_set=None, cpu_dedicated_set=None)
+
+    @patch.object(hooks, 'cpu_sets')
+    def test_compute_joined_auto_cpu_sets(self, cpu_sets):
+        self.migration_enabled.return_value = False
+        cpu_sets.return_value = {'cpu_shared_set': '0,4',
+                                 'cpu_dedicated_set': '1-3,5-7'}
+        hooks.compute_joined(rid='cloud-compute:2')
+        self.relation_set.assert_called_once_with(**{
+            'relation_id': 'cloud-compute:2',
+            'cpu_shared_set': '0,4',
+            'cpu_dedicated_set': '1-3,5-7',
+            'hostname': 'testserver',
+            'private-address': '10.0.0.50',
+        })
 
     def test_compute_joined_with_ssh_migration(self):
         self.migration_enabled.return_value = True
@@ -392,6 +533,8 @@ class NovaComputeRelationsTests(CharmTestCase):
             'migration_auth_type': 'ssh',
             'hostname': 'testserver',
             'private-address': '10.0.0.50',
+            'cpu_shared_set': None,
+            'cpu_dedicated_set': None,
         })
         hooks.compute_joined(rid='cloud-compute:2')
         self.relation_set.assert_called_with(**{
@@ -400,11 +543,30 @@ class NovaComputeRelationsTests(CharmTestCase):
             'migration_auth_type': 'ssh',
             'hostname': 'testserver',
             'private-address': '10.0.0.50',
+            'cpu_shared_set': None,
+            'cpu_dedicated_set': None,
         })
         self.get_relation_ip.assert_called_with(
             'migration', cidr_network=None
         )
 
+    def test_compute_joined_with_migration_and_resize(self):
+        self.migration_enabled.return_value = True
+        self.test_config.set('migration-auth-type', 'ssh')
+        self.test_config.set('enable-resize', True)
+        self.public_ssh_key.return_value = 'foo'
+        hooks.compute_joined(rid='cloud-compute:2')
+        self.relation_set.assert_called_once_with(**{
+            'relation_id': 'cloud-compute:2',
+            'ssh_public_key': 'foo',
+            'nova_ssh_public_key': 'foo',
+            'migration_auth_type': 'ssh',
+            'hostname': 'testserver',
+            'private-address': '10.0.0.50',
+            'cpu_shared_set': None,
+            'cpu_dedicated_set': None,
+        })
+
     def test_compute_joined_with_resize(self):
         self.migration_enabled.return_value = False
         self.test_config.set('enable-resize', True)
@@ -415,6 +577,8 @@ class NovaComputeRelationsTests(CharmTestCase):
             'nova_ssh_public_key': 'bar',
             'hostname': 'testserver',
             'private-address': '10.0.0.50',
+            'cpu_shared_set': None,
+            'cpu_dedicated_set': None,
         })
         hooks.compute_joined(rid='cloud-compute:2')
         self.relation_set.assert_called_with(**{
@@ -422,6 +586,8 @@ class NovaComputeRelationsTests(CharmTestCase):
             'nova_ssh_public_key': 'bar',
             'hostname': 'testserver',
             'private-address': '10.0.0.50',
+            'cpu_shared_set': None,
+            'cpu_dedicated_set': None,
         })
         self.get_relation_ip.assert_called_with(
             'migration', cidr_network=None
@@ -971,6 +1137,7 @@ class NovaComputeRelationsTests(CharmTestCase):
         getgrnam.return_value = grp_mock
         self.remove_old_packages.return_value = False
         hooks.upgrade_charm()
+        self.reset_host_facts.assert_called_once_with()
         self.remove_old_packages.assert_called_once_with()
         self.assertFalse(self.service_restart.called)
 
@@ -984,3 +1151,17 @@ class NovaComputeRelationsTests(CharmTestCase):
         hooks.upgrade_charm()
         self.remove_old_packages.assert_called_once_with()
         self.service_restart.assert_called_once_with('nova-compute')
+
+    @patch.object(hooks, 'series_upgrade_complete')
+    @patch.object(hooks, 'service_stop')
+    @patch.object(hooks.os.path, 'exists')
+    def test_post_series_upgrade(self, exists, service_stop,
+                                 series_upgrade_complete):
+        exists.return_value = False
+        self.libvirt_daemon.return_value = 'libvirtd'
+        hooks.post_series_upgrade()
+        self.reset_host_facts.assert_called_once_with()
+        service_stop.assert_has_calls([call('nova-compute'),
+                                       call('libvirtd')])
+        series_upgrade_complete.assert_called_once_with(
+            hooks.resume_unit_helper, hooks.CONFIGS)
@@ -0,0 +1,160 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import call, patch
+
+from test_utils import CharmTestCase
+
+import nova_compute_facts as facts
+import nova_compute_hugepages as hugepages
+
+TO_PATCH = [
+    'host_facts',
+    'init_is_systemd',
+    'log',
+    'subprocess',
+    'sysctl',
+    'write_file',
+]
+
+NODE_MEMORY = 16 * 1024 ** 3
+
+
+class NovaComputeHugepagesTests(CharmTestCase):
+
+    def setUp(self):
+        super(NovaComputeHugepagesTests, self).setUp(hugepages, TO_PATCH)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for module in (facts, hugepages):
+            patcher = patch.object(module, 'SYSFS_NODE', self.root)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.host = facts.HostFacts(facts={
+            'numa_nodes': [
+                {'node': 0, 'cpus': [0, 1], 'memory': NODE_MEMORY},
+                {'node': 1, 'cpus': [2, 3], 'memory': NODE_MEMORY}],
+            'hugepage_sizes': [2048, 1048576],
+        })
+        self.host_facts.return_value = self.host
+        self.init_is_systemd.return_value = True
+
+    def pool(self, node, size_kb, total):
+        path = os.path.join(self.root, 'node{}'.format(node), 'hugepages',
+                            'hugepages-{}kB'.format(size_kb))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in ('nr_hugepages', 'free_hugepages'):
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(str(total))
+
+    def test_page_sizes(self):
+        for size, size_kb in (('2M', 2048), ('1G', 1048576), ('1GB', 1048576),
+                              ('2048kB', 2048), ('64K', 64), (' 2MiB', 2048)):
+            self.assertEqual(hugepages.page_size_kb(size), size_kb, size)
+        self.assertRaises(ValueError, hugepages.page_size_kb, '2T')
+        self.assertEqual(hugepages.page_size_label(1048576), '1G')
+        self.assertEqual(hugepages.page_size_label(2048), '2M')
+        self.assertEqual(hugepages.page_size_label(64), '64K')
+
+    def test_parse_hugepages_spec(self):
+        self.assertTrue(hugepages.is_hugepages_spec('2M:1024'))
+        self.assertFalse(hugepages.is_hugepages_spec('10%'))
+        self.assertFalse(hugepages.is_hugepages_spec(None))
+        self.assertEqual(
+            hugepages.parse_hugepages_spec('1G:16@node0,16@node1;2M:50%;'),
+            {1048576: [(16, False, 0), (16, False, 1)],
+             2048: [(50.0, True, None)]})
+        for spec in ('1G', '1G:16@1', '1G:1.5', '2M:10;2048kB:10', '3X:1'):
+            self.assertRaises(ValueError, hugepages.parse_hugepages_spec,
+                              spec)
+
+    def test_hugepage_allocation(self):
+        self.assertEqual(
+            hugepages.hugepage_allocation('1G:3;2M:10%@node1,100@node0'),
+            {1048576: {0: 2, 1: 1},
+             2048: {0: 100, 1: 819}})
+        self.assertEqual(
+            hugepages.hugepage_allocation('2M:50%'),
+            {2048: {0: 4096, 1: 4096}})
+        # the pools of node 1 are left alone
+        self.assertEqual(hugepages.hugepage_allocation('1G:4@node0'),
+                         {1048576: {0: 4}})
+        for spec in ('16G:1', '1G:1@node2', '1G:17@node0', '1G:16;2M:60%'):
+            self.assertRaises(ValueError, hugepages.hugepage_allocation,
+                              spec)
+
+    def test_install_hugepages_spec(self):
+        # the kernel only finds memory for 7 of the 8 1G pages on node 1
+        self.pool(0, 1048576, 8)
+        self.pool(1, 1048576, 7)
+        self.pool(0, 2048, 0)
+        self.pool(1, 2048, 0)
+        self.subprocess.check_output.return_value = b'4294967296\n'
+        self.assertEqual(
+            hugepages.install_hugepages_spec('1G:8@node0,8@node1;2M:0'),
+            {1048576: {0: 8, 1: 7}, 2048: {0: 0, 1: 0}})
+        script = self.write_file.call_args_list[0][0][1].decode('UTF-8')
+        nr_hugepages = os.path.join(self.root, 'node{}', 'hugepages',
+                                    'hugepages-{}kB', 'nr_hugepages')
+        for node, size_kb, count in ((0, 1048576, 8), (1, 1048576, 8),
+                                     (0, 2048, 0), (1, 2048, 0)):
+            self.assertIn('echo {} > {}\n'.format(
+                count, nr_hugepages.format(node, size_kb)), script)
+        self.assertIn('mount -t hugetlbfs -o pagesize=1048576K nodev '
+                      '/run/hugepages/kvm-1G\n', script)
+        self.assertNotIn('kvm-2M', script)
+        self.sysctl.create.assert_called_once_with(
+            {'vm.max_map_count': 65536, 'vm.hugetlb_shm_group': 0,
+             'kernel.shmmax': 16 * 1024 ** 3}, hugepages.HUGEPAGE_SYSCTL)
+        self.subprocess.check_call.assert_has_calls([
+            call(['systemctl', 'daemon-reload']),
+            call(['systemctl', 'enable', 'nova-compute-hugepages.service']),
+            call([hugepages.HUGEPAGES_SCRIPT])])
+        self.log.assert_any_call(
+            'Only 7 of 8 1G pages allocated on NUMA node 1',
+            level=hugepages.WARNING)
+
+    def test_install_hugepages_spec_unnamed_node(self):
+        self.pool(0, 2048, 0)
+        self.pool(1, 1048576, 4)
+        self.subprocess.check_output.return_value = b'18446744073692774399'
+        hugepages.install_hugepages_spec('2M:4096@node0')
+        script = self.write_file.call_args_list[0][0][1].decode('UTF-8')
+        self.assertIn('echo 4096 > {}\n'.format(os.path.join(
+            self.root, 'node0', 'hugepages', 'hugepages-2048kB',
+            'nr_hugepages')), script)
+        # the 1G pages of node 1 are kept
+        self.assertNotIn('node1', script)
+        self.sysctl.create.assert_called_once_with(
+            {'vm.max_map_count': 65536, 'vm.hugetlb_shm_group': 0},
+            hugepages.HUGEPAGE_SYSCTL)
+
+    def test_mounts_and_reserved(self):
+        allocation = hugepages.hugepage_allocation('2M:512;1G:0')
+        self.assertEqual(list(hugepages.hugepage_mounts(allocation).values()),
+                         ['/run/hugepages/kvm-2M'])
+        self.pool(0, 2048, 256)
+        self.pool(0, 1048576, 2)
+        self.pool(1, 16, 4)
+        self.assertEqual(hugepages.reserved_hugepages(allocation),
+                         ['node:1,size:16,count:4'])
+        del allocation[1048576]
+        self.assertEqual(hugepages.reserved_hugepages(allocation),
+                         ['node:0,size:1048576,count:2',
+                          'node:1,size:16,count:4'])
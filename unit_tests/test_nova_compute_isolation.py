@@ -0,0 +1,164 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+
+from mock import call, patch
+
+from test_utils import ScratchDirTestCase, TestKV
+
+import nova_compute_facts as facts
+import nova_compute_isolation as isolation
+
+TO_PATCH = [
+    'host_facts',
+    'kv',
+    'log',
+    'subprocess',
+    'write_file',
+]
+
+CPUS = {'shared': [0, 4], 'dedicated': [1, 2, 3, 5, 6, 7]}
+
+
+class NovaComputeIsolationTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(NovaComputeIsolationTests, self).setUp(isolation, TO_PATCH)
+        for name in ('PROC_CMDLINE', 'PROC_IRQ', 'GRUB_DROPIN',
+                     'SYSTEMD_CONF_DROPIN', 'SYSTEMD_UNIT_DROPIN'):
+            patcher = patch.object(isolation, name, self.path(
+                getattr(isolation, name).lstrip('/')))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.subprocess.CalledProcessError = subprocess.CalledProcessError
+        self.test_kv = TestKV()
+        self.kv.return_value = self.test_kv
+        self.write_file.side_effect = lambda path, content, perms: self.write(
+            path, content.decode('UTF-8'))
+        self.host_facts.return_value = facts.HostFacts(facts={
+            'is_container': False,
+            'numa_nodes': [{'node': 0, 'cpus': list(range(8))}],
+        })
+        self.write(isolation.PROC_CMDLINE, 'BOOT_IMAGE=/vmlinuz ro')
+        self.write(os.path.join(isolation.PROC_IRQ, 'default_smp_affinity'),
+                   'ff')
+        for irq, cpus in (('0', '0-7'), ('24', '4'), ('25', '6')):
+            self.write(os.path.join(isolation.PROC_IRQ, irq,
+                                    'smp_affinity_list'), cpus)
+
+    def test_reboot_required(self):
+        self.assertTrue(isolation.reboot_required([1, 2, 3]))
+        self.write(isolation.PROC_CMDLINE,
+                   'ro isolcpus=domain,managed_irq,1-3 nohz_full=1-3 '
+                   'rcu_nocbs=1,2,3')
+        self.assertEqual(isolation.booted_isolation()['isolcpus'],
+                         [1, 2, 3])
+        self.assertFalse(isolation.reboot_required([1, 2, 3]))
+        self.assertTrue(isolation.reboot_required([1, 2]))
+
+    def test_reconcile_cpu_isolation(self):
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(CPUS, ['libvirtd']),
+            {'grub': True,
+             'irqs': ['default', '0', '25'],
+             'systemd': [isolation.SYSTEMD_CONF_DROPIN,
+                         isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd')]})
+        self.assertIn('GRUB_CMDLINE_LINUX_DEFAULT='
+                      '"$GRUB_CMDLINE_LINUX_DEFAULT '
+                      'isolcpus=1-3,5-7 nohz_full=1-3,5-7 rcu_nocbs=1-3,5-7"',
+                      self.read(isolation.GRUB_DROPIN))
+        self.assertIn('[Service]\nCPUAffinity=0,4', self.read(
+            isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd')))
+        self.assertEqual(self.read(os.path.join(
+            isolation.PROC_IRQ, 'default_smp_affinity')), '00000011')
+        self.assertEqual(self.read(os.path.join(
+            isolation.PROC_IRQ, '25', 'smp_affinity_list')), '0,4')
+        self.subprocess.check_call.assert_has_calls([
+            call(['update-grub']), call(['systemctl', 'daemon-reexec'])])
+
+        # nothing drifted
+        self.subprocess.reset_mock()
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(CPUS, ['libvirtd']), {})
+        self.assertFalse(self.subprocess.check_call.called)
+
+        # a new IRQ and an edited drop-in
+        self.write(os.path.join(isolation.PROC_IRQ, '26',
+                                'smp_affinity_list'), '0-7')
+        self.write(isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd'), '')
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(CPUS, ['libvirtd']),
+            {'irqs': ['26'],
+             'systemd': [isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd')]})
+        self.subprocess.check_call.assert_called_once_with(
+            ['systemctl', 'daemon-reload'])
+
+    def test_undo_cpu_isolation(self):
+        # nothing to undo
+        self.assertEqual(isolation.reconcile_cpu_isolation(None, []), {})
+        isolation.reconcile_cpu_isolation(CPUS, ['libvirtd'])
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(None, ['libvirtd']),
+            {'grub': True,
+             'irqs': ['default', '0', '24', '25'],
+             'systemd': [isolation.SYSTEMD_CONF_DROPIN,
+                         isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd')]})
+        self.assertFalse(os.path.exists(isolation.GRUB_DROPIN))
+        self.assertEqual(self.read(os.path.join(
+            isolation.PROC_IRQ, '24', 'smp_affinity_list')), '0-7')
+        self.assertIsNone(self.test_kv.get(isolation.IRQS_ISOLATED_KEY))
+        # restored once only
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(None, ['libvirtd']), {})
+
+    def test_never_isolated(self):
+        # tuned by the operator, with fewer online than possible CPUs
+        self.host_facts.return_value = facts.HostFacts(facts={
+            'is_container': False,
+            'numa_nodes': [{'node': 0, 'cpus': list(range(4))}],
+        })
+        self.write(os.path.join(isolation.PROC_IRQ, '30',
+                                'smp_affinity_list'), '2')
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(None, ['libvirtd']), {})
+        self.assertEqual(self.read(os.path.join(
+            isolation.PROC_IRQ, 'default_smp_affinity')), 'ff')
+        self.assertEqual(self.read(os.path.join(
+            isolation.PROC_IRQ, '30', 'smp_affinity_list')), '2')
+
+    def test_undo_after_failed_run(self):
+        isolation.reconcile_cpu_isolation(CPUS, ['libvirtd'])
+        # an earlier run removed the drop-ins, then failed
+        for path in (isolation.GRUB_DROPIN, isolation.SYSTEMD_CONF_DROPIN,
+                     isolation.SYSTEMD_UNIT_DROPIN.format('libvirtd')):
+            os.unlink(path)
+        self.assertEqual(
+            isolation.reconcile_cpu_isolation(None, ['libvirtd']),
+            {'irqs': ['default', '0', '24', '25']})
+
+    def test_update_grub_fails(self):
+        self.subprocess.check_call.side_effect = (
+            subprocess.CalledProcessError(1, 'update-grub'))
+        self.assertRaises(subprocess.CalledProcessError,
+                          isolation.reconcile_cpu_isolation, CPUS, [])
+        # the next run tries again
+        self.assertFalse(os.path.exists(isolation.GRUB_DROPIN))
+
+    def test_reconcile_in_container(self):
+        self.host_facts.return_value = facts.HostFacts(
+            facts={'is_container': True})
+        self.assertEqual(isolation.reconcile_cpu_isolation(CPUS, []), {})
+        self.assertFalse(os.path.exists(isolation.GRUB_DROPIN))
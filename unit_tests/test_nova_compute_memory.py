@@ -0,0 +1,130 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+
+from mock import MagicMock, patch
+
+from test_utils import ScratchDirTestCase, TestKV
+
+import nova_compute_memory as memory
+
+TO_PATCH = [
+    'host_facts',
+    'kv',
+    'subprocess',
+]
+
+
+class NovaComputeMemoryTests(ScratchDirTestCase):
+
+    def setUp(self):
+        super(NovaComputeMemoryTests, self).setUp(memory, TO_PATCH)
+        for name in ('PROC', 'CEPH_OSD_DIR'):
+            patcher = patch.object(memory, name, self.path(name.lower()))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # 64G with 16G of 1G pages and 1G of 2M pages
+        self.host = MagicMock()
+        self.host.memory_total = 64 * 1024 ** 3
+        self.host.hugepages.return_value = {
+            2048: {'total': 512, 'free': 0},
+            1048576: {'total': 16, 'free': 16}}
+        self.host_facts.return_value = self.host
+        self.test_kv = TestKV()
+        self.kv.return_value = self.test_kv
+        self.subprocess.CalledProcessError = subprocess.CalledProcessError
+        self.subprocess.TimeoutExpired = subprocess.TimeoutExpired
+        self.subprocess.check_output.side_effect = OSError
+        for pid, name in (('1', 'systemd'), ('100', 'qemu-system-x86'),
+                          ('101', 'qemu-system-x86'), ('102', 'kvm')):
+            self.write(os.path.join('proc', pid, 'comm'), name)
+
+    def test_reserved_host_memory(self):
+        reservation = memory.reserved_host_memory()
+        self.assertEqual(reservation['parts'], {
+            'host': 1024 + int((65536 - 17408) * 0.02),
+            'ceph-osd': 0,
+            'ovs-dpdk': 0,
+            'guests': 10 * 128})
+        self.assertEqual(reservation['total'], 1024 + 962 + 1280)
+        self.assertEqual(reservation['sized-from'], {
+            'memory-mb': 65536, 'hugepages-mb': 17408, 'ceph-osds': [],
+            'osd-memory-mb': {},
+            'running-guests': 3, 'most-guests': 3, 'guests': 10})
+        self.assertEqual(memory.format_reservation(reservation),
+                         '3266 MB reserved for the host: host 1986 MB, '
+                         'ceph-osd 0 MB, ovs-dpdk 0 MB, guests 1280 MB')
+
+    def test_reserved_host_memory_hyperconverged(self):
+        for osd in ('ceph-0', 'ceph-3'):
+            os.makedirs(self.path(os.path.join('ceph_osd_dir', osd)))
+
+        def check_output(cmd, **kwargs):
+            if cmd[0] == 'ovs-vsctl':
+                return b'"1024,2048"\n'
+            if cmd[2] == 'osd.3':
+                # no admin socket
+                raise subprocess.CalledProcessError(22, cmd)
+            return b'{"osd_memory_target": "6442450944"}\n'
+        self.subprocess.check_output.side_effect = check_output
+        for pid in range(200, 210):
+            self.write(os.path.join('proc', str(pid), 'comm'),
+                       'qemu-system-x86')
+        reservation = memory.reserved_host_memory()
+        self.assertEqual(reservation['parts']['ceph-osd'], 6144 + 4096)
+        self.assertEqual(reservation['sized-from']['osd-memory-mb'],
+                         {'ceph-0': 6144, 'ceph-3': 4096})
+        self.assertEqual(reservation['parts']['ovs-dpdk'], 3072)
+        self.assertIn('--timeout=10',
+                      self.subprocess.check_output.call_args[0][0])
+        self.assertEqual(reservation['parts']['guests'], 20 * 128)
+        self.assertEqual(reservation['sized-from']['ceph-osds'],
+                         ['ceph-0', 'ceph-3'])
+
+    def test_guests_never_go_down(self):
+        for pid in range(200, 210):
+            self.write(os.path.join('proc', str(pid), 'comm'),
+                       'qemu-system-x86')
+        self.assertEqual(
+            memory.reserved_host_memory()['parts']['guests'], 20 * 128)
+        for pid in range(200, 210):
+            shutil.rmtree(self.path(os.path.join('proc', str(pid))))
+        reservation = memory.reserved_host_memory()
+        self.assertEqual(reservation['parts']['guests'], 20 * 128)
+        self.assertEqual(reservation['sized-from']['running-guests'], 3)
+        self.assertEqual(reservation['sized-from']['most-guests'], 13)
+
+    def test_guests_high_water_reset(self):
+        # a report does not record the guests
+        reservation = memory.reserved_host_memory(record=False)
+        self.assertEqual(reservation['sized-from']['most-guests'], 3)
+        self.assertIsNone(self.test_kv.get(memory.GUESTS_HIGH_WATER_KEY))
+        self.test_kv.set(memory.GUESTS_HIGH_WATER_KEY, 25)
+        self.assertEqual(
+            memory.reserved_host_memory()['parts']['guests'], 30 * 128)
+        memory.reset_guests_high_water()
+        self.assertIsNone(self.test_kv.get(memory.GUESTS_HIGH_WATER_KEY))
+        self.assertTrue(self.test_kv.flushed)
+        self.assertEqual(
+            memory.reserved_host_memory()['parts']['guests'], 10 * 128)
+        self.assertEqual(self.test_kv.get(memory.GUESTS_HIGH_WATER_KEY), 3)
+
+    def test_hook_reserved_host_memory(self):
+        with patch.object(memory, '_reservation', None):
+            self.assertIs(memory.hook_reserved_host_memory(),
+                          memory.hook_reserved_host_memory())
+        self.assertEqual(self.subprocess.check_output.call_count, 1)
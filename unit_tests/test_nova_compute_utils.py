@@ -12,18 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
 import tempfile
 
 import nova_compute_context as compute_context
 import nova_compute_utils as utils
 
+from nova_compute_facts import HostFacts
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+
 from mock import (
     patch,
     MagicMock,
     call
 )
 from test_utils import (
-    CharmTestCase,
+    ScratchDirTestCase,
     patch_open,
     TestKV,
 )
@@ -73,7 +80,7 @@ TO_PATCH = [
 ]
 
 
-class NovaComputeUtilsTests(CharmTestCase):
+class NovaComputeUtilsTests(ScratchDirTestCase):
 
     def setUp(self):
         super(NovaComputeUtilsTests, self).setUp(utils, TO_PATCH)
@@ -82,6 +89,8 @@ class NovaComputeUtilsTests(CharmTestCase):
         self.lsb_release.return_value = {'DISTRIB_CODENAME': 'precise'}
         self.test_kv = TestKV()
         self.kv.return_value = self.test_kv
+        utils.reset_resource_map()
+        self.addCleanup(utils.reset_resource_map)
 
     @patch.object(utils, 'nova_metadata_requirement')
     @patch.object(utils, 'network_manager')
@@ -526,6 +535,51 @@ class NovaComputeUtilsTests(CharmTestCase):
         result = utils.resource_map()['/etc/nova/nova.conf']['services']
         self.assertTrue('nova-api-metadata' in result)
 
+    @patch.object(utils, '_build_resource_map')
+    def test_resource_map_cached(self, _build):
+        _build.return_value = {'/etc/nova/nova.conf': {}}
+        builds = utils.resource_map_builds()
+        self.assertEqual(utils.resource_map(), _build.return_value)
+        self.assertEqual(utils.resource_map(), _build.return_value)
+        _build.assert_called_once_with()
+        self.assertEqual(utils.resource_map_builds(), builds + 1)
+
+    @patch.object(utils, '_build_resource_map')
+    def test_resource_map_reset_on_relation_set(self, _build):
+        utils.resource_map()
+        with patch('subprocess.check_output') as check_output, \
+                patch('subprocess.check_call'), \
+                patch('charmhelpers.core.hookenv.local_unit'), \
+                patch.object(hookenv, '_relation_set_accepts_file', None), \
+                patch.object(hookenv, '_published_relation_settings', {}):
+            check_output.return_value = ''
+            hookenv.relation_set(relation_id='cloud-compute:1', foo='bar')
+        utils.resource_map()
+        self.assertEqual(_build.call_count, 2)
+
+    @patch.object(hookenv, '_relation_snapshot', None)
+    @patch.object(hookenv, 'relation_get')
+    def test_network_config_relation_snapshot(self, _relation_get):
+        self.relation_ids.return_value = ['cloud-compute:0']
+        self.related_units.return_value = ['nova-cloud-controller/0',
+                                           'nova-cloud-controller/1']
+        rdata = {
+            'nova-cloud-controller/0': {},
+            'nova-cloud-controller/1': {'network_manager': 'Neutron',
+                                        'quantum_plugin': 'ovs'},
+        }
+        _relation_get.side_effect = lambda rid, unit: rdata[unit]
+        with patch.object(utils, 'relation_get',
+                          hookenv.snapshot_relation_get):
+            self.assertEqual(utils.network_manager(), 'neutron')
+            self.assertEqual(utils.neutron_plugin(), 'ovs')
+        # one bulk relation-get per unit, however many settings are read
+        _relation_get.assert_has_calls([
+            call(rid='cloud-compute:0', unit='nova-cloud-controller/0'),
+            call(rid='cloud-compute:0', unit='nova-cloud-controller/1'),
+        ])
+        self.assertEqual(_relation_get.call_count, 2)
+
     def fake_user(self, username='foo'):
         user = MagicMock()
         user.pw_dir = '/home/' + username
@@ -661,6 +715,55 @@ class NovaComputeUtilsTests(CharmTestCase):
             ]
             fake_renderer.register.assert_has_calls(ex_reg, any_order=True)
 
+    def test_deferred_configs(self):
+        factory = MagicMock()
+        configs = utils.DeferredConfigs(factory)
+        self.assertFalse(configs.resolved)
+        factory.assert_not_called()
+        configs.write_all()
+        configs.complete_contexts()
+        factory.assert_called_once_with()
+        factory.return_value.write_all.assert_called_once_with()
+        self.assertTrue(configs.resolved)
+        configs.reset()
+        self.assertFalse(configs.resolved)
+        configs.write('/etc/nova/nova.conf')
+        self.assertEqual(factory.call_count, 2)
+
+    @patch('charmhelpers.contrib.openstack.templating.log')
+    @patch('charmhelpers.contrib.openstack.templating.charm_dir')
+    def test_renderer_precompile(self, _charm_dir, _log):
+        from charmhelpers.contrib.openstack import templating
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        _charm_dir.return_value = tmpdir
+        renderer = templating.OSConfigRenderer(
+            templates_dir=utils.TEMPLATES, openstack_release='queens')
+        expected = renderer._get_template('nova.conf').render()
+        modules = renderer.precompile()
+        self.assertEqual(
+            modules, os.path.join(tmpdir, '.jinja2', 'queens', 'modules'))
+        self.assertTrue(os.path.isfile(os.path.join(modules, 'FINGERPRINT')))
+
+        renderer = templating.OSConfigRenderer(
+            templates_dir=utils.TEMPLATES, openstack_release='queens')
+        with patch.object(templating.FileSystemLoader,
+                          'get_source') as get_source:
+            self.assertEqual(renderer._get_template('nova.conf').render(),
+                             expected)
+            get_source.assert_not_called()
+
+        # precompiled templates are ignored once any template changes
+        renderer = templating.OSConfigRenderer(
+            templates_dir=utils.TEMPLATES, openstack_release='queens')
+        with patch.object(templating, 'templates_fingerprint') as fp:
+            fp.return_value = 'changed'
+            self.assertEqual(renderer._get_template('nova.conf').render(),
+                             expected)
+        self.assertTrue(os.listdir(
+            os.path.join(tmpdir, '.jinja2', 'queens', 'bytecode')))
+
     @patch.object(utils, 'check_call')
     def test_enable_shell(self, _check_call):
         utils.enable_shell('dummy')
@@ -756,15 +859,13 @@ class NovaComputeUtilsTests(CharmTestCase):
             utils.configure_lxd('nova')
         self.assertFalse(_configure_subuid.called)
 
-    @patch('psutil.virtual_memory')
+    @patch.object(utils, 'host_facts')
     @patch('subprocess.check_call')
     @patch('subprocess.call')
-    def test_install_hugepages(self, _call, _check_call, _virt_mem):
-        class mem(object):
-            def __init__(self):
-                self.total = 10000000 * 1024
+    def test_install_hugepages(self, _call, _check_call, _host_facts):
+        _host_facts.return_value = HostFacts(
+            facts={'memory_total': 10000000 * 1024})
         self.test_config.set('hugepages', '10%')
-        _virt_mem.side_effect = mem
         _call.return_value = 1
         utils.install_hugepages()
         self.hugepage_support.assert_called_with(
@@ -783,11 +884,9 @@ class NovaComputeUtilsTests(CharmTestCase):
         self.Fstab.remove_by_mountpoint.assert_called_with(
             '/run/hugepages/kvm')
 
-    @patch('psutil.virtual_memory')
     @patch('subprocess.check_call')
     @patch('subprocess.call')
-    def test_install_hugepages_explicit_size(self, _call, _check_call,
-                                             _virt_mem):
+    def test_install_hugepages_explicit_size(self, _call, _check_call):
         self.test_config.set('hugepages', '2048')
         utils.install_hugepages()
         self.hugepage_support.assert_called_with(
@@ -799,6 +898,32 @@ class NovaComputeUtilsTests(CharmTestCase):
             set_shmmax=True,
         )
 
+    @patch('subprocess.check_call')
+    @patch.object(utils.os, 'unlink')
+    @patch.object(utils.os.path, 'exists')
+    @patch.object(utils, 'install_hugepages_spec')
+    @patch.object(utils, 'hugepage_allocation')
+    def test_install_hugepages_spec(self, hugepage_allocation,
+                                    install_hugepages_spec, exists, unlink,
+                                    _check_call):
+        self.test_config.set('hugepages', '1G:4;2M:100@node0')
+        hugepage_allocation.return_value = {1048576: {0: 2, 1: 2},
+                                            2048: {0: 100, 1: 0}}
+        exists.return_value = False
+        self.assertEqual(utils.get_hugepage_number(), 100)
+        utils.install_hugepages()
+        install_hugepages_spec.assert_called_once_with('1G:4;2M:100@node0')
+        self.assertFalse(self.hugepage_support.called)
+        self.assertFalse(_check_call.called)
+        self.assertFalse(unlink.called)
+
+        # a plain count was installed before
+        exists.return_value = True
+        utils.install_hugepages()
+        _check_call.assert_called_once_with(
+            ['update-rc.d', '-f', 'qemu-hugefsdir', 'remove'])
+        unlink.assert_called_once_with(utils.QEMU_HUGEFSDIR)
+
     @patch.object(utils, 'is_unit_paused_set')
     @patch.object(utils, 'services')
     def test_assess_status(self, services, mock_is_paused):
@@ -833,6 +958,118 @@ class NovaComputeUtilsTests(CharmTestCase):
                 utils.VERSION_PACKAGE
             )
 
+    @patch.object(utils.time, 'time')
+    @patch.object(utils, 'status_set')
+    @patch.object(utils, 'status_get')
+    @patch.object(utils, 'installed_versions')
+    @patch.object(utils, 'service_states')
+    @patch.object(utils, 'status_relations')
+    @patch.object(utils, 'hook_name')
+    @patch.object(utils, 'is_unit_paused_set')
+    @patch.object(utils, 'services')
+    @patch.object(utils, 'assess_status_func')
+    def test_assess_status_fast_path(self, asf, services, mock_is_paused,
+                                     hook_name, status_relations,
+                                     service_states,
+                                     installed_versions, status_get,
+                                     status_set, _time):
+        self.kv.return_value = self.test_kv = TestKV()
+        services.return_value = ['nova-compute']
+        mock_is_paused.return_value = False
+        hook_name.return_value = 'update-status'
+        status_relations.return_value = {'amqp': {'amqp:1': {
+            'rabbitmq-server/0': {'password': 'secret'}}}}
+        service_states.return_value = {'nova-compute': {
+            'running': True, 'main_pid': 1234}}
+        installed_versions.return_value = {'nova-common': '2:21.0.0',
+                                           'vaultlocker': None}
+        status_get.return_value = ('active', 'Unit is ready')
+        _time.return_value = 1000
+
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 1)
+        self.assertEqual(
+            self.test_kv.get(utils.ASSESS_STATUS_KEY)['status'],
+            ['active', 'Unit is ready'])
+
+        # nothing changed, the status is published again
+        _time.return_value = 1300
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 1)
+        self.assertEqual(self.os_application_version_set.call_count, 1)
+        status_set.assert_called_once_with('active', 'Unit is ready')
+        service_states.assert_called_with(['nova-compute'], refresh=True)
+
+        # a restarted service
+        service_states.return_value = {'nova-compute': {
+            'running': True, 'main_pid': 4321}}
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 2)
+
+        # changed relation data
+        status_relations.return_value['amqp']['amqp:1'][
+            'rabbitmq-server/0']['password'] = 'changed'
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 3)
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 3)
+
+        # a forced full assessment once the interval passed
+        _time.return_value = 1300 + utils.ASSESS_STATUS_INTERVAL
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 4)
+
+        # any other hook assesses the unit fully and drops the fingerprint
+        hook_name.return_value = 'config-changed'
+        utils.assess_status('test-config')
+        self.assertEqual(asf.call_count, 5)
+        self.assertIsNone(self.test_kv.get(utils.ASSESS_STATUS_KEY))
+
+    @patch.object(utils, 'relation_snapshot')
+    @patch.object(utils, 'get_optional_relations')
+    def test_status_relations(self, get_optional_relations,
+                              relation_snapshot):
+        get_optional_relations.return_value = {
+            'neutron-plugin': ['neutron-plugin']}
+        self.relation_ids.side_effect = lambda name: {
+            'amqp': ['amqp:1'], 'cloud-compute': ['cloud-compute:2'],
+            'neutron-plugin': ['neutron-plugin:3']}.get(name, [])
+        self.related_units.side_effect = lambda rid: {
+            'amqp:1': ['rabbitmq-server/0'],
+            'neutron-plugin:3': ['neutron-openvswitch/0']}.get(rid, [])
+        relation_snapshot.return_value.bag.side_effect = (
+            lambda rid, unit: {'rid': rid})
+        self.assertEqual(utils.status_relations(), {
+            'amqp': {'amqp:1': {'rabbitmq-server/0': {'rid': 'amqp:1'}}},
+            'image-service': {},
+            'cloud-compute': {'cloud-compute:2': {}},
+            'neutron-plugin': {'neutron-plugin:3': {
+                'neutron-openvswitch/0': {'rid': 'neutron-plugin:3'}}}})
+        # only the relations the status checks are read
+        self.assertEqual(
+            sorted(c[0][0] for c in self.relation_ids.call_args_list),
+            ['amqp', 'cloud-compute', 'image-service', 'neutron-plugin'])
+
+    @patch.object(utils, 'hook_name')
+    @patch.object(utils, 'is_unit_paused_set')
+    @patch.object(utils, 'services')
+    @patch.object(utils, 'assess_status_func')
+    def test_assess_status_drops_fingerprint(self, asf, services,
+                                             mock_is_paused, hook_name):
+        services.return_value = ['nova-compute']
+        mock_is_paused.return_value = False
+        hook_name.return_value = 'config-changed'
+        path = self.path('unit-state.db')
+        db = unitdata.Storage(path)
+        db.set(utils.ASSESS_STATUS_KEY, {'fingerprint': 'abc'})
+        db.flush()
+        self.kv.return_value = db
+        utils.assess_status('test-config')
+        db.close()
+        db = unitdata.Storage(path)
+        self.addCleanup(db.close)
+        self.assertIsNone(db.get(utils.ASSESS_STATUS_KEY))
+
     @patch.object(utils, 'REQUIRED_INTERFACES')
     @patch.object(utils, 'services')
     @patch.object(utils, 'make_assess_status_func')
@@ -852,7 +1089,26 @@ class NovaComputeUtilsTests(CharmTestCase):
         utils.assess_status_func('test-config')
         # ports=None whilst port checks are disabled.
         make_assess_status_func.assert_called_once_with(
-            'test-config', test_interfaces, services=['s1'], ports=None)
+            'test-config', test_interfaces,
+            charm_func=utils.check_cpu_isolation, services=['s1'], ports=None)
+
+    @patch.object(utils, 'reboot_required')
+    @patch.object(utils, 'host_facts')
+    def test_check_cpu_isolation(self, host_facts, reboot_required):
+        host_facts.return_value.is_container = False
+        self.assertEqual(utils.check_cpu_isolation('configs'), (None, None))
+        self.test_config.set('isolate-dedicated-cpus', True)
+        self.assertEqual(utils.check_cpu_isolation('configs'), (
+            'blocked', 'Invalid CPU isolation: isolate-dedicated-cpus needs '
+                       'cpu-dedicated-set'))
+        self.test_config.set('cpu-dedicated-set', '2-7')
+        self.test_config.set('cpu-shared-set', '0-1')
+        reboot_required.return_value = True
+        self.assertEqual(utils.check_cpu_isolation('configs'), (
+            'blocked', 'Reboot required to isolate CPUs 2-7'))
+        reboot_required.assert_called_with([2, 3, 4, 5, 6, 7])
+        reboot_required.return_value = False
+        self.assertEqual(utils.check_cpu_isolation('configs'), (None, None))
 
     def test_pause_unit_helper(self):
         with patch.object(utils, '_pause_resume_helper') as prh:
@@ -1141,3 +1397,23 @@ class NovaComputeUtilsTests(CharmTestCase):
         self.assertEquals(utils.use_fqdn_hint(), False)
         _kv().get.return_value = True
         self.assertEquals(utils.use_fqdn_hint(), True)
+
+    @patch.object(utils.time, 'time')
+    def test_compact_unit_state(self, _time):
+        self.test_kv.compact = MagicMock(return_value=(4096, 1024))
+        _time.return_value = 100000
+        utils.compact_unit_state()
+        self.test_kv.compact.assert_called_once_with(
+            max_revisions=10, max_hooks=5000, max_age=2592000)
+        self.assertEqual(self.test_kv.get(utils.UNIT_STATE_COMPACTED_KEY),
+                         100000)
+        self.assertTrue(self.test_kv.flushed)
+        self.log.assert_called_with(
+            'Compacted unit state database from 4096 to 1024 bytes',
+            level=utils.INFO)
+        # at most once a day
+        _time.return_value = 100000 + 3600
+        utils.compact_unit_state()
+        _time.return_value = 100000 + 86400
+        utils.compact_unit_state()
+        self.assertEqual(self.test_kv.compact.call_count, 2)
@@ -0,0 +1,132 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from mock import patch
+
+from test_utils import CharmTestCase
+
+from charmhelpers.fetch import ubuntu_apt_pkg
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'dpkg')
+
+# (status, version, architecture) indexed from each fixture
+EXPECTED_INDEX = {
+    'status.basic': {
+        'nova-common': ('ii', '2:21.0.0-0ubuntu0.20.04.1', 'all'),
+        'nova-common:all': ('ii', '2:21.0.0-0ubuntu0.20.04.1', 'all'),
+        'ceph-common': ('hi', '15.2.1-0ubuntu1', 'amd64'),
+        'ceph-common:amd64': ('hi', '15.2.1-0ubuntu1', 'amd64'),
+        'python-nova': ('rc', '2:17.0.13-0ubuntu1', 'all'),
+        'python-nova:all': ('rc', '2:17.0.13-0ubuntu1', 'all'),
+        'libvirt0': ('iF', '6.0.0-0ubuntu8', 'amd64'),
+        'libvirt0:amd64': ('iF', '6.0.0-0ubuntu8', 'amd64'),
+        'libc6': ('ii', '2.31-0ubuntu9', 'amd64'),
+        'libc6:i386': ('ii', '2.31-0ubuntu9', 'i386'),
+        'libc6:amd64': ('ii', '2.31-0ubuntu9', 'amd64'),
+        'qemu-utils': ('pn', None, 'amd64'),
+        'qemu-utils:amd64': ('pn', None, 'amd64'),
+        'vaultlocker': ('iHR', '1.0.6-0ubuntu0.20.04.1', 'all'),
+        'vaultlocker:all': ('iHR', '1.0.6-0ubuntu0.20.04.1', 'all'),
+    },
+    'status.no-trailing-newline': {
+        'libvirt-daemon': ('ii', '6.0.0-0ubuntu8', 'amd64'),
+        'libvirt-daemon:amd64': ('ii', '6.0.0-0ubuntu8', 'amd64'),
+    },
+    'status.empty': {},
+}
+
+
+class DpkgStatusTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(DpkgStatusTestCase, self).setUp(ubuntu_apt_pkg, ['subprocess'])
+        self.subprocess.CalledProcessError = ValueError
+        self.status = os.path.join(FIXTURES, 'status.basic')
+        for name, value in (('DPKG_STATUS', self.status),
+                            ('_dpkg_status', None)):
+            patcher = patch.object(ubuntu_apt_pkg, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_dpkg_status_index(self):
+        for fixture, expected in EXPECTED_INDEX.items():
+            index = ubuntu_apt_pkg.dpkg_status_index(
+                os.path.join(FIXTURES, fixture))
+            self.assertEqual(
+                {name: (p['status'], p['version'], p['architecture'])
+                 for name, p in index.items()},
+                expected, fixture)
+
+    def test_parse_dpkg_status_multiline_fields(self):
+        with open(self.status) as f:
+            stanza = next(ubuntu_apt_pkg.parse_dpkg_status(f))
+        self.assertEqual(stanza, {
+            'package': 'nova-common',
+            'status': 'install ok installed',
+            'architecture': 'all',
+            'version': '2:21.0.0-0ubuntu0.20.04.1',
+            'description': 'OpenStack Compute - common files'})
+
+    def test_dpkg_status_abbrev(self):
+        self.assertEqual(
+            ubuntu_apt_pkg.dpkg_status_abbrev('install ok installed'), 'ii')
+        self.assertEqual(
+            ubuntu_apt_pkg.dpkg_status_abbrev('deinstall ok config-files'),
+            'rc')
+        self.assertEqual(ubuntu_apt_pkg.dpkg_status_abbrev(''), '')
+
+    def test_cache_installed(self):
+        cache = ubuntu_apt_pkg.Cache()
+        pkg = cache['nova-common']
+        self.assertEqual(pkg.name, 'nova-common')
+        self.assertEqual(pkg.current_ver.ver_str,
+                         '2:21.0.0-0ubuntu0.20.04.1')
+        self.assertEqual(pkg.architecture, 'all')
+        self.assertTrue('libc6:i386' in cache)
+        self.assertFalse(self.subprocess.check_output.called)
+        self.assertEqual(
+            sorted(cache._dpkg_list(
+                ['nova-common', 'ceph-common', 'libvirt0', 'bogus'])),
+            ['nova-common'])
+
+    def test_cache_not_installed(self):
+        self.subprocess.check_output.return_value = (
+            'Package: python-nova\n'
+            'Version: 2:17.0.13-0ubuntu1\n'
+            'Architecture: all\n\n')
+        pkg = ubuntu_apt_pkg.Cache()['python-nova']
+        self.assertEqual(pkg.name, 'python-nova')
+        self.assertEqual(pkg.version, '2:17.0.13-0ubuntu1')
+        self.assertIsNone(pkg.current_ver)
+        self.subprocess.check_output.assert_called_once_with(
+            ['apt-cache', 'show', '--no-all-versions', 'python-nova'],
+            stderr=self.subprocess.STDOUT, universal_newlines=True)
+
+    def test_cache_reindexed_on_change(self):
+        cache = ubuntu_apt_pkg.Cache()
+        self.assertTrue('nova-common' in cache)
+        with patch.object(ubuntu_apt_pkg, 'DPKG_STATUS',
+                          os.path.join(FIXTURES, 'status.empty')):
+            self.assertEqual(cache._dpkg_list(['nova-common']), {})
+
+    @patch.object(ubuntu_apt_pkg.Cache, '_dpkg_query_list')
+    def test_cache_without_status_file(self, _dpkg_query_list):
+        _dpkg_query_list.return_value = {}
+        with patch.object(ubuntu_apt_pkg, 'DPKG_STATUS',
+                          os.path.join(FIXTURES, 'missing')):
+            self.assertEqual(
+                ubuntu_apt_pkg.Cache()._dpkg_list(['nova-common']), {})
+        _dpkg_query_list.assert_called_once_with(['nova-common'])
@@ -16,6 +16,8 @@ import io
 import logging
 import unittest
 import os
+import shutil
+import tempfile
 import yaml
 
 from contextlib import contextmanager
@@ -84,6 +86,30 @@ class CharmTestCase(unittest.TestCase):
             setattr(self, method, self.patch(method))
 
 
+class ScratchDirTestCase(CharmTestCase):
+    '''CharmTestCase with a scratch directory, self.root, for the files a
+    test reads and writes; it is removed once the test ends.'''
+
+    def setUp(self, obj, patches):
+        super(ScratchDirTestCase, self).setUp(obj, patches)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, content):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read().strip()
+
+
 class TestConfig(object):
 
     def __init__(self):
@@ -135,6 +161,9 @@ class TestKV(dict):
     def set(self, attribute, value):
         self.data[attribute] = value
 
+    def unset(self, attribute):
+        self.data.pop(attribute, None)
+
     def flush(self):
         self.flushed = True
 